@@ -7,31 +7,51 @@ __license__ = "MIT"
 # ---------------------------------------------------------------------
 
 import os
+import sys
+import json
+import types
 import pathlib
-import tensorflow as tf
+import functools
+import importlib
 from typing import Union
 
 # ---------------------------------------------------------------------
 # local imports
 # ---------------------------------------------------------------------
 
-from .train_loop import train_loop
-from .export_model_denoise import export_model
-from .model_denoise import model_builder
-from .utilities import \
-    logger, load_config, load_image
-from .pyramid import \
-    build_pyramid_model, \
-    build_inverse_pyramid_model
-from .optimizer import \
-    schedule_builder, \
-    optimizer_builder
-from .custom_layers import \
-    GeluLayer, \
-    RandomOnOff, \
-    Multiplier, \
-    DifferentiableReluLayer, \
-    ChannelwiseMultiplier
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+# tensorflow and the heavy submodules are imported on first use,
+# so importing the package (and the inference tools) stays fast
+# ---------------------------------------------------------------------
+
+_LAZY_ATTRIBUTES = {
+    "train_loop": ".train_loop",
+    "export_model": ".export_model_denoise",
+    "model_builder": ".model_denoise",
+    "load_config": ".utilities",
+    "load_image": ".utilities",
+    "build_pyramid_model": ".pyramid",
+    "build_inverse_pyramid_model": ".pyramid",
+    "receptive_field": ".receptive_field",
+    "bucketed_inference": ".batching",
+    "bucketed_denoiser_builder": ".batching",
+    "tiled_inference": ".tiling",
+    "tiled_denoiser_builder": ".tiling",
+    "schedule_builder": ".optimizer",
+    "optimizer_builder": ".optimizer",
+    "GeluLayer": ".custom_layers",
+    "RandomOnOff": ".custom_layers",
+    "Multiplier": ".custom_layers",
+    "DifferentiableReluLayer": ".custom_layers",
+    "ChannelwiseMultiplier": ".custom_layers",
+    "ModelRegistry": ".registry",
+    "TFLiteRunner": ".tflite_runner",
+    "load_tflite_model": ".tflite_runner",
+    "StreamingDenoiser": ".stream",
+    "denoise_stream": ".stream",
+}
 
 # ---------------------------------------------------------------------
 
@@ -41,10 +61,53 @@ current_dir = pathlib.Path(__file__).parent.resolve()
 
 configs_dir = current_dir / "configs"
 
-configs = [
-    load_config(str(c))
-    for c in configs_dir.glob("*.json")
-]
+
+def _load_configs():
+    configs = []
+    for c in configs_dir.glob("*.json"):
+        with open(str(c), "r") as f:
+            configs.append(json.load(f))
+    return configs
+
+# ---------------------------------------------------------------------
+
+
+def __getattr__(name: str):
+    # configs are parsed on first access
+    if name == "configs":
+        value = _load_configs()
+    elif name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+    else:
+        # submodules, bfcnn.dataset etc
+        try:
+            value = importlib.import_module(f".{name}", __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f"{__name__}.{name}":
+                raise
+            raise AttributeError(
+                f"module [{__name__}] has no attribute [{name}]") from None
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_ATTRIBUTES.keys()) + ["configs"])
+
+
+class _LazyPackage(types.ModuleType):
+    # importing a submodule binds it on the package, the functions named
+    # after their submodule (train_loop, receptive_field) must win as they
+    # did when they were imported eagerly
+    def __setattr__(self, name, value):
+        if isinstance(value, types.ModuleType) and \
+                _LAZY_ATTRIBUTES.get(name, None) == f".{name}":
+            return
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyPackage
 
 # ---------------------------------------------------------------------
 
@@ -52,6 +115,45 @@ pretrained_dir = current_dir / "pretrained"
 
 pretrained_models = {}
 
+# ---------------------------------------------------------------------
+
+
+def load_model(model_path: str):
+    """
+    loads a pretrained model by name or a saved_model from a directory,
+    models are cached and warmed up by the process wide registry
+    so every model is loaded once
+
+    :param model_path: pretrained model name or saved_model directory
+    :return: loaded model
+    """
+    from .registry import default_registry
+
+    # --- argument checking
+    if model_path is None or len(model_path) <= 0:
+        raise ValueError("model_path cannot be empty")
+
+    # --- load from pretrained
+    if model_path in pretrained_models:
+        model_path = pretrained_models[model_path]["saved_model_path"]
+
+    # --- load from any directory
+    if not os.path.exists(model_path):
+        raise ValueError(
+            "model_path [{0}] does not exist".format(model_path))
+
+    return default_registry().get(str(model_path))
+
+# ---------------------------------------------------------------------
+
+
+def _load_tflite(model_name: str, **kwargs):
+    from .tflite_runner import load_tflite_model
+    return load_tflite_model(model_name, **kwargs)
+
+# ---------------------------------------------------------------------
+
+
 # --- populate pretrained_models
 if pretrained_dir.is_dir():
     for directory in \
@@ -59,14 +161,11 @@ if pretrained_dir.is_dir():
         # ---
         model_name = str(directory.name)
 
-        # --- define model loader function
-        def load_tf():
-            saved_model_path = str(directory / "saved_model")
-            return tf.saved_model.load(saved_model_path)
-
         # --- define structure for each model
         pretrained_models[model_name] = {
-            "load_tf": load_tf,
+            # bound to the name, not to the loop variable
+            "load_tf": functools.partial(load_model, model_name),
+            "load_tflite": functools.partial(_load_tflite, model_name),
             "directory": directory,
             "tflite": str(directory / "model.tflite"),
             "configuration": str(directory / "pipeline.json"),
@@ -80,39 +179,28 @@ else:
 # ---------------------------------------------------------------------
 
 
-def load_model(model_path: str):
-    # --- argument checking
-    if model_path is None or len(model_path) <= 0:
-        raise ValueError("model_path cannot be empty")
-
-    # --- load from pretrained
-    if model_path in pretrained_models:
-        return \
-            tf.saved_model.load(
-                pretrained_models[model_path]["saved_model_path"])
-
-    # --- load from any directory
-    if not os.path.exists(model_path):
-        raise ValueError(
-            "model_path [{0}] does not exist".format(model_path))
-
-    return tf.saved_model.load(str(model_path))
-
-# ---------------------------------------------------------------------
-
-
 __all__ = [
-    configs,
-    train_loop,
-    load_model,
-    load_image,
-    export_model,
-    model_builder,
-    schedule_builder,
-    optimizer_builder,
-    pretrained_models,
-    build_pyramid_model,
-    build_inverse_pyramid_model
+    "configs",
+    "train_loop",
+    "load_model",
+    "load_image",
+    "ModelRegistry",
+    "TFLiteRunner",
+    "load_tflite_model",
+    "denoise_stream",
+    "StreamingDenoiser",
+    "export_model",
+    "model_builder",
+    "receptive_field",
+    "schedule_builder",
+    "optimizer_builder",
+    "tiled_inference",
+    "pretrained_models",
+    "bucketed_inference",
+    "build_pyramid_model",
+    "tiled_denoiser_builder",
+    "bucketed_denoiser_builder",
+    "build_inverse_pyramid_model"
 ]
 
 
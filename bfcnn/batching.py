@@ -0,0 +1,296 @@
+r"""shape-bucketed batching with padding for mixed image sizes"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import time
+import numpy as np
+from typing import Dict, List, Tuple, Callable
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+from .tiling import alignment_from_config
+
+# ---------------------------------------------------------------------
+
+DEFAULT_BATCH_SIZE = 8
+DEFAULT_MAX_PADDING = 0.1
+DEFAULT_BUCKET_GRANULARITY = 16
+
+# ---------------------------------------------------------------------
+
+
+def bucket_shape(
+        height: int,
+        width: int,
+        multiple: int = 1,
+        granularity: int = DEFAULT_BUCKET_GRANULARITY) -> Tuple[int, int]:
+    """
+    rounds an image size up to its bucket
+
+    :param height: image height
+    :param width: image width
+    :param multiple: required multiple of the model (2 ** (levels - 1))
+    :param granularity: bucket step in pixels, rounded up to the multiple
+    :return: bucket (height, width)
+    """
+    # --- argument checking
+    if height <= 0 or width <= 0:
+        raise ValueError("height and width must be > 0")
+    if multiple <= 0:
+        raise ValueError("multiple must be > 0")
+    if granularity <= 0:
+        raise ValueError("granularity must be > 0")
+
+    step = int(np.ceil(granularity / multiple)) * multiple
+    return \
+        int(np.ceil(height / step)) * step, \
+        int(np.ceil(width / step)) * step
+
+# ---------------------------------------------------------------------
+
+
+def pad_to_shape(
+        image: np.ndarray,
+        height: int,
+        width: int) -> np.ndarray:
+    """
+    reflect pad an [H, W, C] image at the bottom/right to height x width
+
+    :param image: image to pad
+    :param height: target height
+    :param width: target width
+    :return: padded image
+    """
+    pad_h = height - image.shape[0]
+    pad_w = width - image.shape[1]
+    if pad_h < 0 or pad_w < 0:
+        raise ValueError("target shape must be larger than the image")
+    if pad_h == 0 and pad_w == 0:
+        return image
+    # reflect needs the padding to be smaller than the image
+    mode = "reflect"
+    if pad_h >= image.shape[0] or pad_w >= image.shape[1]:
+        mode = "symmetric"
+    return np.pad(
+        image,
+        pad_width=((0, pad_h), (0, pad_w), (0, 0)),
+        mode=mode)
+
+# ---------------------------------------------------------------------
+
+
+def bucketed_inference(
+        model_fn: Callable,
+        images: List[np.ndarray],
+        multiple: int = 1,
+        granularity: int = DEFAULT_BUCKET_GRANULARITY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_padding: float = DEFAULT_MAX_PADDING) -> List[np.ndarray]:
+    """
+    denoise a list of images of mixed sizes, images are bucketed by size,
+    reflect padded into a single batch per bucket and cropped back
+
+    sizes are rounded up to the granularity, then neighbouring buckets are
+    merged greedily as long as padding every image to the largest real
+    height and width stays within max_padding of the real pixels, images
+    of the same size always share a call
+
+    :param model_fn: callable that maps a uint8 [B, H, W, C] batch
+        to a [B, H, W, C] batch
+    :param images: list of [H, W, C] images
+    :param multiple: required multiple of the model (2 ** (levels - 1))
+    :param granularity: bucket step in pixels
+    :param batch_size: maximum images per call
+    :param max_padding: maximum ratio of padded to real pixels per batch
+    :return: list of denoised images in the same order as the input
+    """
+    # --- argument checking
+    if model_fn is None:
+        raise ValueError("model_fn cannot be None")
+    if images is None:
+        raise ValueError("images cannot be None")
+    if batch_size <= 0:
+        raise ValueError("batch_size must be > 0")
+    if max_padding < 0:
+        raise ValueError("max_padding must be >= 0")
+
+    # --- round every image up to its bucket
+    shapes = []
+    for image in images:
+        if len(image.shape) != 3:
+            raise ValueError("images must be [H, W, C]")
+        h, w = \
+            bucket_shape(
+                height=image.shape[0],
+                width=image.shape[1],
+                multiple=multiple,
+                granularity=granularity)
+        shapes.append((h, w, image.shape[2]))
+
+    # --- greedily merge sorted buckets within the padding budget,
+    # the budget is measured on the real sizes so the granularity
+    # rounding alone never splits images of the same bucket
+    batches = []
+    order = sorted(range(len(images)), key=lambda i: shapes[i])
+    for i in order:
+        h, w, c = shapes[i]
+        image_h, image_w = images[i].shape[0], images[i].shape[1]
+        area = image_h * image_w
+        if len(batches) > 0:
+            batch = batches[-1]
+            batch_image_h = max(batch["image_height"], image_h)
+            batch_image_w = max(batch["image_width"], image_w)
+            batch_area = batch["area"] + area
+            n = len(batch["indices"]) + 1
+            fits = \
+                batch["channels"] == c and \
+                n <= batch_size and \
+                batch_image_h * batch_image_w * n <= \
+                (1.0 + max_padding) * batch_area
+            if fits:
+                batch["indices"].append(i)
+                batch["height"] = max(batch["height"], h)
+                batch["width"] = max(batch["width"], w)
+                batch["image_height"] = batch_image_h
+                batch["image_width"] = batch_image_w
+                batch["area"] = batch_area
+                continue
+        batches.append({
+            "indices": [i],
+            "height": h,
+            "width": w,
+            "image_height": image_h,
+            "image_width": image_w,
+            "channels": c,
+            "area": area
+        })
+
+    logger.debug(
+        f"[{len(images)}] images in [{len(batches)}] batches")
+
+    # --- run a single call per batch
+    results = [None] * len(images)
+    for batch in batches:
+        h, w = batch["height"], batch["width"]
+        x = np.stack([
+            pad_to_shape(images[j], h, w)
+            for j in batch["indices"]
+        ], axis=0)
+        batch_results = np.asarray(model_fn(x))
+        for k, j in enumerate(batch["indices"]):
+            results[j] = \
+                batch_results[k,
+                              :images[j].shape[0],
+                              :images[j].shape[1],
+                              :]
+    return results
+
+# ---------------------------------------------------------------------
+
+
+def bucketed_denoiser_builder(
+        model_fn: Callable,
+        config: Dict = None,
+        granularity: int = DEFAULT_BUCKET_GRANULARITY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_padding: float = DEFAULT_MAX_PADDING) -> Callable[[List[np.ndarray]], List[np.ndarray]]:
+    """
+    wraps a denoiser into a bucketed denoiser for lists of mixed size images,
+    the required multiple is derived from the configuration
+
+    :param model_fn: callable that maps a uint8 [B, H, W, C] batch
+    :param config: pipeline or model_denoise configuration
+    :param granularity: bucket step in pixels
+    :param batch_size: maximum images per call
+    :param max_padding: maximum ratio of padded to real pixels per batch
+    :return: callable that denoises a list of images
+    """
+    multiple = 1
+    if config is not None:
+        multiple = alignment_from_config(config)
+
+    logger.info(
+        f"building bucketed denoiser with "
+        f"multiple:{multiple}, "
+        f"granularity:{granularity}, "
+        f"batch_size:{batch_size}")
+
+    def fn(images: List[np.ndarray]) -> List[np.ndarray]:
+        return \
+            bucketed_inference(
+                model_fn=model_fn,
+                images=images,
+                multiple=multiple,
+                granularity=granularity,
+                batch_size=batch_size,
+                max_padding=max_padding)
+
+    return fn
+
+# ---------------------------------------------------------------------
+
+
+def benchmark_bucketed_inference(
+        model_fn: Callable,
+        images: List[np.ndarray],
+        multiple: int = 1,
+        granularity: int = DEFAULT_BUCKET_GRANULARITY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_padding: float = DEFAULT_MAX_PADDING) -> Dict:
+    """
+    compares images per second of the per-image loop
+    against the bucketed batches
+
+    :param model_fn: callable that maps a uint8 [B, H, W, C] batch
+    :param images: list of [H, W, C] images
+    :param multiple: required multiple of the model (2 ** (levels - 1))
+    :param granularity: bucket step in pixels
+    :param batch_size: maximum images per call
+    :param max_padding: maximum ratio of padded to real pixels per batch
+    :return: dictionary with images per second for each mode
+    """
+    # --- per image loop, padded only to the required multiple
+    start_time = time.time()
+    for image in images:
+        h, w = \
+            bucket_shape(
+                height=image.shape[0],
+                width=image.shape[1],
+                multiple=multiple,
+                granularity=multiple)
+        x = pad_to_shape(image, h, w)
+        _ = np.asarray(model_fn(np.expand_dims(x, axis=0)))
+    per_image_time = time.time() - start_time
+
+    # --- bucketed
+    start_time = time.time()
+    _ = bucketed_inference(
+        model_fn=model_fn,
+        images=images,
+        multiple=multiple,
+        granularity=granularity,
+        batch_size=batch_size,
+        max_padding=max_padding)
+    bucketed_time = time.time() - start_time
+
+    result = {
+        "images": len(images),
+        "per_image_images_per_s": len(images) / max(per_image_time, 1e-6),
+        "bucketed_images_per_s": len(images) / max(bucketed_time, 1e-6)
+    }
+    result["speedup"] = \
+        result["bucketed_images_per_s"] / \
+        max(result["per_image_images_per_s"], 1e-6)
+    logger.info(f"bucketed inference benchmark: {result}")
+    return result
+
+# ---------------------------------------------------------------------
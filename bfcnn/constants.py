@@ -3,6 +3,7 @@ EPSILON_DEFAULT = 0.0001
 TYPE_STR = "type"
 CONFIG_STR = "config"
 MODEL_DENOISE_STR = "model_denoise"
+RECEPTIVE_FIELD_STR = "receptive_field"
 MODEL_DISCRIMINATE_STR = "model_discriminate"
 MODEL_DENOISE_DEFAULT_NAME_STR = "model_denoise.h5"
 MODEL_DISCRIMINATE_DEFAULT_NAME_STR = "model_discriminate.h5"
@@ -1,5 +1,4 @@
 import tensorflow as tf
-from tensorflow import keras
 import tensorflow_addons as tfa
 from typing import Dict, Callable, Iterator
 
@@ -8,24 +7,51 @@ from typing import Dict, Callable, Iterator
 # ---------------------------------------------------------------------
 
 from .custom_logger import logger
-from .utilities import merge_iterators, random_choice
+from .utilities import merge_iterators
+from .preprocess import \
+    shards_dataset, \
+    load_shards_metadata, \
+    COLOR_MODE_CHANNELS
+from .dataset_cache import DatasetCache
+from .patch_sampler import patches_dataset
 
 # ---------------------------------------------------------------------
 
 DATASET_FN_STR = "dataset"
 AUGMENTATION_FN_STR = "augmentation"
 DATASET_TESTING_FN_STR = "dataset_testing"
+DATASET_CACHE_STR = "dataset_cache"
 
 
 # ---------------------------------------------------------------------
 
 
 def dataset_builder(
-        config: Dict):
+        config: Dict,
+        input_context: tf.distribute.InputContext = None):
+    """
+    builds the training dataset and the noise augmentation
+
+    :param config: dataset configuration
+    :param input_context: distributed input pipeline, batch_size is the
+        global batch size, every pipeline gets its own shard of batches
+        with the per replica batch size
+    :return: dictionary with the dataset and augmentation function
+    """
     # ---
     logger.info("creating dataset_builder with configuration [{0}]".format(config))
     # --- argument parsing
     batch_size = config["batch_size"]
+    # shuffling seed, pipelines must agree on the order to shard it
+    seed = config.get("seed", None)
+    no_pipelines = 1
+    pipeline_id = 0
+    if input_context is not None:
+        batch_size = input_context.get_per_replica_batch_size(batch_size)
+        no_pipelines = input_context.num_input_pipelines
+        pipeline_id = input_context.input_pipeline_id
+        if no_pipelines > 1 and seed is None:
+            seed = 0
     # crop image from dataset
     input_shape = config["input_shape"]
     color_mode = config.get("color_mode", "rgb")
@@ -33,25 +59,52 @@ def dataset_builder(
     inputs = config["inputs"]
     # directory to load data from
     directory = []
+    # preprocessed shards to load data from (see preprocess.py)
+    shards = []
     # resolution of the files loaded (reshape)
     dataset_shape = []
+    # native resolution patches per decoded image instead of
+    # resizing the whole image (see patch_sampler.py)
+    patches_per_image = []
     if isinstance(inputs, list):
         for i in inputs:
             directory.append(i.get("directory", None))
+            shards.append(i.get("shards", None))
             dataset_shape.append(i.get("dataset_shape", [256, 256]))
+            patches_per_image.append(i.get("patches_per_image", None))
     elif isinstance(inputs, dict):
         directory.append(config.get("directory", None))
+        shards.append(config.get("shards", None))
         dataset_shape.append(config.get("dataset_shape", [256, 256]))
+        patches_per_image.append(config.get("patches_per_image", None))
     else:
         raise ValueError("dont know how to handle anything else than list and dict")
+    # shards are stored already resized
+    for i, s in enumerate(shards):
+        if s is not None:
+            dataset_shape[i] = load_shards_metadata(s)["shape"][0:2]
+    # patches are sampled with the input shape
+    for i, k in enumerate(patches_per_image):
+        if k is not None:
+            dataset_shape[i] = input_shape[0:2]
+    shuffle_buffer_size = config.get("shuffle_buffer_size", batch_size * 8)
+    # keep decoded images of directory inputs between epochs
+    cache = None
+    if config.get("cache", None) is not None:
+        cache = DatasetCache(config["cache"])
+    # synthesize the noise in the input pipeline and produce
+    # (clean, noisy) pairs instead of clean batches
+    noise_in_pipeline = config.get("noise_in_pipeline", False)
+    # batches prefetched, -1 to autotune
+    prefetch_buffer_size = config.get("prefetch_buffer_size", 2)
     # --- clip values to min max
     min_value = config.get("min_value", 0)
     max_value = config.get("max_value", 255)
-    clip_value = tf.constant(config.get("clip_value", True))
+    clip_value = config.get("clip_value", True)
     # --- if true round values
-    round_values = tf.constant(config.get("round_values", True))
+    round_values = config.get("round_values", True)
     # --- dataset augmentation
-    random_blur = tf.constant(config.get("random_blur", False))
+    random_blur = config.get("random_blur", False)
     subsample_size = config.get("subsample_size", -1)
     # in radians
     random_rotate = tf.constant(config.get("random_rotate", 0.0))
@@ -64,53 +117,79 @@ def dataset_builder(
     additional_noise = config.get("additional_noise", [])
     multiplicative_noise = config.get("multiplicative_noise", [])
     # quantization value, -1 disabled, otherwise 2, 4, 8
-    quantization = tf.constant(config.get("quantization", -1))
+    quantization = config.get("quantization", -1)
     # whether to crop or not
-    random_crop = dataset_shape[0][0:2] != input_shape[0:2]
+    random_crop = any([s[0:2] != input_shape[0:2] for s in dataset_shape])
     random_crop = tf.constant(random_crop)
 
-    # build noise options
+    # build noise options, only the enabled ones end up in the graph
     noise_choices = []
     if len(additional_noise) > 0:
         noise_choices.append(0)
-    else:
-        additional_noise = [1.0]
-
     if len(multiplicative_noise) > 0:
         noise_choices.append(1)
-    else:
-        multiplicative_noise = [1.0]
-
     if subsample_size > 0:
         noise_choices.append(2)
-    else:
-        subsample_size = 2
-
     if quantization > 1:
         noise_choices.append(3)
-    else:
-        quantization = 1
-
-    noise_choices = tf.constant(noise_choices)
-    additional_noise = tf.constant(additional_noise, dtype=tf.float32)
-    multiplicative_noise = tf.constant(multiplicative_noise, dtype=tf.float32)
-
-    # --- define generator function from directory
-    if directory:
-        dataset = [
-            tf.keras.preprocessing.image_dataset_from_directory(
-                directory=d,
-                image_size=s,
-                shuffle=True,
-                label_mode=None,
-                batch_size=batch_size,
-                color_mode=color_mode,
-                interpolation="bilinear")
-            for d, s in zip(directory, dataset_shape)
-        ]
 
-    else:
-        raise ValueError("don't know how to handle non directory datasets")
+    # --- define generator function from directory or shards,
+    # every input pipeline keeps its own part of each input
+    dataset = []
+    for d, s, sh, k in zip(directory, dataset_shape, shards, patches_per_image):
+        if sh is not None:
+            source = \
+                shards_dataset(
+                    directory=sh,
+                    channels=COLOR_MODE_CHANNELS[color_mode],
+                    shuffle=True,
+                    shuffle_buffer_size=shuffle_buffer_size,
+                    seed=seed,
+                    no_pipelines=no_pipelines,
+                    pipeline_id=pipeline_id).batch(batch_size)
+        elif d is not None and k is not None:
+            source = \
+                patches_dataset(
+                    directory=d,
+                    patch_shape=s,
+                    patches_per_image=k,
+                    channels=COLOR_MODE_CHANNELS[color_mode],
+                    shuffle_buffer_size=shuffle_buffer_size,
+                    seed=seed,
+                    no_pipelines=no_pipelines,
+                    pipeline_id=pipeline_id).batch(batch_size)
+        elif d is not None and cache is not None:
+            # shuffled after the cache so every epoch has its own order
+            source = \
+                cache.directory_dataset(
+                    directory=d,
+                    dataset_shape=s,
+                    channels=COLOR_MODE_CHANNELS[color_mode],
+                    seed=seed,
+                    no_pipelines=no_pipelines,
+                    pipeline_id=pipeline_id) \
+                .shuffle(
+                    buffer_size=shuffle_buffer_size,
+                    seed=seed,
+                    reshuffle_each_iteration=True) \
+                .batch(batch_size) \
+                .map(lambda x: tf.cast(x, dtype=tf.float32))
+        elif d is not None:
+            source = \
+                tf.keras.preprocessing.image_dataset_from_directory(
+                    directory=d,
+                    image_size=s,
+                    shuffle=True,
+                    seed=seed,
+                    label_mode=None,
+                    batch_size=batch_size,
+                    color_mode=color_mode,
+                    interpolation="bilinear")
+            if no_pipelines > 1:
+                source = source.shard(no_pipelines, pipeline_id)
+        else:
+            raise ValueError("don't know how to handle non directory datasets")
+        dataset.append(source)
 
     def input_batch_augmentations(input_batch):
         input_shape_inference = tf.shape(input_batch)
@@ -180,108 +259,182 @@ def dataset_builder(
         return input_batch
 
     # --- define augmentation function
-    def augmentation(input_batch):
-        # --- copy input batch
-        noisy_batch = tf.identity(input_batch)
-        input_shape_inference = tf.shape(noisy_batch)
-
-        # --- random select noise type
-        noise_type = \
-            random_choice(noise_choices, size=1)[0]
-
-        logger.info(f"noise_type: {noise_type}")
+    def seed_stream(seed):
+        # seeds for the stateless random ops of one augmentation call,
+        # folded from the element seed in the order the ops are traced,
+        # without a seed the random ops are stateful
+        counter = [0]
+
+        def next_seed():
+            if seed is None:
+                return None
+            counter[0] += 1
+            return tf.random.experimental.stateless_fold_in(seed, counter[0])
+        return next_seed
+
+    def random_uniform(seeds, **kwargs):
+        seed = seeds()
+        if seed is None:
+            return tf.random.uniform(**kwargs)
+        return tf.random.stateless_uniform(seed=seed, **kwargs)
+
+    def random_truncated_normal(seeds, **kwargs):
+        seed = seeds()
+        if seed is None:
+            return tf.random.truncated_normal(**kwargs)
+        return tf.random.stateless_truncated_normal(seed=seed, **kwargs)
+
+    def per_sample_apply(input_batch, fns, seeds):
+        """
+        applies one of fns to every sample, drawn uniformly per sample,
+        the batch is partitioned so each sample only pays for its own fn
+        """
+        batch_size = tf.shape(input_batch)[0]
+        index = \
+            random_uniform(
+                seeds,
+                shape=(batch_size,),
+                minval=0,
+                maxval=len(fns),
+                dtype=tf.int32)
+        partitions = \
+            tf.dynamic_partition(
+                input_batch,
+                partitions=index,
+                num_partitions=len(fns))
+        indices = \
+            tf.dynamic_partition(
+                tf.range(batch_size),
+                partitions=index,
+                num_partitions=len(fns))
+        return \
+            tf.dynamic_stitch(
+                indices=indices,
+                data=[fn(x, seeds) for fn, x in zip(fns, partitions)])
+
+    def per_sample_choice(values, batch_size, seeds):
+        # one random entry of values per sample, broadcast over the image
+        values = tf.constant(values)
+        index = \
+            random_uniform(
+                seeds,
+                shape=(batch_size, 1, 1, 1),
+                minval=0,
+                maxval=tf.shape(values)[0],
+                dtype=tf.int32)
+        return tf.gather(values, index)
+
+    def gaussian_blur(input_batch, seeds):
+        # separable 3x3 gaussian (sigma 1) with reflect padding,
+        # same as tfa.image.gaussian_filter2d but written with slices
+        # so it also works on an empty partition
+        w = [0.27406862, 0.45186276, 0.27406862]
+        x = \
+            tf.concat([
+                input_batch[:, 1:2, :, :],
+                input_batch,
+                input_batch[:, -2:-1, :, :]
+            ], axis=1)
+        x = w[0] * x[:, :-2, :, :] + w[1] * x[:, 1:-1, :, :] + w[2] * x[:, 2:, :, :]
+        x = \
+            tf.concat([
+                x[:, :, 1:2, :],
+                x,
+                x[:, :, -2:-1, :]
+            ], axis=2)
+        return w[0] * x[:, :, :-2, :] + w[1] * x[:, :, 1:-1, :] + w[2] * x[:, :, 2:, :]
+
+    def no_noise(input_batch, seeds):
+        return input_batch
 
-        if noise_type == 0:
-            # additional noise
-            noise_std = random_choice(additional_noise, size=1)[0]
-            if tf.random.uniform(()) > 0.5:
-                # channel independent noise
-                noisy_batch = \
-                    noisy_batch + \
-                    tf.random.truncated_normal(
-                        mean=0,
-                        stddev=noise_std,
-                        shape=input_shape_inference)
-            else:
-                # channel dependent noise
-                tmp_noisy_batch = \
-                    tf.random.truncated_normal(
+    def random_noise(input_batch, seeds, noise_std, multiplicative: bool):
+        noise_std = [float(n) for n in noise_std]
+
+        def noise_fn(channels: int):
+            def fn(x, fn_seeds):
+                x_shape = tf.shape(x)
+                std = \
+                    per_sample_choice(
+                        noise_std,
+                        batch_size=x_shape[0],
+                        seeds=fn_seeds)
+                noise = \
+                    random_truncated_normal(
+                        fn_seeds,
                         mean=0,
-                        stddev=noise_std,
-                        shape=(input_shape_inference[0],
-                               input_shape[0],
-                               input_shape[1],
-                               1))
-                tmp_noisy_batch = \
-                    tf.repeat(
-                        tmp_noisy_batch,
-                        axis=3,
-                        repeats=[input_shape_inference[3]])
-                noisy_batch = noisy_batch + tmp_noisy_batch
-            # blur to embed noise
-            if random_blur:
-                if tf.random.uniform(()) > 0.5:
-                    noisy_batch = \
-                        tfa.image.gaussian_filter2d(
-                            image=noisy_batch,
-                            sigma=1,
-                            filter_shape=(3, 3))
-        elif noise_type == 1:
-            # multiplicative noise
-            noise_std = \
-                random_choice(multiplicative_noise, size=1)[0]
-            if tf.random.uniform(()) > 0.5:
-                # channel independent noise
-                noisy_batch = \
-                    noisy_batch * \
-                    tf.random.truncated_normal(
-                        mean=1,
-                        stddev=noise_std,
-                        shape=input_shape_inference)
-            else:
-                # channel dependent noise
-                tmp_noisy_batch = \
-                    tf.random.truncated_normal(
-                        mean=1,
-                        stddev=noise_std,
-                        shape=(input_shape_inference[0],
-                               input_shape[0],
-                               input_shape[1],
-                               1))
-                tmp_noisy_batch = \
-                    tf.repeat(
-                        tmp_noisy_batch,
-                        axis=3,
-                        repeats=[input_shape_inference[3]])
-                noisy_batch = noisy_batch * tmp_noisy_batch
-
-            # blur to embed noise
-            if random_blur:
-                if tf.random.uniform(()) > 0.5:
-                    noisy_batch = \
-                        tfa.image.gaussian_filter2d(
-                            image=noisy_batch,
-                            sigma=1,
-                            filter_shape=(3, 3))
-        elif noise_type == 2:
-            # subsample
-            stride = (subsample_size, subsample_size)
+                        stddev=1,
+                        shape=(x_shape[0], x_shape[1], x_shape[2],
+                               x_shape[3] if channels is None else channels))
+                if multiplicative:
+                    return x * (1.0 + std * noise)
+                return x + std * noise
+            return fn
+
+        # channel independent or channel dependent noise
+        noisy_batch = \
+            per_sample_apply(
+                input_batch,
+                fns=[noise_fn(channels=None), noise_fn(channels=1)],
+                seeds=seeds)
+        # blur to embed noise
+        if random_blur:
             noisy_batch = \
-                keras.layers.MaxPool2D(
-                    pool_size=(1, 1),
-                    strides=stride)(noisy_batch)
+                per_sample_apply(
+                    noisy_batch,
+                    fns=[gaussian_blur, no_noise],
+                    seeds=seeds)
+        return noisy_batch
+
+    def subsample(input_batch, seeds):
+        # keep every subsample_size pixel and repeat it back
+        input_shape_inference = tf.shape(input_batch)
+        noisy_batch = \
+            input_batch[:, ::subsample_size, ::subsample_size, :]
+        noisy_batch = \
+            tf.repeat(noisy_batch, repeats=subsample_size, axis=1)
+        noisy_batch = \
+            tf.repeat(noisy_batch, repeats=subsample_size, axis=2)
+        return \
+            noisy_batch[:,
+                        :input_shape_inference[1],
+                        :input_shape_inference[2],
+                        :]
+
+    def quantize(input_batch, seeds):
+        noisy_batch = tf.round(input_batch / quantization)
+        return tf.round(noisy_batch * quantization)
+
+    noise_fns = {
+        0: lambda x, seeds:
+            random_noise(x, seeds, additional_noise, multiplicative=False),
+        1: lambda x, seeds:
+            random_noise(x, seeds, multiplicative_noise, multiplicative=True),
+        2: subsample,
+        3: quantize
+    }
+
+    def augmentation(input_batch, seed=None):
+        """
+        noisy copy of a batch, every sample draws its own noise type and
+        strength, the batch is partitioned by noise type so each sample
+        only pays for its own noise and there are no data dependent
+        branches, it can run in the train step or in a tf.data map
+
+        :param input_batch: clean batch
+        :param seed: [2] seed of stateless random ops, the same seed
+            gives the same noise, None for stateful random ops
+        :return: noisy batch
+        """
+        # --- copy input batch
+        noisy_batch = tf.identity(input_batch)
+
+        if len(noise_choices) > 0:
+            # --- random select noise type per sample
             noisy_batch = \
-                keras.layers.UpSampling2D(
-                    size=stride)(noisy_batch)
-        elif noise_type == 3:
-            # quantize values
-            noisy_batch = tf.round(noisy_batch / quantization)
-            noisy_batch = noisy_batch * quantization
-            noisy_batch = tf.round(noisy_batch)
-        else:
-            logger.info(
-                "don't know how to handle noise_type [{0}]".format(
-                    noise_type))
+                per_sample_apply(
+                    noisy_batch,
+                    fns=[noise_fns[n] for n in noise_choices],
+                    seeds=seed_stream(seed))
 
         # --- clip values within boundaries
         if clip_value:
@@ -301,20 +454,42 @@ def dataset_builder(
     result = dict()
 
     result[AUGMENTATION_FN_STR] = augmentation
+    result[DATASET_CACHE_STR] = cache
 
     # dataset produces the dataset with basic geometric distortions
     if len(dataset) == 0:
         raise ValueError("don't know how to handle zero datasets")
     elif len(dataset) == 1:
-        result[DATASET_FN_STR] = \
-            dataset[0].map(
-                map_func=input_batch_augmentations,
-                num_parallel_calls=tf.data.AUTOTUNE).prefetch(2)
+        dataset = dataset[0]
     else:
-        result[DATASET_FN_STR] = \
-            tf.data.Dataset.sample_from_datasets(dataset).map(
-                map_func=input_batch_augmentations,
-                num_parallel_calls=tf.data.AUTOTUNE).prefetch(2)
+        dataset = \
+            tf.data.Dataset.sample_from_datasets(
+                dataset,
+                seed=seed)
+
+    dataset = \
+        dataset.map(
+            map_func=input_batch_augmentations,
+            num_parallel_calls=tf.data.AUTOTUNE)
+
+    # (clean, noisy) pairs, the noise of every batch comes from its own
+    # seed, new every epoch and reproducible given the dataset seed
+    if noise_in_pipeline:
+        batch_seeds = \
+            tf.data.Dataset.random(
+                seed=seed,
+                rerandomize_each_iteration=True).batch(2)
+        dataset = \
+            tf.data.Dataset.zip((dataset, batch_seeds)).map(
+                map_func=lambda x, batch_seed: (
+                    x,
+                    augmentation(
+                        x,
+                        seed=tf.random.experimental.stateless_fold_in(
+                            batch_seed, pipeline_id))),
+                num_parallel_calls=tf.data.AUTOTUNE)
+
+    result[DATASET_FN_STR] = dataset.prefetch(prefetch_buffer_size)
 
     return result
 
@@ -0,0 +1,246 @@
+r"""cache of decoded and resized training images between epochs"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import glob
+import hashlib
+import tensorflow as tf
+from pathlib import Path
+from typing import Dict, List, Union
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+from .preprocess import list_images, load_image_uint8
+
+# ---------------------------------------------------------------------
+
+CACHE_MEMORY_STR = "memory"
+CACHE_FILE_STR = "file"
+
+# ---------------------------------------------------------------------
+
+
+def _hash(values: List) -> str:
+    return hashlib.sha1(
+        "|".join([str(v) for v in values]).encode("utf-8")).hexdigest()[:16]
+
+# ---------------------------------------------------------------------
+
+
+class DatasetCache:
+    """
+    caches the decoded, resized uint8 images of directory inputs so
+    later epochs skip decoding
+
+    "cache": {
+        "type": "memory",
+        "memory_budget": 2000000000
+    }
+    "cache": {
+        "type": "file",
+        "directory": "/tmp/bfcnn_cache"
+    }
+
+    the memory cache keeps as many images as fit in the byte budget (shared
+    by all inputs), the rest are decoded every epoch. Keeping a fixed subset
+    is what an epoch-long scan wants, any recency based eviction would
+    evict every image right before it is needed again.
+
+    file caches are keyed by the file list (with sizes and modification
+    times), the resize and the input pipeline, a changed directory or
+    dataset_shape builds a new cache on the next epoch and evicts the
+    stale ones of the same directory
+    """
+
+    def __init__(self, config: Dict):
+        # --- argument checking
+        if isinstance(config, str):
+            config = {"type": config}
+        self._type = config.get("type", CACHE_MEMORY_STR).strip().lower()
+        if self._type not in [CACHE_MEMORY_STR, CACHE_FILE_STR]:
+            raise ValueError(
+                f"don't know how to handle cache type [{self._type}]")
+        self._budget_left = config.get("memory_budget", -1)
+        self._directory = config.get("directory", None)
+        if self._type == CACHE_FILE_STR:
+            if self._directory is None:
+                raise ValueError("file cache needs a directory")
+            Path(str(self._directory)).mkdir(parents=True, exist_ok=True)
+
+        # --- counters updated inside the input pipeline
+        self._decoded = \
+            tf.Variable(0, trainable=False, dtype=tf.int64, name="cache_decoded")
+        self._served = \
+            tf.Variable(0, trainable=False, dtype=tf.int64, name="cache_served")
+        self._decode_seconds = \
+            tf.Variable(0.0, trainable=False, dtype=tf.float64, name="cache_decode_seconds")
+        self._last = (0, 0, 0.0)
+
+    # ---------------------------------------------------------------------
+
+    def _decode_fn(self, height: int, width: int, channels: int):
+        def fn(path):
+            start = tf.timestamp()
+            with tf.control_dependencies([start]):
+                x = \
+                    load_image_uint8(
+                        path,
+                        height=height,
+                        width=width,
+                        channels=channels)
+            with tf.control_dependencies([x]):
+                updates = [
+                    self._decoded.assign_add(1),
+                    self._decode_seconds.assign_add(tf.timestamp() - start)
+                ]
+            with tf.control_dependencies(updates):
+                return tf.identity(x)
+        return fn
+
+    def _served_fn(self, x):
+        with tf.control_dependencies([self._served.assign_add(1)]):
+            return tf.identity(x)
+
+    def _cache_file(
+            self,
+            directory: str,
+            files: List[str],
+            key_values: List) -> str:
+        """
+        cache file prefix of this input, stale caches of the same
+        directory and pipeline are removed
+        """
+        prefix = _hash([os.path.abspath(directory)] + key_values[-2:])
+        key = _hash(
+            key_values +
+            [(f, os.path.getsize(f), os.path.getmtime(f)) for f in files])
+        filename = os.path.join(str(self._directory), f"{prefix}_{key}")
+        for f in glob.glob(os.path.join(str(self._directory), f"{prefix}_*")):
+            if not f.startswith(filename):
+                logger.info(f"evicting stale dataset cache [{f}]")
+                os.remove(f)
+        return filename
+
+    # ---------------------------------------------------------------------
+
+    def directory_dataset(
+            self,
+            directory: Union[str, Path],
+            dataset_shape: List[int],
+            channels: int,
+            seed: int = None,
+            no_pipelines: int = 1,
+            pipeline_id: int = 0) -> tf.data.Dataset:
+        """
+        unshuffled, unbatched uint8 [H, W, C] images of a directory,
+        decoded on the first epoch and read from the cache afterwards
+
+        :param directory: directory of images
+        :param dataset_shape: [height, width] to resize to
+        :param channels: channels to decode
+        :param seed: seed mixing cached and uncached images
+        :param no_pipelines: number of input pipelines sharing the directory
+        :param pipeline_id: index of this input pipeline
+        :return: dataset
+        """
+        files = list_images(directory)[pipeline_id::no_pipelines]
+        if len(files) == 0:
+            raise ValueError(f"no images found in [{directory}]")
+        height, width = int(dataset_shape[0]), int(dataset_shape[1])
+        decode_fn = self._decode_fn(height, width, channels)
+
+        def decoded(paths: List[str]) -> tf.data.Dataset:
+            return \
+                tf.data.Dataset.from_tensor_slices(paths).map(
+                    map_func=decode_fn,
+                    num_parallel_calls=tf.data.AUTOTUNE)
+
+        if self._type == CACHE_FILE_STR:
+            filename = \
+                self._cache_file(
+                    directory=str(directory),
+                    files=files,
+                    key_values=[height, width, channels, no_pipelines, pipeline_id])
+            dataset = decoded(files).cache(filename)
+            logger.info(
+                f"file cache [{filename}] for [{len(files)}] images of [{directory}]")
+        else:
+            image_bytes = height * width * channels
+            no_cached = len(files)
+            if self._budget_left >= 0:
+                no_cached = min(no_cached, self._budget_left // image_bytes)
+                self._budget_left -= no_cached * image_bytes
+            logger.info(
+                f"memory cache for [{no_cached}] out of [{len(files)}] images "
+                f"of [{directory}], [{no_cached * image_bytes / 2 ** 20:.1f}] MB")
+            if no_cached == len(files):
+                dataset = decoded(files).cache()
+            elif no_cached == 0:
+                dataset = decoded(files)
+            else:
+                dataset = \
+                    tf.data.Dataset.sample_from_datasets(
+                        [decoded(files[:no_cached]).cache(),
+                         decoded(files[no_cached:])],
+                        weights=[float(no_cached), float(len(files) - no_cached)],
+                        seed=seed)
+        return dataset.map(self._served_fn)
+
+    # ---------------------------------------------------------------------
+
+    def statistics(self) -> Dict:
+        """
+        hit rate and decode time saved since the last call
+
+        :return: dictionary of statistics
+        """
+        decoded = int(self._decoded.numpy())
+        served = int(self._served.numpy())
+        decode_seconds = float(self._decode_seconds.numpy())
+        last_decoded, last_served, last_decode_seconds = self._last
+        self._last = (decoded, served, decode_seconds)
+
+        epoch_decoded = decoded - last_decoded
+        epoch_served = served - last_served
+        hits = max(epoch_served - epoch_decoded, 0)
+        # decode seconds per image summed over the parallel calls
+        seconds_per_decode = decode_seconds / max(decoded, 1)
+        return {
+            "images": epoch_served,
+            "hits": hits,
+            "hit_rate": hits / max(epoch_served, 1),
+            "decode_seconds": decode_seconds - last_decode_seconds,
+            "decode_seconds_saved": hits * seconds_per_decode
+        }
+
+    def log_statistics(self, step: int = None) -> Dict:
+        """
+        logs the statistics since the last call, and writes them
+        to the default summary writer when a step is given
+
+        :param step: summary step
+        :return: dictionary of statistics
+        """
+        stats = self.statistics()
+        logger.info(
+            f"dataset cache: hit rate [{stats['hit_rate']:.3f}] "
+            f"over [{stats['images']}] images, "
+            f"decode [{stats['decode_seconds']:.2f}] sec, "
+            f"saved [{stats['decode_seconds_saved']:.2f}] sec")
+        if step is not None:
+            tf.summary.scalar("dataset/cache_hit_rate", stats["hit_rate"], step=step)
+            tf.summary.scalar(
+                "dataset/decode_seconds_saved", stats["decode_seconds_saved"], step=step)
+        return stats
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,435 @@
+r"""denoise every image of a directory"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+from PIL import Image, JpegImagePlugin
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple, Union, Callable
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+
+IMAGE_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+DEFAULT_BATCH_SIZE = 4
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# ---------------------------------------------------------------------
+
+
+class DecodedImage:
+    """pixels of an image and what is needed to write it back the same way"""
+
+    def __init__(
+            self,
+            path: str,
+            output_path: str,
+            pixels: np.ndarray,
+            image_format: str,
+            mode: str,
+            alpha: np.ndarray,
+            save_kwargs: Dict):
+        self.path = path
+        self.output_path = output_path
+        self.pixels = pixels
+        self.image_format = image_format
+        self.mode = mode
+        self.alpha = alpha
+        self.save_kwargs = save_kwargs
+
+
+def list_images(
+        directory: Union[str, Path],
+        exclude_directory: Union[str, Path] = None) -> List[str]:
+    """
+    all the image files under a directory, in a fixed order
+
+    :param directory: root directory, searched recursively
+    :param exclude_directory: images under this directory are skipped
+    :return: sorted list of paths
+    """
+    if exclude_directory is not None:
+        exclude_directory = Path(str(exclude_directory)).resolve()
+    return sorted([
+        str(p)
+        for p in Path(str(directory)).rglob("*")
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS and
+        (exclude_directory is None or
+         not p.resolve().is_relative_to(exclude_directory))
+    ])
+
+
+def decode_image(
+        path: str,
+        output_path: str,
+        channels: int = 3) -> DecodedImage:
+    """
+    decodes an image to uint8 [H, W, channels] and keeps its format,
+    mode, alpha channel and metadata (exif, icc profile, dpi and for
+    jpegs the quantization tables and chroma subsampling)
+    """
+    with Image.open(path) as image:
+        image_format = image.format
+        mode = image.mode
+        save_kwargs = {
+            k: image.info[k]
+            for k in ["exif", "icc_profile", "dpi", "transparency"]
+            if k in image.info
+        }
+        if image_format == "JPEG":
+            # same quality as the original
+            save_kwargs["qtables"] = image.quantization
+            sampling = JpegImagePlugin.get_sampling(image)
+            if sampling >= 0:
+                save_kwargs["subsampling"] = sampling
+        alpha = None
+        if "A" in image.getbands():
+            alpha = np.asarray(image.getchannel("A"))
+        pixels = \
+            np.asarray(
+                image.convert("L" if channels == 1 else "RGB"),
+                dtype=np.uint8)
+    if channels == 1:
+        pixels = pixels[..., np.newaxis]
+    return \
+        DecodedImage(
+            path=path,
+            output_path=output_path,
+            pixels=pixels,
+            image_format=image_format,
+            mode=mode,
+            alpha=alpha,
+            save_kwargs=save_kwargs)
+
+
+def encode_image(decoded: DecodedImage, denoised: np.ndarray):
+    """
+    writes a denoised image in the format and mode of the original,
+    through a temporary file so an interrupted run never leaves
+    a partial output behind
+    """
+    image = \
+        Image.fromarray(
+            np.squeeze(denoised, axis=-1) if denoised.shape[-1] == 1 else denoised)
+    if decoded.alpha is not None:
+        image.putalpha(Image.fromarray(decoded.alpha))
+    if image.mode != decoded.mode:
+        try:
+            image = image.convert(decoded.mode)
+        except ValueError:
+            pass
+    os.makedirs(os.path.dirname(decoded.output_path), exist_ok=True)
+    tmp_path = f"{decoded.output_path}.tmp"
+    image.save(tmp_path, format=decoded.image_format, **decoded.save_kwargs)
+    os.replace(tmp_path, decoded.output_path)
+
+# ---------------------------------------------------------------------
+
+
+def denoise_directory(
+        model_fn: Callable,
+        input_directory: Union[str, Path],
+        output_directory: Union[str, Path],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = DEFAULT_WORKERS,
+        channels: int = 3,
+        overwrite: bool = False) -> Dict:
+    """
+    denoises every image under input_directory into the same relative path
+    under output_directory
+
+    images are decoded and encoded on a pool of worker threads, images of
+    the same shape are batched and the batches run on the same pool,
+    outputs that already exist are skipped unless overwrite is set,
+    so an interrupted run resumes where it stopped
+
+    :param model_fn: denoiser, uint8 [B, H, W, C] -> uint8 [B, H, W, C]
+    :param input_directory: directory of images, searched recursively
+    :param output_directory: directory to write the denoised images
+    :param batch_size: maximum images per model call
+    :param workers: decode, denoise and encode threads
+    :param channels: input channels of the model
+    :param overwrite: denoise images that already have an output
+    :return: report dictionary
+    """
+    # --- argument checking
+    if model_fn is None:
+        raise ValueError("model_fn cannot be None")
+    if not os.path.isdir(str(input_directory)):
+        raise ValueError(
+            "input_directory [{0}] does not exist".format(input_directory))
+    if batch_size <= 0:
+        raise ValueError("batch_size must be > 0")
+    if workers <= 0:
+        raise ValueError("workers must be > 0")
+    if channels not in [1, 3]:
+        raise ValueError("channels must be 1 or 3")
+    input_directory = Path(str(input_directory)).resolve()
+    output_directory = Path(str(output_directory)).resolve()
+    if input_directory == output_directory:
+        raise ValueError("output_directory must differ from input_directory")
+
+    # --- resume, skip existing outputs, an output directory inside
+    # the input directory is not denoised again
+    jobs = []
+    skipped = 0
+    paths = \
+        list_images(
+            directory=input_directory,
+            exclude_directory=output_directory)
+    for path in paths:
+        output_path = \
+            str(output_directory / Path(path).relative_to(input_directory))
+        if not overwrite and os.path.isfile(output_path):
+            skipped += 1
+            continue
+        jobs.append((path, output_path))
+    logger.info(
+        f"denoising [{len(jobs)}] images of [{input_directory}], "
+        f"skipping [{skipped}] already denoised")
+
+    lock = threading.Lock()
+    report = {
+        "images": 0,
+        "skipped": skipped,
+        "failed": 0,
+        "batches": 0,
+        "max_pending": 0,
+        "decode_s": 0.0,
+        "denoise_s": 0.0,
+        "encode_s": 0.0
+    }
+
+    def add(key: str, value):
+        with lock:
+            report[key] += value
+
+    def decode(job: Tuple[str, str]):
+        start_time = time.time()
+        try:
+            return decode_image(job[0], job[1], channels=channels)
+        except Exception as e:
+            logger.error(f"cannot decode [{job[0]}]: {e}")
+            add("failed", 1)
+            return None
+        finally:
+            add("decode_s", time.time() - start_time)
+
+    def process(batch: List[DecodedImage]):
+        start_time = time.time()
+        try:
+            denoised = \
+                np.asarray(model_fn(np.stack([d.pixels for d in batch], axis=0)))
+        except Exception as e:
+            logger.error(f"cannot denoise [{batch[0].path}] ...: {e}")
+            add("failed", len(batch))
+            return
+        finally:
+            add("denoise_s", time.time() - start_time)
+        add("batches", 1)
+        for d, y in zip(batch, denoised):
+            start_time = time.time()
+            try:
+                encode_image(d, y)
+                add("images", 1)
+            except Exception as e:
+                logger.error(f"cannot encode [{d.output_path}]: {e}")
+                add("failed", 1)
+            finally:
+                add("encode_s", time.time() - start_time)
+
+    start_time = time.time()
+    with ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="bfcnn-denoise") as executor:
+        # bounded number of decoded, pending and processing images
+        window = workers + batch_size
+        decoding = deque()
+        processing = deque()
+        pending = {}
+        jobs = iter(jobs)
+
+        def submit_batch(batch: List[DecodedImage]):
+            while len(processing) >= workers:
+                processing.popleft().result()
+            processing.append(executor.submit(process, batch))
+
+        while True:
+            while len(decoding) < window:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                decoding.append(executor.submit(decode, job))
+            if len(decoding) == 0:
+                break
+            decoded = decoding.popleft().result()
+            if decoded is None:
+                continue
+            # images of the same shape are batched together
+            shape = decoded.pixels.shape
+            pending.setdefault(shape, []).append(decoded)
+            if len(pending[shape]) >= batch_size:
+                submit_batch(pending.pop(shape))
+            # mixed sizes rarely fill a batch, the oldest groups are
+            # flushed so the waiting images stay bounded
+            no_pending = sum([len(b) for b in pending.values()])
+            report["max_pending"] = max(report["max_pending"], no_pending)
+            while no_pending > window:
+                batch = pending.pop(next(iter(pending)))
+                no_pending -= len(batch)
+                submit_batch(batch)
+        for batch in pending.values():
+            submit_batch(batch)
+        for f in processing:
+            f.result()
+
+    elapsed = time.time() - start_time
+    report["seconds"] = elapsed
+    report["images_per_s"] = report["images"] / max(elapsed, 1e-6)
+    logger.info(
+        f"denoised [{report['images']}] images in [{elapsed:.2f}] sec, "
+        f"[{report['images_per_s']:.2f}] images/s")
+    return report
+
+# ---------------------------------------------------------------------
+
+
+def model_fn_builder(
+        model: str,
+        tflite: bool = False,
+        workers: int = DEFAULT_WORKERS) -> Tuple[Callable, int]:
+    """
+    loads a pretrained model name, saved_model directory or .tflite file
+
+    :param model: pretrained model name or path
+    :param tflite: use the tflite model of a pretrained model
+    :param workers: concurrent calls, one tflite interpreter each
+    :return: model function and its input channels
+    """
+    if tflite or str(model).endswith(".tflite"):
+        from .tflite_runner import load_tflite_model
+        runner = load_tflite_model(model, max_interpreters=workers)
+        return runner, runner.channels
+
+    import tensorflow as tf
+    from . import load_model
+    from .registry import model_channels
+    saved_model = load_model(model)
+
+    def model_fn(x: np.ndarray) -> np.ndarray:
+        return saved_model(tf.convert_to_tensor(x, dtype=tf.uint8)).numpy()
+
+    return model_fn, model_channels(saved_model)
+
+# ---------------------------------------------------------------------
+
+
+def main(args):
+    # --- argument checking
+    if args.model is None:
+        raise ValueError("--model is required")
+    if args.input_directory is None or args.output_directory is None:
+        raise ValueError("--input-directory and --output-directory are required")
+
+    model_fn, channels = \
+        model_fn_builder(
+            model=args.model,
+            tflite=args.tflite,
+            workers=args.workers)
+    report = \
+        denoise_directory(
+            model_fn=model_fn,
+            input_directory=args.input_directory,
+            output_directory=args.output_directory,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            channels=channels,
+            overwrite=args.overwrite)
+    print(json.dumps(report, indent=4))
+
+    return 0 if report["failed"] == 0 else 1
+
+# ---------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    # define arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--model",
+        default=None,
+        type=str,
+        dest="model",
+        help="pretrained model name, saved_model directory or .tflite file")
+
+    parser.add_argument(
+        "--tflite",
+        action="store_true",
+        dest="tflite",
+        help="use the tflite model of a pretrained model")
+
+    parser.add_argument(
+        "--input-directory",
+        default=None,
+        type=str,
+        dest="input_directory",
+        help="directory of images to denoise, searched recursively")
+
+    parser.add_argument(
+        "--output-directory",
+        default=None,
+        type=str,
+        dest="output_directory",
+        help="directory to write the denoised images")
+
+    parser.add_argument(
+        "--batch-size",
+        default=DEFAULT_BATCH_SIZE,
+        type=int,
+        dest="batch_size",
+        help="maximum images of the same shape per model call")
+
+    parser.add_argument(
+        "--workers",
+        default=DEFAULT_WORKERS,
+        type=int,
+        dest="workers",
+        help="threads decoding, denoising and encoding")
+
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        dest="overwrite",
+        help="denoise images that already have an output")
+
+    parser.add_argument(
+        "--version",
+        action="version",
+        version="%(prog)s (version {version})".format(version=__version__))
+
+    # parse the arguments and pass them to main
+    args = parser.parse_args()
+
+    sys.exit(main(args))
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,142 @@
+r"""distribution strategies for data parallel training"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import tensorflow as tf
+from pathlib import Path
+from typing import Dict, Union
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+
+DEFAULT_STRATEGY_STR = "default"
+MIRRORED_STRATEGY_STR = "mirrored"
+MULTI_WORKER_MIRRORED_STRATEGY_STR = "multi_worker_mirrored"
+
+COMMUNICATION_IMPLEMENTATIONS = {
+    "auto": tf.distribute.experimental.CommunicationImplementation.AUTO,
+    "ring": tf.distribute.experimental.CommunicationImplementation.RING,
+    "nccl": tf.distribute.experimental.CommunicationImplementation.NCCL
+}
+
+# ---------------------------------------------------------------------
+
+
+def strategy_builder(
+        config: Union[str, Dict] = None) -> tf.distribute.Strategy:
+    """
+    builds a distribution strategy from the train configuration,
+    must be called before any other tensorflow op when running multi worker
+
+    "distribute": "mirrored"
+    "distribute": {
+        "strategy": "multi_worker_mirrored",
+        "communication": "ring"
+    }
+
+    multi worker clusters are described by the TF_CONFIG environment
+    variable, so several local processes can form a cluster on one machine
+
+    :param config: strategy name or dictionary, None for the default strategy
+    :return: distribution strategy
+    """
+    if config is None:
+        config = {}
+    if isinstance(config, str):
+        config = {"strategy": config}
+    if not isinstance(config, dict):
+        raise ValueError("distribute must be a string or a dictionary")
+
+    strategy_type = config.get("strategy", DEFAULT_STRATEGY_STR).strip().lower()
+    communication = config.get("communication", "auto").strip().lower()
+    if communication not in COMMUNICATION_IMPLEMENTATIONS:
+        raise ValueError(
+            f"don't know how to handle communication [{communication}]")
+
+    if strategy_type == DEFAULT_STRATEGY_STR:
+        strategy = tf.distribute.get_strategy()
+    elif strategy_type == MIRRORED_STRATEGY_STR:
+        # all local devices unless specified
+        strategy = \
+            tf.distribute.MirroredStrategy(
+                devices=config.get("devices", None))
+    elif strategy_type == MULTI_WORKER_MIRRORED_STRATEGY_STR:
+        strategy = \
+            tf.distribute.MultiWorkerMirroredStrategy(
+                communication_options=tf.distribute.experimental.CommunicationOptions(
+                    implementation=COMMUNICATION_IMPLEMENTATIONS[communication]))
+    else:
+        raise ValueError(
+            f"don't know how to handle strategy [{strategy_type}]")
+
+    logger.info(
+        f"distribution strategy [{strategy_type}] "
+        f"with [{strategy.num_replicas_in_sync}] replicas in sync")
+    return strategy
+
+# ---------------------------------------------------------------------
+
+
+def is_chief(strategy: tf.distribute.Strategy) -> bool:
+    """
+    true if this worker writes summaries and the checkpoints that are kept
+
+    :param strategy: distribution strategy
+    :return: true for the chief (or a single worker)
+    """
+    return strategy.extended.should_checkpoint
+
+
+def _worker_directory(
+        model_dir: Union[str, Path],
+        strategy: tf.distribute.Strategy) -> str:
+    task_id = strategy.cluster_resolver.task_id
+    return os.path.join(str(model_dir), f"worker_tmp_{task_id}")
+
+
+def write_directory(
+        model_dir: Union[str, Path],
+        strategy: tf.distribute.Strategy) -> str:
+    """
+    directory this worker saves into, every worker has to take part in saving
+    a distributed model, non chief workers save into a temporary directory
+
+    :param model_dir: model directory of the chief
+    :param strategy: distribution strategy
+    :return: directory to write into
+    """
+    if is_chief(strategy):
+        return str(model_dir)
+    directory = _worker_directory(model_dir, strategy)
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def remove_write_directory(
+        model_dir: Union[str, Path],
+        strategy: tf.distribute.Strategy) -> None:
+    """
+    removes the temporary directory of a non chief worker
+
+    :param model_dir: model directory of the chief
+    :param strategy: distribution strategy
+    """
+    if is_chief(strategy):
+        return
+    directory = _worker_directory(model_dir, strategy)
+    if tf.io.gfile.exists(directory):
+        tf.io.gfile.rmtree(directory)
+
+# ---------------------------------------------------------------------
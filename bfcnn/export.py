@@ -17,6 +17,7 @@ from enum import Enum
 
 from .export_model_denoise import export_model as export_model_denoise
 from .export_model_decomposition import export_model as export_model_decomposition
+from .export_tflite import TFLitePrecision
 
 # ---------------------------------------------------------------------
 
@@ -51,6 +52,31 @@ class ModelType(Enum):
 # ---------------------------------------------------------------------
 
 
+def prune_channels_strategy(args):
+    if args.prune_channels_threshold is not None and \
+            args.prune_channels_fraction is not None:
+        raise ValueError(
+            "--prune-channels-threshold and --prune-channels-fraction "
+            "are mutually exclusive")
+    if args.prune_channels_threshold is not None:
+        return {
+            "type": "channel_minimum_threshold",
+            "config": {"minimum_threshold": args.prune_channels_threshold}
+        }
+    if args.prune_channels_fraction is not None:
+        if not 0.0 <= args.prune_channels_fraction <= 1.0:
+            raise ValueError(
+                "--prune-channels-fraction must be in [0, 1], "
+                f"got [{args.prune_channels_fraction}]")
+        return {
+            "type": "channel_drop_bottom",
+            "config": {"percentage": args.prune_channels_fraction}
+        }
+    return None
+
+# ---------------------------------------------------------------------
+
+
 def main(args):
     # --- argument checking
     if not os.path.isfile(args.pipeline_config):
@@ -63,7 +89,14 @@ def main(args):
             checkpoint_directory=args.checkpoint_directory,
             output_directory=args.output_directory,
             to_tflite=args.to_tflite,
-            test_model=args.test_model)
+            test_model=args.test_model,
+            to_tflite_int8=args.to_tflite_int8,
+            representative_directory=args.representative_directory,
+            precisions=args.precisions,
+            benchmark_directory=args.benchmark_directory,
+            fold_batch_norm=args.fold_batch_norm,
+            prune_channels_strategy=prune_channels_strategy(args),
+            sparse=args.sparse)
     elif args.model_type == ModelType.DECOMPOSITION:
         export_model_decomposition(
             pipeline_config=args.pipeline_config,
@@ -119,6 +152,66 @@ if __name__ == "__main__":
         dest="to_tflite",
         help="convert to tflite")
 
+    parser.add_argument(
+        "--to-tflite-int8",
+        action="store_true",
+        dest="to_tflite_int8",
+        help="convert to full integer tflite, "
+             "calibrated on the representative directory")
+
+    parser.add_argument(
+        "--representative-directory",
+        default=None,
+        type=str,
+        dest="representative_directory",
+        help="path to images for int8 calibration and evaluation")
+
+    parser.add_argument(
+        "--precision",
+        default=None,
+        nargs="+",
+        type=TFLitePrecision.from_string,
+        choices=list(TFLitePrecision),
+        dest="precisions",
+        help="tflite variants to export and benchmark into variants.json")
+
+    parser.add_argument(
+        "--benchmark-directory",
+        default=None,
+        type=str,
+        dest="benchmark_directory",
+        help="path to images for benchmarking the tflite variants")
+
+    parser.add_argument(
+        "--fold-batch-norm",
+        action="store_true",
+        dest="fold_batch_norm",
+        help="fold batch normalization into the convolutions")
+
+    prune_group = parser.add_mutually_exclusive_group()
+
+    prune_group.add_argument(
+        "--prune-channels-threshold",
+        default=None,
+        type=float,
+        dest="prune_channels_threshold",
+        help="remove conv2d channels with mean absolute weight "
+             "below this threshold (0 removes only dead channels)")
+
+    prune_group.add_argument(
+        "--prune-channels-fraction",
+        default=None,
+        type=float,
+        dest="prune_channels_fraction",
+        help="remove this fraction in [0, 1] of the weakest conv2d channels")
+
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        dest="sparse",
+        help="export a tflite model with sparse encoded weights "
+             "and compare it against the dense one")
+
     parser.add_argument(
         "--test-model",
         action="store_true",
@@ -20,6 +20,20 @@ from .constants import *
 from .custom_logger import logger
 from .utilities import load_config
 from .model_denoise import model_builder, module_denoiser_builder
+from .receptive_field import receptive_field, receptive_field_to_dict
+from .pruning import \
+    PruneStrategy, \
+    prune_channels, \
+    channel_pruning_report
+from .folding import \
+    folding_error, \
+    fold_batch_normalization, \
+    DEFAULT_FOLDING_TOLERANCE
+from .export_tflite import \
+    TFLitePrecision, \
+    export_int8_tflite, \
+    export_sparse_tflite, \
+    export_tflite_variants
 
 # ---------------------------------------------------------------------
 
@@ -34,7 +48,14 @@ def export_model(
         checkpoint_directory: Union[str, Path],
         output_directory: Union[str, Path],
         to_tflite: bool = True,
-        test_model: bool = True):
+        test_model: bool = True,
+        to_tflite_int8: bool = False,
+        representative_directory: Union[str, Path] = None,
+        precisions: List[TFLitePrecision] = None,
+        benchmark_directory: Union[str, Path] = None,
+        fold_batch_norm: bool = False,
+        prune_channels_strategy: Dict = None,
+        sparse: bool = False):
     """
     build and export a denoising model
 
@@ -43,6 +64,19 @@ def export_model(
     :param output_directory: path to the output directory
     :param to_tflite: if true convert to tflite
     :param test_model: if true run model in test mode
+    :param to_tflite_int8: if true convert to a full integer tflite model
+    :param representative_directory: images to calibrate and evaluate
+        the full integer model on
+    :param precisions: if set export a tflite variant per precision
+        and benchmark them into variants.json
+    :param benchmark_directory: optional images to benchmark the variants on
+    :param fold_batch_norm: if true fold batch normalization into the
+        convolutions, kept only if the outputs match the original model
+    :param prune_channels_strategy: if set remove conv2d channels with this
+        structured pruning strategy ({"type": ..., "config": {...}})
+        and write flops / latency before and after to pruning.json
+    :param sparse: if true export model_sparse.tflite with sparse encoded
+        weights and compare it against the dense encoding in sparse.json
     :return:
     """
     # --- argument checking
@@ -59,6 +93,14 @@ def export_model(
         if not os.path.isdir(output_directory):
             raise ValueError("Output directory [{0}] is not valid".format(
                 output_directory))
+    needs_representative = \
+        to_tflite_int8 or \
+        (precisions is not None and TFLitePrecision.INT8 in precisions)
+    if needs_representative and \
+            (representative_directory is None or
+             not os.path.isdir(str(representative_directory))):
+        raise ValueError("Representative directory [{0}] is not valid".format(
+            representative_directory))
 
     # --- setup variables
     output_directory = str(output_directory)
@@ -75,6 +117,12 @@ def export_model(
     normalizer = models.normalizer
     denormalizer = models.denormalizer
 
+    # --- compute receptive field so runtime code
+    # can size tiles and padding without re-deriving it
+    pipeline_config[RECEPTIVE_FIELD_STR] = \
+        receptive_field_to_dict(
+            receptive_field(denoiser))
+
     # --- create the help variables
     global_step = \
         tf.Variable(
@@ -117,6 +165,39 @@ def export_model(
                 f"at epoch [{int(global_epoch)}] "
                 f"and step [{int(global_step)}]")
 
+    # --- physically remove pruned channels
+    if prune_channels_strategy is not None:
+        pruned_denoiser = \
+            prune_channels(
+                model=denoiser,
+                strategy=PruneStrategy.from_string(
+                    prune_channels_strategy[TYPE_STR]),
+                **prune_channels_strategy.get(CONFIG_STR, {}))
+        report = \
+            channel_pruning_report(
+                model=denoiser,
+                pruned=pruned_denoiser,
+                input_shape=pipeline_config["dataset"]["input_shape"])
+        with open(os.path.join(output_directory, "pruning.json"), "w") as f:
+            f.write(json.dumps(report, indent=4))
+        denoiser = pruned_denoiser
+
+    # --- fold batch normalization into the convolutions
+    if fold_batch_norm:
+        folded_denoiser = fold_batch_normalization(denoiser)
+        error = \
+            folding_error(
+                model=denoiser,
+                folded=folded_denoiser,
+                input_shape=pipeline_config["dataset"]["input_shape"])
+        if error <= DEFAULT_FOLDING_TOLERANCE:
+            logger.info(f"folded model matches with relative error [{error}]")
+            denoiser = folded_denoiser
+        else:
+            logger.warning(
+                f"folded model differs with relative error [{error}], "
+                f"exporting the original model")
+
     # --- combine denoise, normalize and denormalize
     logger.info("combining denoise, normalize and denormalize model")
     dataset_config = pipeline_config["dataset"]
@@ -135,12 +216,7 @@ def export_model(
     # be constructed, only after this can we save the
     # checkpoint and saved model.
     concrete_function = \
-        denoising_module.__call__.get_concrete_function(
-            tf.TensorSpec(
-                shape=[None, None, None] + [no_channels],
-                dtype=tf.uint8,
-                name="input")
-        )
+        denoising_module.__call__.get_concrete_function()
 
     # export the model as save_model format (default)
     logger.info(f"saving module: [{output_saved_model}]")
@@ -171,6 +247,37 @@ def export_model(
         with open(output_tflite_model, "wb") as f:
             f.write(tflite_model)
 
+    # --- export to full integer tflite
+    if to_tflite_int8:
+        logger.info(
+            f"converting to full integer tflite, calibrating "
+            f"on [{representative_directory}]")
+        export_int8_tflite(
+            module=denoising_module,
+            dataset_config=dataset_config,
+            representative_directory=representative_directory,
+            output_directory=output_directory)
+
+    # --- export and benchmark tflite precision variants
+    if precisions is not None and len(precisions) > 0:
+        logger.info(f"exporting tflite variants [{precisions}]")
+        export_tflite_variants(
+            module=denoising_module,
+            dataset_config=dataset_config,
+            precisions=precisions,
+            output_directory=output_directory,
+            benchmark_directory=benchmark_directory,
+            representative_directory=representative_directory)
+
+    # --- export with sparse encoded weights
+    if sparse:
+        logger.info("exporting tflite with sparse weights")
+        export_sparse_tflite(
+            module=denoising_module,
+            dataset_config=dataset_config,
+            output_directory=output_directory,
+            benchmark_directory=benchmark_directory)
+
     # --- run graph with random input
     if test_model:
         concrete_input_shape = [1] + input_shape
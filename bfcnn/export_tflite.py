@@ -0,0 +1,929 @@
+r"""tflite export with post-training quantization, evaluation and variant selection"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import copy
+import json
+import time
+import shutil
+import platform
+import tempfile
+import numpy as np
+import tensorflow as tf
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Tuple, Union, Iterable
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+from .constants import CONFIG_STR, TYPE_STR
+from .pruning import prune_function_builder, get_conv2d_weights
+from .model_denoise import \
+    model_builder, \
+    module_denoiser_builder, \
+    DenoisingInferenceModule
+from .dataset import dataset_builder, DATASET_FN_STR
+
+# ---------------------------------------------------------------------
+
+DEFAULT_CALIBRATION_SAMPLES = 64
+DEFAULT_EVALUATION_SAMPLES = 16
+DEFAULT_BENCHMARK_ITERATIONS = 5
+DEFAULT_BENCHMARK_NOISE_STD = 10.0
+DEFAULT_MAX_PSNR_LOSS = 0.5
+DEFAULT_SPARSE_BENCHMARK_SHAPE = [256, 256, 3]
+DEFAULT_SPARSE_PRUNE_CONFIG = {
+    TYPE_STR: "drop_bottom",
+    CONFIG_STR: {"percentage": 0.7}
+}
+VARIANTS_FILENAME = "variants.json"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+# ---------------------------------------------------------------------
+
+
+class TFLitePrecision(Enum):
+    # float32 weights and activations
+    FP32 = 0
+
+    # float16 weights, float32 activations
+    FP16 = 1
+
+    # int8 weights, float32 activations
+    DYNAMIC_RANGE = 2
+
+    # full integer, uint8 input and output, builtin ops only
+    INT8 = 3
+
+    @staticmethod
+    def from_string(type_str: str) -> "TFLitePrecision":
+        # --- argument checking
+        if type_str is None:
+            raise ValueError("type_str must not be null")
+        if not isinstance(type_str, str):
+            raise ValueError("type_str must be string")
+        type_str = type_str.strip().upper().replace("-", "_")
+        if len(type_str) <= 0:
+            raise ValueError("stripped type_str must not be empty")
+
+        # --- clean string and get
+        return TFLitePrecision[type_str]
+
+    def to_string(self) -> str:
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+# ---------------------------------------------------------------------
+
+
+def psnr(
+        x: np.ndarray,
+        y: np.ndarray,
+        max_value: float = 255.0) -> float:
+    """
+    peak signal to noise ratio between two images in dB
+
+    :param x: first image
+    :param y: second image
+    :param max_value: maximum pixel value
+    :return: psnr in dB
+    """
+    mse = \
+        np.mean(
+            np.square(
+                x.astype(np.float64) - y.astype(np.float64)))
+    mse = max(mse, 1e-10)
+    return float(10.0 * np.log10((max_value ** 2) / mse))
+
+# ---------------------------------------------------------------------
+
+
+def tflite_function_builder(
+        module: DenoisingInferenceModule,
+        input_shape: List[int],
+        precision: TFLitePrecision = TFLitePrecision.FP32):
+    """
+    builds a fixed shape uint8 -> uint8 concrete function for conversion
+
+    for INT8 the function is float in / float out, with the input and
+    output ranges pinned to [0, 255] by fake quantization so the converter
+    maps uint8 pixels to quantized values with scale 1 and zero point 0
+
+    :param module: denoising inference module
+    :param input_shape: [H, W, C] of the tflite model
+    :param precision: target precision
+    :return: concrete function
+    """
+    shape = [1] + list(input_shape)
+
+    if precision == TFLitePrecision.INT8:
+        @tf.function(
+            input_signature=[
+                tf.TensorSpec(shape=shape, dtype=tf.float32, name="input")])
+        def fn(x):
+            x = \
+                tf.quantization.fake_quant_with_min_max_args(
+                    x, min=0.0, max=255.0, num_bits=8)
+            x = module._run_inference_on_floats(x)
+            x = tf.clip_by_value(x, 0.0, 255.0)
+            return \
+                tf.quantization.fake_quant_with_min_max_args(
+                    x, min=0.0, max=255.0, num_bits=8)
+    else:
+        @tf.function(
+            input_signature=[
+                tf.TensorSpec(shape=shape, dtype=tf.uint8, name="input")])
+        def fn(x):
+            x = tf.cast(x, dtype=tf.float32)
+            x = module._run_inference_on_floats(x)
+            x = tf.clip_by_value(x, 0.0, 255.0)
+            return tf.cast(tf.round(x), dtype=tf.uint8)
+
+    return fn.get_concrete_function()
+
+# ---------------------------------------------------------------------
+
+
+def convert_to_tflite(
+        module: DenoisingInferenceModule,
+        input_shape: List[int],
+        precision: TFLitePrecision = TFLitePrecision.FP32,
+        representative_dataset: Iterable[np.ndarray] = None,
+        sparse: bool = False) -> bytes:
+    """
+    converts a denoising module to a tflite flatbuffer using builtin ops only
+
+    :param module: denoising inference module
+    :param input_shape: [H, W, C] of the tflite model
+    :param precision: target precision
+    :param representative_dataset: uint8 [1, H, W, C] calibration images,
+        required for INT8
+    :param sparse: if true store pruned constant tensors in the tflite
+        sparse encoding, the converter keeps tensors dense when the
+        encoding would not be smaller
+    :return: tflite model
+    """
+    # --- argument checking
+    if module is None:
+        raise ValueError("module cannot be None")
+    if precision == TFLitePrecision.INT8 and \
+            representative_dataset is None:
+        raise ValueError("INT8 requires a representative_dataset")
+
+    logger.info(
+        f"converting to tflite with "
+        f"precision:{precision}, "
+        f"sparse:{sparse}, "
+        f"input_shape:{input_shape}")
+
+    concrete_function = \
+        tflite_function_builder(
+            module=module,
+            input_shape=input_shape,
+            precision=precision)
+    converter = \
+        tf.lite.TFLiteConverter.from_concrete_functions(
+            [concrete_function], module)
+
+    if precision == TFLitePrecision.FP32:
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS
+        ]
+    elif precision == TFLitePrecision.FP16:
+        converter.optimizations = [
+            tf.lite.Optimize.DEFAULT
+        ]
+        converter.target_spec.supported_types = [
+            tf.float16
+        ]
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS
+        ]
+    elif precision == TFLitePrecision.DYNAMIC_RANGE:
+        converter.optimizations = [
+            tf.lite.Optimize.DEFAULT
+        ]
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS
+        ]
+    elif precision == TFLitePrecision.INT8:
+        def representative_dataset_gen():
+            for image in representative_dataset:
+                yield [image.astype(np.float32)]
+        converter.optimizations = [
+            tf.lite.Optimize.DEFAULT
+        ]
+        converter.representative_dataset = representative_dataset_gen
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8
+        ]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    else:
+        raise ValueError(
+            f"don't know how to handle precision [{precision}]")
+
+    if sparse:
+        converter.optimizations = \
+            list(converter.optimizations) + [
+                tf.lite.Optimize.EXPERIMENTAL_SPARSITY
+            ]
+
+    return converter.convert()
+
+# ---------------------------------------------------------------------
+
+
+def representative_dataset_builder(
+        dataset_config: Dict,
+        directory: Union[str, Path],
+        no_samples: int) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    loads (clean, noisy) uint8 [1, H, W, C] samples from a directory using
+    the training dataset pipeline and its noise augmentation
+
+    :param dataset_config: dataset configuration of the pipeline
+    :param directory: directory with representative images
+    :param no_samples: number of samples to load
+    :return: clean samples, noisy samples
+    """
+    # --- argument checking
+    if directory is None or not os.path.isdir(str(directory)):
+        raise ValueError(
+            f"representative directory [{directory}] is not valid")
+    if no_samples <= 0:
+        raise ValueError("no_samples must be > 0")
+
+    input_shape = dataset_config["input_shape"]
+    config = copy.deepcopy(dataset_config)
+    config["batch_size"] = 1
+    config["inputs"] = [{
+        "directory": str(directory),
+        "dataset_shape": input_shape[0:2]
+    }]
+    config["noise_in_pipeline"] = True
+    dataset = dataset_builder(config)
+
+    clean = []
+    noisy = []
+    while len(clean) < no_samples:
+        count = len(clean)
+        for clean_batch, noisy_batch in dataset[DATASET_FN_STR]:
+            clean.append(clean_batch.numpy().astype(np.uint8))
+            noisy.append(noisy_batch.numpy().astype(np.uint8))
+            if len(clean) >= no_samples:
+                break
+        if len(clean) == count:
+            raise ValueError(
+                f"representative directory [{directory}] has no images")
+        if len(clean) < no_samples:
+            logger.warning(
+                f"representative directory [{directory}] has fewer "
+                f"than [{no_samples}] images, reusing images")
+
+    return clean, noisy
+
+# ---------------------------------------------------------------------
+
+
+def split_representative_files(
+        directory: Union[str, Path],
+        no_calibration_samples: int,
+        no_evaluation_samples: int,
+        seed: int = 0) -> Tuple[List[str], List[str]]:
+    """
+    splits the images of a directory by file into calibration and
+    evaluation images, in proportion to the samples of each, so the
+    evaluation images are never seen by the calibration
+
+    :param directory: directory with representative images
+    :param no_calibration_samples: samples used for calibration
+    :param no_evaluation_samples: samples used for evaluation
+    :param seed: seed of the split
+    :return: calibration filenames, evaluation filenames
+    """
+    filenames = sorted([
+        os.path.join(root, f)
+        for root, _, files in os.walk(str(directory))
+        for f in files
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    ])
+    if len(filenames) < 2:
+        raise ValueError(
+            f"representative directory [{directory}] needs at least 2 images "
+            f"to keep the evaluation images apart from the calibration ones")
+    no_evaluation = \
+        int(np.round(
+            len(filenames) * no_evaluation_samples /
+            (no_calibration_samples + no_evaluation_samples)))
+    no_evaluation = min(max(no_evaluation, 1), len(filenames) - 1)
+    order = np.random.RandomState(seed).permutation(len(filenames))
+    evaluation = sorted([filenames[i] for i in order[:no_evaluation]])
+    calibration = sorted([filenames[i] for i in order[no_evaluation:]])
+    if len(calibration) < no_calibration_samples or \
+            len(evaluation) < no_evaluation_samples:
+        logger.warning(
+            f"representative directory [{directory}] has [{len(filenames)}] "
+            f"images, calibration and evaluation reuse images of their own split")
+    return calibration, evaluation
+
+
+def _link_files(
+        filenames: List[str],
+        directory: Union[str, Path]):
+    # a directory of the given files for the dataset pipeline
+    for i, filename in enumerate(filenames):
+        link = os.path.join(str(directory), f"{i:06d}_{os.path.basename(filename)}")
+        try:
+            os.symlink(os.path.abspath(filename), link)
+        except OSError:
+            shutil.copyfile(filename, link)
+
+# ---------------------------------------------------------------------
+
+
+def benchmark_dataset_builder(
+        input_shape: List[int],
+        directory: Union[str, Path] = None,
+        no_samples: int = DEFAULT_EVALUATION_SAMPLES,
+        noise_std: float = DEFAULT_BENCHMARK_NOISE_STD,
+        seed: int = 0) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    builds a fixed (clean, noisy) uint8 [1, H, W, C] benchmark set,
+    the same inputs give the same samples so variants exported at different
+    times stay comparable
+
+    images are read in sorted order from the directory and resized to the
+    input shape, without a directory smooth synthetic images are generated,
+    noise is additive gaussian from a seeded generator
+
+    :param input_shape: [H, W, C] of the samples
+    :param directory: optional directory with benchmark images
+    :param no_samples: maximum number of samples
+    :param noise_std: standard deviation of the additive noise
+    :param seed: seed of the generator
+    :return: clean samples, noisy samples
+    """
+    # --- argument checking
+    if no_samples <= 0:
+        raise ValueError("no_samples must be > 0")
+    if directory is not None and not os.path.isdir(str(directory)):
+        raise ValueError(
+            f"benchmark directory [{directory}] is not valid")
+
+    height, width, channels = input_shape
+    rng = np.random.RandomState(seed)
+
+    clean = []
+    if directory is not None:
+        filenames = sorted([
+            os.path.join(root, f)
+            for root, _, files in os.walk(str(directory))
+            for f in files
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        ])[:no_samples]
+        for filename in filenames:
+            image = \
+                tf.io.decode_image(
+                    tf.io.read_file(filename),
+                    channels=channels,
+                    expand_animations=False)
+            image = \
+                tf.image.resize(
+                    image,
+                    size=(height, width),
+                    method="bilinear")
+            clean.append(
+                np.clip(np.round(image.numpy()), 0, 255).astype(np.uint8))
+        if len(clean) == 0:
+            raise ValueError(
+                f"benchmark directory [{directory}] has no images")
+    else:
+        for _ in range(no_samples):
+            image = \
+                rng.uniform(
+                    low=0.0,
+                    high=255.0,
+                    size=(1, max(height // 16, 1), max(width // 16, 1), channels))
+            image = \
+                tf.image.resize(
+                    image,
+                    size=(height, width),
+                    method="bicubic")
+            clean.append(
+                np.clip(np.round(image.numpy()[0]), 0, 255).astype(np.uint8))
+
+    clean = [np.expand_dims(image, axis=0) for image in clean]
+    noisy = [
+        np.clip(
+            np.round(
+                image.astype(np.float32) +
+                rng.normal(loc=0.0, scale=noise_std, size=image.shape)),
+            0, 255).astype(np.uint8)
+        for image in clean
+    ]
+    return clean, noisy
+
+# ---------------------------------------------------------------------
+
+
+def evaluate_tflite(
+        tflite_model: bytes,
+        noisy: List[np.ndarray],
+        clean: List[np.ndarray],
+        iterations: int = DEFAULT_BENCHMARK_ITERATIONS) -> Dict:
+    """
+    measures size, cpu latency and psnr of a tflite model
+
+    :param tflite_model: tflite flatbuffer
+    :param noisy: uint8 [1, H, W, C] inputs
+    :param clean: uint8 [1, H, W, C] targets
+    :param iterations: timed passes over the inputs
+    :return: dictionary with size_bytes, latency_ms and psnr
+    """
+    # --- argument checking
+    if len(noisy) == 0 or len(noisy) != len(clean):
+        raise ValueError("noisy and clean must be non empty and equal length")
+
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+
+    def run(image: np.ndarray) -> np.ndarray:
+        interpreter.set_tensor(
+            input_details["index"],
+            image.astype(input_details["dtype"]))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_details["index"])
+
+    # --- quality
+    outputs = [run(image) for image in noisy]
+    quality = [psnr(y, x) for x, y in zip(clean, outputs)]
+
+    # --- latency, first pass above doubles as warm up
+    latencies = []
+    for _ in range(iterations):
+        for image in noisy:
+            start_time = time.perf_counter()
+            _ = run(image)
+            latencies.append(time.perf_counter() - start_time)
+
+    return {
+        "size_bytes": len(tflite_model),
+        "latency_ms": float(np.median(latencies) * 1000.0),
+        "psnr": float(np.mean(quality)),
+        "outputs": outputs
+    }
+
+# ---------------------------------------------------------------------
+
+
+def export_int8_tflite(
+        module: DenoisingInferenceModule,
+        dataset_config: Dict,
+        representative_directory: Union[str, Path],
+        output_directory: Union[str, Path],
+        no_calibration_samples: int = DEFAULT_CALIBRATION_SAMPLES,
+        no_evaluation_samples: int = DEFAULT_EVALUATION_SAMPLES) -> Dict:
+    """
+    exports a full integer uint8 tflite model calibrated on a representative
+    directory and compares it against the float tflite model on held-out
+    samples from the same directory, the images are split by file so no
+    image is used for both
+
+    writes model_int8.tflite and model_int8.json to the output directory
+
+    :param module: denoising inference module
+    :param dataset_config: dataset configuration of the pipeline
+    :param representative_directory: directory with representative images
+    :param output_directory: path to write outputs
+    :param no_calibration_samples: samples used for calibration
+    :param no_evaluation_samples: held-out samples used for evaluation
+    :return: report dictionary
+    """
+    # --- argument checking
+    if no_calibration_samples <= 0:
+        raise ValueError("no_calibration_samples must be > 0")
+    if no_evaluation_samples <= 0:
+        raise ValueError("no_evaluation_samples must be > 0")
+
+    input_shape = dataset_config["input_shape"]
+    if representative_directory is None or \
+            not os.path.isdir(str(representative_directory)):
+        raise ValueError(
+            f"representative directory [{representative_directory}] is not valid")
+    calibration_files, evaluation_files = \
+        split_representative_files(
+            directory=representative_directory,
+            no_calibration_samples=no_calibration_samples,
+            no_evaluation_samples=no_evaluation_samples)
+    with tempfile.TemporaryDirectory() as calibration_directory, \
+            tempfile.TemporaryDirectory() as evaluation_directory:
+        _link_files(calibration_files, calibration_directory)
+        _link_files(evaluation_files, evaluation_directory)
+        _, calibration = \
+            representative_dataset_builder(
+                dataset_config=dataset_config,
+                directory=calibration_directory,
+                no_samples=no_calibration_samples)
+        evaluation_clean, evaluation_noisy = \
+            representative_dataset_builder(
+                dataset_config=dataset_config,
+                directory=evaluation_directory,
+                no_samples=no_evaluation_samples)
+
+    # --- convert both models
+    fp32_model = \
+        convert_to_tflite(
+            module=module,
+            input_shape=input_shape,
+            precision=TFLitePrecision.FP32)
+    int8_model = \
+        convert_to_tflite(
+            module=module,
+            input_shape=input_shape,
+            precision=TFLitePrecision.INT8,
+            representative_dataset=calibration)
+
+    # --- evaluate on held-out samples
+    fp32_results = evaluate_tflite(fp32_model, evaluation_noisy, evaluation_clean)
+    int8_results = evaluate_tflite(int8_model, evaluation_noisy, evaluation_clean)
+    agreement = [
+        psnr(x, y)
+        for x, y in zip(fp32_results.pop("outputs"), int8_results.pop("outputs"))
+    ]
+    report = {
+        "input_shape": list(input_shape),
+        "calibration_samples": no_calibration_samples,
+        "evaluation_samples": no_evaluation_samples,
+        "calibration_files": len(calibration_files),
+        "evaluation_files": len(evaluation_files),
+        "fp32": fp32_results,
+        "int8": int8_results,
+        "size_ratio": int8_results["size_bytes"] / fp32_results["size_bytes"],
+        "speedup": fp32_results["latency_ms"] / max(int8_results["latency_ms"], 1e-6),
+        "psnr_delta": int8_results["psnr"] - fp32_results["psnr"],
+        "psnr_int8_vs_fp32": float(np.mean(agreement))
+    }
+    logger.info(f"int8 tflite report: {report}")
+
+    # --- save model and report
+    output_directory = str(output_directory)
+    with open(os.path.join(output_directory, "model_int8.tflite"), "wb") as f:
+        f.write(int8_model)
+    with open(os.path.join(output_directory, "model_int8.json"), "w") as f:
+        f.write(json.dumps(report, indent=4))
+
+    return report
+
+# ---------------------------------------------------------------------
+
+
+def export_tflite_variants(
+        module: DenoisingInferenceModule,
+        dataset_config: Dict,
+        precisions: List[TFLitePrecision],
+        output_directory: Union[str, Path],
+        benchmark_directory: Union[str, Path] = None,
+        representative_directory: Union[str, Path] = None,
+        no_benchmark_samples: int = DEFAULT_EVALUATION_SAMPLES,
+        no_calibration_samples: int = DEFAULT_CALIBRATION_SAMPLES) -> Dict:
+    """
+    exports one tflite model per precision side by side, benchmarks each on
+    the same fixed image set and writes variants.json with size, cpu latency
+    and quality loss against the fp32 variant, which is always included
+
+    :param module: denoising inference module
+    :param dataset_config: dataset configuration of the pipeline
+    :param precisions: precisions to export
+    :param output_directory: path to write outputs
+    :param benchmark_directory: optional directory with benchmark images
+    :param representative_directory: calibration images, required for INT8
+    :param no_benchmark_samples: number of benchmark samples
+    :param no_calibration_samples: number of INT8 calibration samples
+    :return: variants dictionary
+    """
+    # --- argument checking
+    if precisions is None or len(precisions) == 0:
+        raise ValueError("precisions must not be empty")
+    if TFLitePrecision.INT8 in precisions and \
+            representative_directory is None:
+        raise ValueError("INT8 requires a representative_directory")
+
+    # --- fp32 first, it is the reference of the others
+    precisions = \
+        [TFLitePrecision.FP32] + \
+        [p for p in dict.fromkeys(precisions) if p != TFLitePrecision.FP32]
+    input_shape = dataset_config["input_shape"]
+    output_directory = str(output_directory)
+    clean, noisy = \
+        benchmark_dataset_builder(
+            input_shape=input_shape,
+            directory=benchmark_directory,
+            no_samples=no_benchmark_samples)
+    calibration = None
+    if TFLitePrecision.INT8 in precisions:
+        _, calibration = \
+            representative_dataset_builder(
+                dataset_config=dataset_config,
+                directory=representative_directory,
+                no_samples=no_calibration_samples)
+
+    variants = []
+    reference = None
+    for precision in precisions:
+        tflite_model = \
+            convert_to_tflite(
+                module=module,
+                input_shape=input_shape,
+                precision=precision,
+                representative_dataset=calibration)
+        filename = f"model_{precision.to_string().lower()}.tflite"
+        with open(os.path.join(output_directory, filename), "wb") as f:
+            f.write(tflite_model)
+        results = evaluate_tflite(tflite_model, noisy, clean)
+        outputs = results.pop("outputs")
+        if reference is None:
+            reference = (results, outputs)
+        results["precision"] = precision.to_string()
+        results["path"] = filename
+        results["psnr_loss"] = reference[0]["psnr"] - results["psnr"]
+        results["psnr_vs_fp32"] = \
+            float(np.mean([psnr(x, y) for x, y in zip(reference[1], outputs)]))
+        logger.info(f"tflite variant: {results}")
+        variants.append(results)
+
+    result = {
+        "input_shape": list(input_shape),
+        "benchmark_samples": len(clean),
+        "benchmark_directory": benchmark_directory,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "variants": variants
+    }
+    with open(os.path.join(output_directory, VARIANTS_FILENAME), "w") as f:
+        f.write(json.dumps(result, indent=4))
+
+    return result
+
+# ---------------------------------------------------------------------
+
+
+def select_tflite_variant(
+        directory: Union[str, Path],
+        max_psnr_loss: float = DEFAULT_MAX_PSNR_LOSS,
+        measure_latency: bool = True,
+        iterations: int = DEFAULT_BENCHMARK_ITERATIONS) -> Dict:
+    """
+    picks the fastest variant of variants.json whose quality loss is within
+    max_psnr_loss, latency is re-measured on this host by default since the
+    fastest variant differs between hosts
+
+    :param directory: directory with variants.json and the tflite models
+    :param max_psnr_loss: maximum allowed psnr loss against fp32 in dB
+    :param measure_latency: if true re-measure latency on this host
+    :param iterations: timed runs per variant
+    :return: selected variant with an absolute path
+    """
+    directory = str(directory)
+    with open(os.path.join(directory, VARIANTS_FILENAME), "r") as f:
+        variants_config = json.load(f)
+    shape = [1] + variants_config["input_shape"]
+
+    candidates = []
+    for variant in variants_config["variants"]:
+        if variant["psnr_loss"] > max_psnr_loss:
+            continue
+        variant = dict(variant)
+        variant["path"] = os.path.join(directory, variant["path"])
+        if measure_latency:
+            image = \
+                np.random.randint(
+                    low=0, high=256, size=shape).astype(np.uint8)
+            with open(variant["path"], "rb") as f:
+                variant["latency_ms"] = \
+                    evaluate_tflite(
+                        f.read(), [image], [image],
+                        iterations=iterations)["latency_ms"]
+        candidates.append(variant)
+
+    if len(candidates) == 0:
+        raise ValueError(
+            f"no variant within max_psnr_loss [{max_psnr_loss}]")
+    selected = min(candidates, key=lambda v: v["latency_ms"])
+    logger.info(
+        f"selected tflite variant [{selected['precision']}] "
+        f"with latency_ms:{selected['latency_ms']:.2f}")
+    return selected
+
+# ---------------------------------------------------------------------
+
+
+def conv2d_sparsity(model) -> float:
+    """
+    fraction of zero conv2d weights of a model
+
+    :param model: keras model
+    :return: sparsity in [0, 1]
+    """
+    weights = get_conv2d_weights(model)
+    if weights.size == 0:
+        return 0.0
+    return float(np.mean(weights == 0.0))
+
+# ---------------------------------------------------------------------
+
+
+def compare_dense_sparse_tflite(
+        module: DenoisingInferenceModule,
+        input_shape: List[int],
+        noisy: List[np.ndarray],
+        clean: List[np.ndarray],
+        precision: TFLitePrecision = TFLitePrecision.FP32,
+        representative_dataset: Iterable[np.ndarray] = None) -> Tuple[bytes, Dict]:
+    """
+    converts a module with dense and with sparse weight encoding
+    and compares file size, cpu latency and outputs
+
+    :param module: denoising inference module
+    :param input_shape: [H, W, C] of the tflite model
+    :param noisy: uint8 [1, H, W, C] inputs
+    :param clean: uint8 [1, H, W, C] targets
+    :param precision: target precision of both models
+    :param representative_dataset: calibration images, required for INT8
+    :return: sparse tflite model, report dictionary
+    """
+    models = {}
+    results = {}
+    for key, sparse in [("dense", False), ("sparse", True)]:
+        models[key] = \
+            convert_to_tflite(
+                module=module,
+                input_shape=input_shape,
+                precision=precision,
+                representative_dataset=representative_dataset,
+                sparse=sparse)
+        results[key] = evaluate_tflite(models[key], noisy, clean)
+    agreement = [
+        psnr(x, y)
+        for x, y in zip(results["dense"].pop("outputs"),
+                        results["sparse"].pop("outputs"))
+    ]
+    report = {
+        "input_shape": list(input_shape),
+        "precision": precision.to_string(),
+        "dense": results["dense"],
+        "sparse": results["sparse"],
+        "size_ratio":
+            results["sparse"]["size_bytes"] /
+            results["dense"]["size_bytes"],
+        "speedup":
+            results["dense"]["latency_ms"] /
+            max(results["sparse"]["latency_ms"], 1e-6),
+        "psnr_sparse_vs_dense": float(np.mean(agreement))
+    }
+    return models["sparse"], report
+
+# ---------------------------------------------------------------------
+
+
+def export_sparse_tflite(
+        module: DenoisingInferenceModule,
+        dataset_config: Dict,
+        output_directory: Union[str, Path],
+        precision: TFLitePrecision = TFLitePrecision.FP32,
+        benchmark_directory: Union[str, Path] = None,
+        representative_directory: Union[str, Path] = None,
+        no_benchmark_samples: int = DEFAULT_EVALUATION_SAMPLES,
+        no_calibration_samples: int = DEFAULT_CALIBRATION_SAMPLES) -> Dict:
+    """
+    exports a tflite model with sparse encoded weights for pruned denoisers
+    and benchmarks it against the dense encoding on the same fixed image set
+
+    writes model_sparse.tflite and sparse.json to the output directory
+
+    :param module: denoising inference module
+    :param dataset_config: dataset configuration of the pipeline
+    :param output_directory: path to write outputs
+    :param precision: target precision
+    :param benchmark_directory: optional directory with benchmark images
+    :param representative_directory: calibration images, required for INT8
+    :param no_benchmark_samples: number of benchmark samples
+    :param no_calibration_samples: number of INT8 calibration samples
+    :return: report dictionary
+    """
+    # --- argument checking
+    if precision == TFLitePrecision.INT8 and \
+            representative_directory is None:
+        raise ValueError("INT8 requires a representative_directory")
+
+    input_shape = dataset_config["input_shape"]
+    clean, noisy = \
+        benchmark_dataset_builder(
+            input_shape=input_shape,
+            directory=benchmark_directory,
+            no_samples=no_benchmark_samples)
+    calibration = None
+    if precision == TFLitePrecision.INT8:
+        _, calibration = \
+            representative_dataset_builder(
+                dataset_config=dataset_config,
+                directory=representative_directory,
+                no_samples=no_calibration_samples)
+
+    tflite_model, report = \
+        compare_dense_sparse_tflite(
+            module=module,
+            input_shape=input_shape,
+            noisy=noisy,
+            clean=clean,
+            precision=precision,
+            representative_dataset=calibration)
+    report["sparsity"] = conv2d_sparsity(module._model_denoise)
+    logger.info(f"sparse tflite report: {report}")
+
+    # --- save model and report
+    output_directory = str(output_directory)
+    with open(os.path.join(output_directory, "model_sparse.tflite"), "wb") as f:
+        f.write(tflite_model)
+    with open(os.path.join(output_directory, "sparse.json"), "w") as f:
+        f.write(json.dumps(report, indent=4))
+
+    return report
+
+# ---------------------------------------------------------------------
+
+
+def benchmark_sparse_tflite(
+        configs: List[Dict],
+        prune_config: Union[Dict, List[Dict]] = None,
+        input_shape: List[int] = None,
+        no_samples: int = 2) -> List[Dict]:
+    """
+    prunes freshly built denoisers of every configuration and compares
+    the dense and the sparse tflite encoding of each
+
+    :param configs: pipeline configurations, for example bfcnn.configs
+    :param prune_config: unstructured pruning configuration,
+        defaults to dropping the bottom 70% of the weights
+    :param input_shape: [H, W] of the benchmark images,
+        channels are taken from each configuration
+    :param no_samples: number of synthetic benchmark samples
+    :return: one report per configuration
+    """
+    # --- argument checking
+    if configs is None or len(configs) == 0:
+        raise ValueError("configs must not be empty")
+    if prune_config is None:
+        prune_config = DEFAULT_SPARSE_PRUNE_CONFIG
+    if input_shape is None:
+        input_shape = DEFAULT_SPARSE_BENCHMARK_SHAPE
+
+    prune_fn = prune_function_builder(prune_config)
+    reports = []
+    for config in configs:
+        model_config = config["model_denoise"]
+        channels = model_config["input_shape"][2]
+        shape = list(input_shape[0:2]) + [channels]
+        models = model_builder(model_config)
+        prune_fn(models.denoiser)
+        module = \
+            module_denoiser_builder(
+                model_denoise=models.denoiser,
+                model_normalize=models.normalizer,
+                model_denormalize=models.denormalizer,
+                training_channels=channels)
+        clean, noisy = \
+            benchmark_dataset_builder(
+                input_shape=shape,
+                no_samples=no_samples)
+        _, report = \
+            compare_dense_sparse_tflite(
+                module=module,
+                input_shape=shape,
+                noisy=noisy,
+                clean=clean)
+        report["type"] = model_config[TYPE_STR]
+        report["sparsity"] = conv2d_sparsity(models.denoiser)
+        logger.info(
+            f"sparse benchmark [{report['type']}]: "
+            f"sparsity:{report['sparsity']:.2f}, "
+            f"size_ratio:{report['size_ratio']:.2f}, "
+            f"speedup:{report['speedup']:.2f}")
+        reports.append(report)
+    return reports
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,316 @@
+r"""fold batch normalization into neighbouring convolutions for export"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+from .utilities import \
+    FunctionalGraph, \
+    is_plain_conv2d, \
+    is_unpadded_conv2d, \
+    rebuild_functional_model
+
+# ---------------------------------------------------------------------
+
+DEFAULT_FOLDING_TOLERANCE = 1e-4
+# folded biases with every value below this are left out
+DEFAULT_ZERO_BIAS_TOLERANCE = 1e-7
+
+# ---------------------------------------------------------------------
+
+
+def _batch_normalization_affine(
+        layer: keras.layers.BatchNormalization) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    inference time batch normalization as a per channel affine a * x + b
+
+    :param layer: batch normalization layer
+    :return: a, b
+    """
+    mean = layer.moving_mean.numpy().astype(np.float64)
+    variance = layer.moving_variance.numpy().astype(np.float64)
+    gamma = np.ones_like(mean)
+    beta = np.zeros_like(mean)
+    if layer.scale:
+        gamma = layer.gamma.numpy().astype(np.float64)
+    if layer.center:
+        beta = layer.beta.numpy().astype(np.float64)
+    a = gamma / np.sqrt(variance + layer.epsilon)
+    b = beta - mean * a
+    return a, b
+
+# ---------------------------------------------------------------------
+
+
+def _is_channel_last_batch_normalization(node) -> bool:
+    layer = node.layer
+    if not isinstance(layer, keras.layers.BatchNormalization):
+        return False
+    if node.call_kwargs.get("training", None):
+        return False
+    rank = node.keras_inputs[0].shape.rank
+    axis = layer.axis if isinstance(layer.axis, (list, tuple)) else [layer.axis]
+    return rank == 4 and len(axis) == 1 and axis[0] in [-1, rank - 1]
+
+
+def _can_fold_before(layer) -> bool:
+    """
+    a batch normalization in front of a convolution folds exactly only when
+    no zero padding reaches the kernel, (1x1 kernels or valid padding)
+    """
+    return is_unpadded_conv2d(layer)
+
+
+def _can_fold_after(layer) -> bool:
+    return \
+        is_plain_conv2d(layer) and \
+        layer.activation is keras.activations.linear
+
+# ---------------------------------------------------------------------
+
+
+def _fold_before(
+        kernel: np.ndarray,
+        bias: np.ndarray,
+        a: np.ndarray,
+        b: np.ndarray,
+        groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    conv(a * x + b) -> conv'(x)
+
+    :param kernel: [kh, kw, cin / groups, cout]
+    :param bias: [cout]
+    :param a: [cin] scale
+    :param b: [cin] offset
+    :param groups: convolution groups
+    :return: folded kernel, folded bias
+    """
+    cin_group = kernel.shape[2]
+    cout_group = kernel.shape[3] // groups
+    # input channel of every (i, o) pair of the kernel
+    group = np.arange(kernel.shape[3]) // cout_group
+    channel = group[np.newaxis, :] * cin_group + np.arange(cin_group)[:, np.newaxis]
+    kernel_folded = kernel * a[channel][np.newaxis, np.newaxis, :, :]
+    bias_folded = bias + np.sum(kernel * b[channel][np.newaxis, np.newaxis, :, :], axis=(0, 1, 2))
+    return kernel_folded, bias_folded
+
+
+def _fold_after(
+        kernel: np.ndarray,
+        bias: np.ndarray,
+        a: np.ndarray,
+        b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    a * conv(x) + b -> conv'(x)
+
+    :param kernel: [kh, kw, cin / groups, cout]
+    :param bias: [cout]
+    :param a: [cout] scale
+    :param b: [cout] offset
+    :return: folded kernel, folded bias
+    """
+    return kernel * a[np.newaxis, np.newaxis, np.newaxis, :], bias * a + b
+
+# ---------------------------------------------------------------------
+
+
+def _folded_conv2d(
+        conv: keras.layers.Conv2D,
+        before: keras.layers.BatchNormalization = None,
+        after: keras.layers.BatchNormalization = None) -> keras.layers.Conv2D:
+    """
+    builds a copy of conv with the batch normalizations folded in,
+    the copy has no regularizers and a bias only if the folded one is not zero
+    """
+    kernel = conv.kernel.numpy().astype(np.float64)
+    bias = np.zeros(kernel.shape[3], dtype=np.float64)
+    if conv.use_bias:
+        bias = conv.bias.numpy().astype(np.float64)
+    if before is not None:
+        a, b = _batch_normalization_affine(before)
+        kernel, bias = _fold_before(kernel, bias, a, b, conv.groups)
+    if after is not None:
+        a, b = _batch_normalization_affine(after)
+        kernel, bias = _fold_after(kernel, bias, a, b)
+
+    use_bias = bool(np.any(np.abs(bias) > DEFAULT_ZERO_BIAS_TOLERANCE))
+    config = conv.get_config()
+    config["use_bias"] = use_bias
+    config["bias_initializer"] = "zeros"
+    for key in ["kernel_regularizer", "bias_regularizer",
+                "activity_regularizer", "kernel_constraint", "bias_constraint"]:
+        config[key] = None
+    layer = keras.layers.Conv2D.from_config(config)
+    layer.build(tf.TensorShape([None, None, None, kernel.shape[2] * conv.groups]))
+    weights = [kernel.astype(conv.kernel.dtype.as_numpy_dtype)]
+    if use_bias:
+        weights.append(bias.astype(conv.kernel.dtype.as_numpy_dtype))
+    layer.set_weights(weights)
+    return layer
+
+# ---------------------------------------------------------------------
+
+
+def _plan_folds(model: keras.Model) -> Tuple[Dict, Dict]:
+    """
+    finds the batch normalization nodes that can be removed
+
+    :param model: functional model
+    :return:
+        removed batch normalization node ids,
+        folded convolutions by node id
+    """
+    graph = FunctionalGraph(model)
+    nodes = graph.nodes
+    output_ids = graph.output_ids
+    consumers = graph.consumers
+    single_use = graph.single_use
+
+    removed = {}
+    conv_layers = {}
+    replaced = defaultdict(lambda: [None, None])
+
+    # --- conv -> bn
+    for node in nodes:
+        if not _can_fold_after(node.layer) or not single_use(node.layer):
+            continue
+        t_id = node.flat_output_ids[0]
+        if t_id in output_ids or len(consumers[t_id]) != 1:
+            continue
+        bn_node = consumers[t_id][0]
+        if not _is_channel_last_batch_normalization(bn_node):
+            continue
+        removed[id(bn_node)] = bn_node
+        replaced[id(node)][1] = bn_node.layer
+        conv_layers[id(node)] = node.layer
+
+    # --- bn -> conv
+    for node in nodes:
+        if id(node) in removed:
+            continue
+        if not _is_channel_last_batch_normalization(node):
+            continue
+        t_id = node.flat_output_ids[0]
+        if t_id in output_ids or len(consumers[t_id]) == 0:
+            continue
+        foldable = all([
+            _can_fold_before(c.layer) and
+            single_use(c.layer) and
+            replaced.get(id(c), [None, None])[0] is None
+            for c in consumers[t_id]
+        ])
+        if not foldable:
+            continue
+        removed[id(node)] = node
+        for c in consumers[t_id]:
+            replaced[id(c)][0] = node.layer
+            conv_layers[id(c)] = c.layer
+
+    folded = {
+        node_id: _folded_conv2d(
+            conv=conv_layers[node_id], before=before, after=after)
+        for node_id, (before, after) in replaced.items()
+    }
+    return set(removed.keys()), folded
+
+# ---------------------------------------------------------------------
+
+
+def count_batch_normalization(model: keras.Model) -> int:
+    """
+    number of batch normalization calls in a model, nested models included
+
+    :param model: keras model
+    :return: count
+    """
+    count = 0
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.BatchNormalization):
+            count += 1
+        elif isinstance(layer, keras.Model):
+            count += count_batch_normalization(layer)
+    return count
+
+# ---------------------------------------------------------------------
+
+
+def fold_batch_normalization(model: keras.Model) -> keras.Model:
+    """
+    folds frozen batch normalization statistics into the neighbouring
+    convolutions and returns a new model without them
+
+    a batch normalization followed by a 1x1 (or valid padded) convolution
+    is folded into its kernel and bias, a batch normalization following a
+    linear convolution is folded into it, all other batch normalizations
+    are kept since zero padding makes folding them inexact at the borders
+
+    :param model: functional keras model with restored weights
+    :return: folded model, the input model is not modified
+    """
+    # --- argument checking
+    if model is None:
+        raise ValueError("model cannot be None")
+    if not getattr(model, "_is_graph_network", False):
+        raise ValueError("only functional models can be folded")
+
+    before = count_batch_normalization(model)
+    folded = rebuild_functional_model(model, plan_fn=_plan_folds)
+    after = count_batch_normalization(folded)
+    logger.info(
+        f"folded batch normalization in [{model.name}], "
+        f"kept [{after}] out of [{before}] layers")
+    return folded
+
+# ---------------------------------------------------------------------
+
+
+def folding_error(
+        model: keras.Model,
+        folded: keras.Model,
+        input_shape: List[int],
+        no_samples: int = 2,
+        seed: int = 0) -> float:
+    """
+    maximum absolute output difference between a model and its folded copy
+    on random inputs, relative to the output magnitude
+
+    :param model: original model
+    :param folded: folded model
+    :param input_shape: [H, W, C] of the random inputs
+    :param no_samples: number of random inputs
+    :param seed: seed of the random inputs
+    :return: relative error
+    """
+    rng = np.random.RandomState(seed)
+    error = 0.0
+    for _ in range(no_samples):
+        x = \
+            rng.uniform(
+                low=-0.5,
+                high=+0.5,
+                size=[1] + list(input_shape)).astype(np.float32)
+        y = tf.nest.flatten(model(x, training=False))
+        y_folded = tf.nest.flatten(folded(x, training=False))
+        for a, b in zip(y, y_folded):
+            a = np.array(a)
+            b = np.array(b)
+            scale = max(float(np.max(np.abs(a))), 1.0)
+            error = max(error, float(np.max(np.abs(a - b))) / scale)
+    return error
+
+# ---------------------------------------------------------------------
@@ -212,27 +212,28 @@ def loss_function_builder(
     """
     logger.info("building loss_function with config [{0}]".format(config))
 
-    # ---
-    hinge = tf.constant(config.get("hinge", 0.0))
-    cutoff = tf.constant(config.get("cutoff", 255.0))
+    # --- python values so the loss can be traced,
+    # hinge and cutoff configure layers and the flags select branches
+    hinge = float(config.get("hinge", 0.0))
+    cutoff = float(config.get("cutoff", 255.0))
 
     # --- mae
     mae_multiplier = tf.constant(config.get("mae_multiplier", 1.0))
 
     # --- delta
     mae_delta_multiplier = tf.constant(config.get("mae_delta_multiplier", 0.0))
-    mae_delta_enabled = tf.constant(mae_delta_multiplier > 0.0)
+    mae_delta_enabled = config.get("mae_delta_multiplier", 0.0) > 0.0
 
     # --- variance
     mae_variance_multiplier = tf.constant(config.get("variance_multiplier", 0.0))
-    mae_variance_enabled = tf.constant(mae_variance_multiplier > 0.0)
+    mae_variance_enabled = config.get("variance_multiplier", 0.0) > 0.0
 
     # --- regularization
     regularization_multiplier = tf.constant(config.get("regularization", 1.0))
 
     # --- flags
-    use_single_loss = tf.constant(config.get("single_loss", True))
-    use_decomposition_loss = tf.constant(config.get("decomposition_loss", False))
+    use_single_loss = bool(config.get("single_loss", True))
+    use_decomposition_loss = bool(config.get("decomposition_loss", False))
 
     def loss_function(
             input_batch,
@@ -7,6 +7,7 @@ __license__ = "MIT"
 # ---------------------------------------------------------------------
 
 import abc
+import contextlib
 import tensorflow as tf
 from tensorflow import keras
 from collections import namedtuple
@@ -30,6 +31,7 @@ from .pyramid import \
     build_pyramid_model, \
     build_inverse_pyramid_model
 from .constants import CONFIG_STR, TYPE_STR
+from .receptive_field import receptive_field
 from .regularizer import builder as regularizer_builder
 
 # ---------------------------------------------------------------------
@@ -48,6 +50,41 @@ BuilderResults = namedtuple(
 # ---------------------------------------------------------------------
 
 
+@contextlib.contextmanager
+def dtype_policy_scope(policy: str):
+    """
+    builds layers under a keras dtype policy, the previous global
+    policy is restored on exit
+
+    :param policy: policy name, ie "mixed_bfloat16"
+    """
+    previous_policy = keras.mixed_precision.global_policy()
+    keras.mixed_precision.set_global_policy(policy)
+    try:
+        yield
+    finally:
+        keras.mixed_precision.set_global_policy(previous_policy)
+
+
+def mixed_precision_policy(mixed_precision) -> str:
+    """
+    maps the mixed_precision option to a keras dtype policy
+
+    :param mixed_precision: false, true (bfloat16) or a policy name
+    :return: policy name
+    """
+    if mixed_precision is None or mixed_precision is False:
+        return "float32"
+    if mixed_precision is True:
+        return "mixed_bfloat16"
+    if mixed_precision in ["float32", "mixed_bfloat16", "mixed_float16"]:
+        return mixed_precision
+    raise ValueError(
+        f"don't know how to handle mixed_precision [{mixed_precision}]")
+
+# ---------------------------------------------------------------------
+
+
 def model_builder(
         config: Dict) -> BuilderResults:
     """
@@ -81,6 +118,9 @@ def model_builder(
     add_final_bn = config.get("add_final_bn", True)
     shared_model = config.get("shared_model", False)
     add_concat_input = config.get("add_concat_input", False)
+    # input is [frame, previous denoised frame] on the channels,
+    # see stream.py TEMPORAL_CONCAT
+    temporal_context = config.get("temporal_context", False)
     input_shape = config.get("input_shape", (None, None, 3))
     output_multiplier = config.get("output_multiplier", 1.0)
     depthwise_scaling = config.get("depthwise_scaling", False)
@@ -92,6 +132,9 @@ def model_builder(
     kernel_initializer = config.get("kernel_initializer", "glorot_normal")
     add_learnable_multiplier = config.get("add_learnable_multiplier", False)
     add_residual_between_models = config.get("add_residual_between_models", False)
+    # bfloat16 / float16 compute in the denoising levels with float32 weights,
+    # normalization, pyramids and outputs stay float32
+    dtype_policy = mixed_precision_policy(config.get("mixed_precision", False))
 
     use_pyramid = pyramid_config is not None
     use_local_normalization = local_normalization > 0
@@ -107,6 +150,15 @@ def model_builder(
         raise ValueError("filters must be > 0")
     if kernel_size <= 0:
         raise ValueError("kernel_size must be > 0")
+    if temporal_context and model_type not in ["resnet", "sparse_resnet"]:
+        raise ValueError(
+            f"temporal_context is not supported by [{model_type}] models")
+
+    # frame and previous frame channels
+    no_channels = input_shape[2]
+    model_input_shape = list(input_shape)
+    if temporal_context:
+        model_input_shape[2] = no_channels * 2
 
     kernel_regularizer = \
         regularizer_builder(kernel_regularizer)
@@ -114,7 +166,7 @@ def model_builder(
     # --- build normalize denormalize models
     model_normalize = \
         build_normalize_model(
-            input_dims=input_shape,
+            input_dims=model_input_shape,
             min_value=min_value,
             max_value=max_value)
 
@@ -148,6 +200,10 @@ def model_builder(
         add_learnable_multiplier=add_learnable_multiplier,
     )
 
+    if temporal_context:
+        model_params["input_dims"] = model_input_shape
+        model_params["add_temporal_input"] = True
+
     model_builder_fn = None
     if model_type == "unet":
         model_builder_fn = build_model_unet
@@ -192,9 +248,13 @@ def model_builder(
     # setup input
     input_layer = \
         keras.Input(
-            shape=input_shape,
+            shape=model_input_shape,
             name="input_tensor")
     x = input_layer
+    x_previous = None
+    if temporal_context:
+        x = input_layer[..., 0:no_channels]
+        x_previous = input_layer[..., no_channels:]
 
     # define normalization/denormalization layers
     local_normalization_layer = \
@@ -224,6 +284,14 @@ def model_builder(
     else:
         x_levels = [x]
 
+    # the previous frame is decomposed the same way
+    x_previous_levels = None
+    if temporal_context:
+        if use_pyramid:
+            x_previous_levels = model_pyramid(x_previous, training=False)
+        else:
+            x_previous_levels = [x_previous]
+
     # --- local/global normalization cap
     means = []
     sigmas = []
@@ -239,6 +307,10 @@ def model_builder(
                 x_level = \
                     local_normalization_layer(
                         [x_level, mean, sigma])
+                if temporal_context:
+                    x_previous_levels[i] = \
+                        local_normalization_layer(
+                            [x_previous_levels[i], mean, sigma])
             if use_global_normalization:
                 mean, sigma = \
                     mean_sigma_global(
@@ -247,6 +319,10 @@ def model_builder(
                 x_level = \
                     global_normalization_layer(
                         [x_level, mean, sigma])
+                if temporal_context:
+                    x_previous_levels[i] = \
+                        global_normalization_layer(
+                            [x_previous_levels[i], mean, sigma])
             means.append(mean)
             sigmas.append(sigma)
             x_levels[i] = x_level
@@ -254,22 +330,45 @@ def model_builder(
     logger.info("pyramid produces [{0}] scales".format(len(x_levels)))
 
     # --- shared or separate models
-    if shared_model:
-        logger.info("building shared model")
-        resnet_model = \
-            model_builder_fn(
-                name="level_shared",
-                **model_params)
-        denoise_models = [resnet_model] * len(x_levels)
-    else:
-        logger.info("building per scale model")
+    with dtype_policy_scope(dtype_policy):
+        if shared_model:
+            logger.info("building shared model")
+            resnet_model = \
+                model_builder_fn(
+                    name="level_shared",
+                    **model_params)
+            denoise_models = [resnet_model] * len(x_levels)
+        else:
+            logger.info("building per scale model")
+            denoise_models = [
+                model_builder_fn(
+                    name=f"level_{i}",
+                    **model_params)
+                for i in range(len(x_levels))
+            ]
+
+    if dtype_policy != "float32":
+        logger.info(f"denoising levels use dtype policy [{dtype_policy}]")
+
+        def float32_outputs(model):
+            def fn(x):
+                return tf.nest.map_structure(
+                    lambda y: tf.cast(y, dtype=tf.float32),
+                    model(x))
+            return fn
+
         denoise_models = [
-            model_builder_fn(
-                name=f"level_{i}",
-                **model_params)
-            for i in range(len(x_levels))
+            float32_outputs(m) for m in denoise_models
         ]
 
+    def level_input(i: int, x_level):
+        # every level sees the same level of the previous frame
+        if not temporal_context:
+            return x_level
+        return \
+            keras.layers.Concatenate()(
+                [x_level, x_previous_levels[i]])
+
     # --- add residual between models
     # speeds up training a lot, and better results
     if add_residual_between_models:
@@ -277,7 +376,8 @@ def model_builder(
         current_level_output = None
         for i, x_level in reversed(list(enumerate(x_levels))):
             if previous_level is None:
-                current_level_output = denoise_models[i](x_level)
+                current_level_output = \
+                    denoise_models[i](level_input(i, x_level))
                 previous_level = current_level_output
             else:
                 previous_level = \
@@ -300,14 +400,14 @@ def model_builder(
                 current_level_input = \
                     current_level_input - current_level_input_smoothed
                 current_level_output = \
-                    denoise_models[i](current_level_input)
+                    denoise_models[i](level_input(i, current_level_input))
                 previous_level = \
                     keras.layers.Add()(
                         [previous_level, current_level_output])
             x_levels[i] = current_level_output
     else:
         for i, x_level in enumerate(x_levels):
-            x_levels[i] = denoise_models[i](x_level)
+            x_levels[i] = denoise_models[i](level_input(i, x_level))
 
     # --- split intermediate results and actual results
     x_levels_intermediate = []
@@ -396,6 +496,23 @@ def model_builder(
 # ---------------------------------------------------------------------
 
 
+def reflect_indices(size, padded_size):
+    """
+    indices that reflect pad an axis of length size to padded_size,
+    the same as tf.pad REFLECT but for any pad, the reflection
+    repeats when the pad is larger than the axis
+
+    :param size: int32 scalar, length of the axis
+    :param padded_size: int32 scalar, length after padding
+    :return: int32 Tensor of shape [padded_size]
+    """
+    period = tf.maximum(2 * (size - 1), 1)
+    i = tf.range(padded_size) % period
+    return tf.where(i < size, i, period - i)
+
+# ---------------------------------------------------------------------
+
+
 class DenoisingInferenceModule(tf.Module, abc.ABC):
     """denoising inference module."""
 
@@ -405,7 +522,8 @@ class DenoisingInferenceModule(tf.Module, abc.ABC):
             model_normalize: keras.Model,
             model_denormalize: keras.Model,
             training_channels: int = 1,
-            cast_to_uint8: bool = True):
+            cast_to_uint8: bool = True,
+            pad_multiple: int = None):
         """
         Initializes a module for denoising.
 
@@ -414,6 +532,8 @@ class DenoisingInferenceModule(tf.Module, abc.ABC):
         :param model_denormalize: model that denormalizes the output
         :param training_channels: how many color channels were used in training
         :param cast_to_uint8: cast output to uint8
+        :param pad_multiple: inputs are reflect padded to a multiple of this
+            and cropped back, if None it is derived from the denoiser
 
         """
         # --- argument checking
@@ -425,22 +545,47 @@ class DenoisingInferenceModule(tf.Module, abc.ABC):
             raise ValueError("model_denormalize should not be None")
         if training_channels <= 0:
             raise ValueError("training channels should be > 0")
+        if pad_multiple is None:
+            pad_multiple = receptive_field(model_denoise).alignment
+        if pad_multiple <= 0:
+            raise ValueError("pad_multiple should be > 0")
 
         # --- setup instance variables
+        self._pad_multiple = pad_multiple
         self._cast_to_uint8 = cast_to_uint8
         self._model_denoise = model_denoise
         self._model_normalize = model_normalize
         self._model_denormalize = model_denormalize
         self._training_channels = training_channels
 
-    def _run_inference_on_images(self, image):
+    def _run_inference_on_floats(self, x):
         """
-        Cast image to float and run inference.
+        Pad, normalize, denoise, denormalize and crop a float batch.
 
-        :param image: uint8 Tensor of shape
-        :return: denoised image: uint8 Tensor of shape if the input
+        :param x: float32 Tensor of shape [B, H, W, C] in [0, 255]
+        :return: denoised float32 Tensor of the same shape
         """
-        x = tf.cast(image, dtype=tf.float32)
+        # --- reflect pad to the multiple the pyramid needs,
+        # gathered so inputs smaller than the pad keep reflecting
+        # where tf.pad REFLECT would fail
+        if self._pad_multiple > 1:
+            shape = tf.shape(x)
+            height = shape[1]
+            width = shape[2]
+            x = \
+                tf.gather(
+                    x,
+                    reflect_indices(
+                        size=height,
+                        padded_size=height + (-height) % self._pad_multiple),
+                    axis=1)
+            x = \
+                tf.gather(
+                    x,
+                    reflect_indices(
+                        size=width,
+                        padded_size=width + (-width) % self._pad_multiple),
+                    axis=2)
 
         # --- normalize
         x = self._model_normalize(x)
@@ -451,6 +596,23 @@ class DenoisingInferenceModule(tf.Module, abc.ABC):
         # --- denormalize
         x = self._model_denormalize(x)
 
+        # --- crop back to the input size
+        if self._pad_multiple > 1:
+            x = x[:, :height, :width, :]
+
+        return x
+
+    def _run_inference_on_images(self, image):
+        """
+        Cast image to float and run inference.
+
+        :param image: uint8 Tensor of shape
+        :return: denoised image: uint8 Tensor of shape if the input
+        """
+        x = tf.cast(image, dtype=tf.float32)
+
+        x = self._run_inference_on_floats(x)
+
         # --- cast to uint8
         if self._cast_to_uint8:
             x = tf.round(x)
@@ -471,17 +633,19 @@ class DenoisingInferenceModule1Channel(DenoisingInferenceModule):
             model_denoise: keras.Model = None,
             model_normalize: keras.Model = None,
             model_denormalize: keras.Model = None,
-            cast_to_uint8: bool = True):
+            cast_to_uint8: bool = True,
+            pad_multiple: int = None):
         super().__init__(
             model_denoise=model_denoise,
             model_normalize=model_normalize,
             model_denormalize=model_denormalize,
             training_channels=1,
-            cast_to_uint8=cast_to_uint8)
+            cast_to_uint8=cast_to_uint8,
+            pad_multiple=pad_multiple)
 
     @tf.function(
         input_signature=[
-            tf.TensorSpec(shape=[None, None, None, 1], dtype=tf.uint8)])
+            tf.TensorSpec(shape=[None, None, None, 1], dtype=tf.uint8, name="input")])
     def __call__(self, input_tensor):
         return self._run_inference_on_images(input_tensor)
 
@@ -495,17 +659,19 @@ class DenoisingInferenceModule3Channel(DenoisingInferenceModule):
             model_denoise: keras.Model = None,
             model_normalize: keras.Model = None,
             model_denormalize: keras.Model = None,
-            cast_to_uint8: bool = True):
+            cast_to_uint8: bool = True,
+            pad_multiple: int = None):
         super().__init__(
             model_denoise=model_denoise,
             model_normalize=model_normalize,
             model_denormalize=model_denormalize,
             training_channels=3,
-            cast_to_uint8=cast_to_uint8)
+            cast_to_uint8=cast_to_uint8,
+            pad_multiple=pad_multiple)
 
     @tf.function(
         input_signature=[
-            tf.TensorSpec(shape=[None, None, None, 3], dtype=tf.uint8)])
+            tf.TensorSpec(shape=[None, None, None, 3], dtype=tf.uint8, name="input")])
     def __call__(self, input_tensor):
         return self._run_inference_on_images(input_tensor)
 
@@ -518,7 +684,8 @@ def module_denoiser_builder(
         model_normalize: keras.Model = None,
         model_denormalize: keras.Model = None,
         training_channels: int = 1,
-        cast_to_uint8: bool = True) -> DenoisingInferenceModule:
+        cast_to_uint8: bool = True,
+        pad_multiple: int = None) -> DenoisingInferenceModule:
     """
     builds a module for denoising.
 
@@ -527,13 +694,16 @@ def module_denoiser_builder(
     :param model_denormalize: model that denormalizes the output
     :param training_channels: how many color channels were used in training
     :param cast_to_uint8: cast output to uint8
+    :param pad_multiple: inputs are reflect padded to a multiple of this
+        and cropped back, if None it is derived from the denoiser
 
     :return: denoiser module
     """
     logger.info(
         f"building denoising module with "
         f"training_channels:{training_channels}, "
-        f"cast_to_uint8:{cast_to_uint8}")
+        f"cast_to_uint8:{cast_to_uint8}, "
+        f"pad_multiple:{pad_multiple}")
 
     if training_channels == 1:
         return \
@@ -541,14 +711,16 @@ def module_denoiser_builder(
                 model_denoise=model_denoise,
                 model_normalize=model_normalize,
                 model_denormalize=model_denormalize,
-                cast_to_uint8=cast_to_uint8)
+                cast_to_uint8=cast_to_uint8,
+                pad_multiple=pad_multiple)
     elif training_channels == 3:
         return \
             DenoisingInferenceModule3Channel(
                 model_denoise=model_denoise,
                 model_normalize=model_normalize,
                 model_denormalize=model_denormalize,
-                cast_to_uint8=cast_to_uint8)
+                cast_to_uint8=cast_to_uint8,
+                pad_multiple=pad_multiple)
     else:
         raise ValueError(
             "don't know how to handle training_channels:{0}".format(training_channels))
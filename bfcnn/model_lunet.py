@@ -62,7 +62,8 @@ def lunet_blocks(
             keras.layers.UpSampling2D(
                 size=(2, 2),
                 interpolation="bilinear")(level_x_down)
-        level_x_diff = level_x - level_x_smoothed
+        # layer autocasts, bilinear upsampling outputs float32 under mixed precision
+        level_x_diff = keras.layers.Subtract()([level_x, level_x_smoothed])
         level_x = level_x_down
         levels_x.append(level_x_diff)
     levels_x.append(level_x)
@@ -162,6 +162,7 @@ def build_model_resnet(
         add_learnable_multiplier: bool = False,
         add_projection_to_input: bool = True,
         add_concat_input: bool = False,
+        add_temporal_input: bool = False,
         name="resnet",
         **kwargs) -> keras.Model:
     """
@@ -189,6 +190,9 @@ def build_model_resnet(
     :param add_learnable_multiplier:
     :param add_projection_to_input: if true project to input tensor channel number
     :param add_concat_input: if true concat input to intermediate before projecting
+    :param add_temporal_input: if true the input is the frame and the previous
+        denoised frame concatenated on the channels, the projection and the
+        skip are to the frame channels only
     :param name: name of the model
     :return: resnet model
     """
@@ -196,6 +200,14 @@ def build_model_resnet(
     logger.info("building resnet")
     logger.info(f"parameters not used: {kwargs}")
 
+    # --- argument checking
+    no_channels = input_dims[channel_index]
+    if add_temporal_input:
+        if no_channels % 2 != 0:
+            raise ValueError(
+                "add_temporal_input needs [frame, previous frame] channels")
+        no_channels = no_channels // 2
+
     # --- setup parameters
     bn_params = dict(
         center=use_bias,
@@ -276,7 +288,7 @@ def build_model_resnet(
         use_bias=use_bias,
         # this must be linear because it is capped later
         activation="linear",
-        filters=input_dims[channel_index],
+        filters=no_channels,
         kernel_regularizer=kernel_regularizer,
         kernel_initializer=kernel_initializer
     )
@@ -325,6 +337,11 @@ def build_model_resnet(
             shape=input_dims)
     x = input_layer
     y = input_layer
+    y_concat = input_layer
+
+    # skip with the frame, the previous frame is context only
+    if add_temporal_input:
+        y = input_layer[..., 0:no_channels]
 
     if add_var:
         _, x_var = \
@@ -360,7 +377,7 @@ def build_model_resnet(
 
     # optional concat and mix with input
     if add_concat_input:
-        y_tmp = y
+        y_tmp = y_concat
         if use_bn:
             y_tmp = tf.keras.layers.BatchNormalization(**bn_params)(y_tmp)
         x = tf.keras.layers.Concatenate()([x, y_tmp])
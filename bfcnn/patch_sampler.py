@@ -0,0 +1,192 @@
+r"""random native resolution patches from large training images"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import tensorflow as tf
+from pathlib import Path
+from typing import List, Union
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+from .preprocess import list_images
+
+# ---------------------------------------------------------------------
+
+DEFAULT_PATCHES_PER_IMAGE = 8
+
+# ---------------------------------------------------------------------
+
+
+def sample_patches(
+        contents: tf.Tensor,
+        patch_shape: List[int],
+        patches_per_image: int,
+        channels: int,
+        seed: tf.Tensor) -> tf.Tensor:
+    """
+    patches_per_image random [patch_h, patch_w] patches of an encoded image
+    at its native resolution, jpegs are only decoded inside the window
+    that covers the patches, other formats are decoded fully
+
+    images smaller than a patch are resized up to the patch size
+    in the dimension they are missing
+
+    :param contents: encoded image
+    :param patch_shape: [height, width] of the patches
+    :param patches_per_image: number of patches
+    :param channels: channels to decode
+    :param seed: [2] seed of the patch positions
+    :return: [patches_per_image, patch_h, patch_w, channels] uint8 patches
+    """
+    patch_h, patch_w = int(patch_shape[0]), int(patch_shape[1])
+
+    def offsets(height, width):
+        # top left corner of every patch, 0 if the image is too small
+        max_offset = \
+            tf.stack([
+                tf.maximum(height - patch_h, 0),
+                tf.maximum(width - patch_w, 0)])
+        u = \
+            tf.random.stateless_uniform(
+                shape=(patches_per_image, 2),
+                seed=seed,
+                dtype=tf.float32)
+        return \
+            tf.minimum(
+                tf.cast(u * tf.cast(max_offset + 1, tf.float32), tf.int32),
+                max_offset)
+
+    def decode_jpeg_window():
+        shape = tf.image.extract_jpeg_shape(contents, output_type=tf.int32)
+        patch_offsets = offsets(shape[0], shape[1])
+        top_left = tf.reduce_min(patch_offsets, axis=0)
+        bottom_right = \
+            tf.minimum(
+                tf.reduce_max(patch_offsets, axis=0) + [patch_h, patch_w],
+                shape[0:2])
+        image = \
+            tf.io.decode_and_crop_jpeg(
+                contents,
+                crop_window=tf.concat([top_left, bottom_right - top_left], axis=0),
+                channels=channels)
+        return image, patch_offsets - top_left
+
+    def decode_full():
+        image = \
+            tf.io.decode_image(
+                contents,
+                channels=channels,
+                expand_animations=False)
+        shape = tf.shape(image)
+        return image, offsets(shape[0], shape[1])
+
+    image, patch_offsets = \
+        tf.cond(
+            tf.io.is_jpeg(contents),
+            decode_jpeg_window,
+            decode_full)
+
+    # stretch images smaller than a patch
+    shape = tf.shape(image)
+    image = \
+        tf.cond(
+            tf.logical_or(shape[0] < patch_h, shape[1] < patch_w),
+            lambda: tf.cast(
+                tf.clip_by_value(
+                    tf.round(
+                        tf.image.resize(
+                            image,
+                            size=tf.maximum(shape[0:2], [patch_h, patch_w]),
+                            method="bilinear")),
+                    0, 255),
+                dtype=tf.uint8),
+            lambda: image)
+
+    # gather the rows and then the columns of every patch
+    rows = patch_offsets[:, 0:1] + tf.range(patch_h)[tf.newaxis, :]
+    cols = patch_offsets[:, 1:2] + tf.range(patch_w)[tf.newaxis, :]
+    patches = tf.gather(image, rows, axis=0)
+    patches = tf.gather(patches, cols, axis=2, batch_dims=1)
+    patches.set_shape([patches_per_image, patch_h, patch_w, channels])
+    return patches
+
+# ---------------------------------------------------------------------
+
+
+def patches_dataset(
+        directory: Union[str, Path],
+        patch_shape: List[int],
+        patches_per_image: int = DEFAULT_PATCHES_PER_IMAGE,
+        channels: int = 3,
+        shuffle_buffer_size: int = 1024,
+        seed: int = None,
+        no_pipelines: int = 1,
+        pipeline_id: int = 0) -> tf.data.Dataset:
+    """
+    float32 [patch_h, patch_w, C] patches of the images of a directory,
+    every decoded image gives patches_per_image patches and the patches
+    of the different images are shuffled together
+
+    :param directory: directory of images
+    :param patch_shape: [height, width] of the patches
+    :param patches_per_image: patches drawn from every decoded image
+    :param channels: channels to decode
+    :param shuffle_buffer_size: patches in the shuffle buffer
+    :param seed: seed of the image order and the patch positions
+    :param no_pipelines: number of input pipelines sharing the directory
+    :param pipeline_id: index of this input pipeline
+    :return: unbatched dataset
+    """
+    # --- argument checking
+    if patches_per_image <= 0:
+        raise ValueError("patches_per_image must be > 0")
+    if len(patch_shape) < 2:
+        raise ValueError("patch_shape must be [height, width]")
+    files = list_images(directory)[pipeline_id::no_pipelines]
+    if len(files) == 0:
+        raise ValueError(f"no images found in [{directory}]")
+    logger.info(
+        f"sampling [{patches_per_image}] patches of {list(patch_shape[0:2])} "
+        f"from each of [{len(files)}] images of [{directory}]")
+
+    # a seed per image, new every epoch
+    image_seeds = \
+        tf.data.Dataset.random(
+            seed=seed,
+            rerandomize_each_iteration=True).batch(2)
+    dataset = \
+        tf.data.Dataset.from_tensor_slices(files) \
+            .shuffle(
+                buffer_size=len(files),
+                seed=seed,
+                reshuffle_each_iteration=True)
+    dataset = \
+        tf.data.Dataset.zip((dataset, image_seeds)).map(
+            map_func=lambda path, image_seed:
+                sample_patches(
+                    contents=tf.io.read_file(path),
+                    patch_shape=patch_shape,
+                    patches_per_image=patches_per_image,
+                    channels=channels,
+                    seed=tf.random.experimental.stateless_fold_in(
+                        image_seed, pipeline_id)),
+            num_parallel_calls=tf.data.AUTOTUNE)
+    return \
+        dataset \
+            .unbatch() \
+            .shuffle(
+                buffer_size=shuffle_buffer_size,
+                seed=seed,
+                reshuffle_each_iteration=True) \
+            .map(lambda x: tf.cast(x, dtype=tf.float32))
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,374 @@
+r"""decode and resize training images once into sharded uint8 tfrecords"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import argparse
+import tensorflow as tf
+from pathlib import Path
+from typing import Dict, List, Union
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+
+SHARDS_METADATA_STR = "shards.json"
+SHARD_FILENAME_FORMAT = "shard-{0:05d}-of-{1:05d}.tfrecord"
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png")
+COLOR_MODE_CHANNELS = {"grayscale": 1, "rgb": 3, "rgba": 4}
+DEFAULT_NO_SHARDS = 16
+
+# ---------------------------------------------------------------------
+
+
+def list_images(directory: Union[str, Path]) -> List[str]:
+    """
+    all the image files under a directory, in a fixed order
+
+    :param directory: root directory, searched recursively
+    :return: sorted list of paths
+    """
+    return sorted([
+        str(p)
+        for p in Path(str(directory)).rglob("*")
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+    ])
+
+# ---------------------------------------------------------------------
+
+
+def load_image_uint8(
+        path: tf.Tensor,
+        height: int,
+        width: int,
+        channels: int,
+        interpolation: str = "bilinear") -> tf.Tensor:
+    """
+    decodes an image file and resizes it like image_dataset_from_directory,
+    rounded to uint8
+
+    :param path: string tensor of the file path
+    :param height: height to resize to
+    :param width: width to resize to
+    :param channels: channels to decode
+    :param interpolation: resize method
+    :return: [height, width, channels] uint8 image
+    """
+    x = tf.io.read_file(path)
+    x = tf.image.decode_image(
+        x, channels=channels, expand_animations=False)
+    x = tf.image.resize(x, [height, width], method=interpolation)
+    x.set_shape([height, width, channels])
+    x = tf.clip_by_value(tf.round(x), 0, 255)
+    return tf.cast(x, dtype=tf.uint8)
+
+# ---------------------------------------------------------------------
+
+
+def _patches(image: tf.Tensor, patch_shape: List[int]) -> tf.Tensor:
+    """
+    non overlapping grid of [patch_h, patch_w] patches of an [H, W, C] image,
+    borders that do not fill a patch are dropped
+    """
+    patch_h, patch_w = patch_shape[0], patch_shape[1]
+    no_h = image.shape[0] // patch_h
+    no_w = image.shape[1] // patch_w
+    channels = image.shape[2]
+    x = image[:no_h * patch_h, :no_w * patch_w, :]
+    x = tf.reshape(x, [no_h, patch_h, no_w, patch_w, channels])
+    x = tf.transpose(x, [0, 2, 1, 3, 4])
+    return tf.reshape(x, [no_h * no_w, patch_h, patch_w, channels])
+
+
+def preprocess_images(
+        directory: Union[str, Path],
+        output_directory: Union[str, Path],
+        dataset_shape: List[int],
+        color_mode: str = "rgb",
+        patch_shape: List[int] = None,
+        no_shards: int = DEFAULT_NO_SHARDS,
+        interpolation: str = "bilinear") -> Dict:
+    """
+    decodes every image of a directory, resizes it to dataset_shape
+    (as image_dataset_from_directory does) and writes the rounded uint8
+    pixels into sharded tfrecords, optionally cut into fixed size patches
+
+    the shards are read back by the dataset with the "shards" input,
+    so jpeg decoding and resizing only happen once
+
+    :param directory: directory of images
+    :param output_directory: directory to write the shards into
+    :param dataset_shape: [height, width] the images are resized to
+    :param color_mode: grayscale, rgb or rgba
+    :param patch_shape: [height, width] of the patches, None for full images
+    :param no_shards: number of shard files
+    :param interpolation: resize method
+    :return: metadata dictionary, also written to shards.json
+    """
+    # --- argument checking
+    if color_mode not in COLOR_MODE_CHANNELS:
+        raise ValueError(f"don't know how to handle color_mode [{color_mode}]")
+    if len(dataset_shape) < 2:
+        raise ValueError("dataset_shape must be [height, width]")
+    if no_shards <= 0:
+        raise ValueError("no_shards must be > 0")
+    if patch_shape is not None:
+        if patch_shape[0] > dataset_shape[0] or \
+                patch_shape[1] > dataset_shape[1]:
+            raise ValueError("patch_shape must fit in dataset_shape")
+    files = list_images(directory)
+    if len(files) == 0:
+        raise ValueError(f"no images found in [{directory}]")
+    Path(str(output_directory)).mkdir(parents=True, exist_ok=True)
+
+    channels = COLOR_MODE_CHANNELS[color_mode]
+    height, width = int(dataset_shape[0]), int(dataset_shape[1])
+
+    def load_fn(path):
+        x = \
+            load_image_uint8(
+                path,
+                height=height,
+                width=width,
+                channels=channels,
+                interpolation=interpolation)
+        if patch_shape is None:
+            return tf.expand_dims(x, axis=0)
+        return _patches(x, patch_shape)
+
+    # --- decode in parallel, write round robin into the shards
+    start_time = time.time()
+    dataset = \
+        tf.data.Dataset.from_tensor_slices(files) \
+            .map(load_fn, num_parallel_calls=tf.data.AUTOTUNE) \
+            .unbatch() \
+            .prefetch(tf.data.AUTOTUNE)
+    no_shards = min(no_shards, len(files))
+    shard_files = [
+        SHARD_FILENAME_FORMAT.format(i, no_shards)
+        for i in range(no_shards)
+    ]
+    writers = [
+        tf.io.TFRecordWriter(os.path.join(str(output_directory), f))
+        for f in shard_files
+    ]
+    no_images = 0
+    shape = None
+    try:
+        for x in dataset:
+            x = x.numpy()
+            shape = list(x.shape)
+            example = \
+                tf.train.Example(
+                    features=tf.train.Features(feature={
+                        "image": tf.train.Feature(
+                            bytes_list=tf.train.BytesList(value=[x.tobytes()]))
+                    }))
+            writers[no_images % no_shards].write(example.SerializeToString())
+            no_images += 1
+    finally:
+        for w in writers:
+            w.close()
+
+    metadata = {
+        "shape": shape,
+        "files": shard_files,
+        "no_images": no_images,
+        "no_source_images": len(files),
+        "color_mode": color_mode,
+        "dataset_shape": [height, width],
+        "patch_shape": None if patch_shape is None else list(patch_shape[0:2])
+    }
+    with open(os.path.join(str(output_directory), SHARDS_METADATA_STR), "w") as f:
+        json.dump(metadata, f, indent=4)
+    logger.info(
+        f"wrote [{no_images}] images of shape {shape} from [{len(files)}] files "
+        f"into [{no_shards}] shards in [{time.time() - start_time:.2f}] sec")
+    return metadata
+
+# ---------------------------------------------------------------------
+
+
+def load_shards_metadata(directory: Union[str, Path]) -> Dict:
+    """
+    reads the metadata written by preprocess_images
+
+    :param directory: shards directory
+    :return: metadata dictionary
+    """
+    path = os.path.join(str(directory), SHARDS_METADATA_STR)
+    if not os.path.isfile(path):
+        raise ValueError(f"no [{SHARDS_METADATA_STR}] in [{directory}]")
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def shards_dataset(
+        directory: Union[str, Path],
+        channels: int = None,
+        shuffle: bool = True,
+        shuffle_buffer_size: int = 1024,
+        seed: int = None,
+        no_pipelines: int = 1,
+        pipeline_id: int = 0) -> tf.data.Dataset:
+    """
+    float32 [H, W, C] images from the shards of a directory, the shard
+    files are read with parallel interleave and the records are only
+    reshaped, nothing is decoded
+
+    :param directory: shards directory
+    :param channels: channels to convert to, None to keep the stored ones
+    :param shuffle: shuffle files and images every epoch
+    :param shuffle_buffer_size: images in the shuffle buffer
+    :param seed: shuffling seed
+    :param no_pipelines: number of input pipelines sharing the shards
+    :param pipeline_id: index of this input pipeline
+    :return: unbatched dataset
+    """
+    metadata = load_shards_metadata(directory)
+    shape = metadata["shape"]
+    files = [
+        os.path.join(str(directory), f)
+        for f in metadata["files"]
+    ]
+
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    # whole files per pipeline when there are enough of them
+    shard_files = no_pipelines > 1 and len(files) >= no_pipelines
+    shard_records = no_pipelines > 1 and not shard_files
+    if shard_files:
+        dataset = dataset.shard(no_pipelines, pipeline_id)
+    if shuffle:
+        dataset = \
+            dataset.shuffle(
+                buffer_size=len(files),
+                seed=seed,
+                reshuffle_each_iteration=True)
+    dataset = \
+        dataset.interleave(
+            tf.data.TFRecordDataset,
+            cycle_length=min(len(files), 8),
+            num_parallel_calls=tf.data.AUTOTUNE,
+            # records are split by position between the pipelines
+            deterministic=shard_records)
+    if shard_records:
+        dataset = dataset.shard(no_pipelines, pipeline_id)
+    if shuffle:
+        dataset = \
+            dataset.shuffle(
+                buffer_size=shuffle_buffer_size,
+                seed=seed,
+                reshuffle_each_iteration=True)
+
+    def parse_fn(record):
+        features = \
+            tf.io.parse_single_example(
+                record,
+                features={"image": tf.io.FixedLenFeature([], tf.string)})
+        x = tf.io.decode_raw(features["image"], tf.uint8)
+        x = tf.reshape(x, shape)
+        if channels is not None and channels != shape[2]:
+            if channels == 1 and shape[2] >= 3:
+                x = tf.image.rgb_to_grayscale(x[:, :, 0:3])
+            elif channels == 3 and shape[2] == 1:
+                x = tf.image.grayscale_to_rgb(x)
+            else:
+                raise ValueError(
+                    f"cannot convert [{shape[2]}] channels to [{channels}]")
+        return tf.cast(x, dtype=tf.float32)
+
+    return dataset.map(parse_fn, num_parallel_calls=tf.data.AUTOTUNE)
+
+# ---------------------------------------------------------------------
+
+
+def main(args):
+    # --- argument checking
+    if not os.path.isdir(args.directory):
+        raise ValueError(
+            "Image directory [{0}] is not valid".format(args.directory))
+
+    preprocess_images(
+        directory=args.directory,
+        output_directory=args.output_directory,
+        dataset_shape=args.dataset_shape,
+        color_mode=args.color_mode,
+        patch_shape=args.patch_shape,
+        no_shards=args.no_shards)
+
+    return 0
+
+# ---------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    # define arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--directory",
+        default="",
+        dest="directory",
+        help="Directory of training images")
+
+    parser.add_argument(
+        "--output-directory",
+        default="",
+        dest="output_directory",
+        help="Directory to write the shards into")
+
+    parser.add_argument(
+        "--dataset-shape",
+        nargs=2,
+        type=int,
+        default=[256, 256],
+        dest="dataset_shape",
+        help="Height and width the images are resized to")
+
+    parser.add_argument(
+        "--patch-shape",
+        nargs=2,
+        type=int,
+        default=None,
+        dest="patch_shape",
+        help="Height and width of non overlapping patches, "
+             "full images if not set")
+
+    parser.add_argument(
+        "--color-mode",
+        default="rgb",
+        dest="color_mode",
+        choices=list(COLOR_MODE_CHANNELS.keys()),
+        help="Channels of the stored images")
+
+    parser.add_argument(
+        "--no-shards",
+        type=int,
+        default=DEFAULT_NO_SHARDS,
+        dest="no_shards",
+        help="Number of shard files")
+
+    parser.add_argument(
+        "--version",
+        action="version",
+        version="%(prog)s (version {version})".format(version=__version__))
+
+    # parse the arguments and pass them to main
+    args = parser.parse_args()
+
+    sys.exit(main(args))
+
+# ---------------------------------------------------------------------
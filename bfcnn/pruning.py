@@ -1,7 +1,9 @@
 r"""build weight pruning strategies"""
 
+import time
 import keras
 import numpy as np
+import tensorflow as tf
 from enum import Enum
 from sklearn.decomposition import PCA
 from sklearn.preprocessing import StandardScaler
@@ -13,6 +15,18 @@ from typing import Dict, Callable, List, Tuple, Union
 
 from .custom_logger import logger
 from .constants import CONFIG_STR, TYPE_STR
+from .utilities import \
+    FunctionalGraph, \
+    is_plain_conv2d, \
+    is_unpadded_conv2d, \
+    rebuild_functional_model
+
+# ---------------------------------------------------------------------
+
+DEFAULT_LATENCY_ITERATIONS = 10
+# cpu kernels vectorize over blocks of channels,
+# odd channel counts can be slower than the unpruned model
+DEFAULT_CHANNEL_MULTIPLE = 8
 
 # ---------------------------------------------------------------------
 
@@ -65,6 +79,42 @@ def reshape_to_2d_to_4d(
 # ---------------------------------------------------------------------
 
 
+def channel_scores(
+        x: np.ndarray) -> np.ndarray:
+    """
+    mean absolute weight of every filter of a [kh, kw, cin, cout] kernel
+
+    :param x: kernel
+    :return: [cout] scores
+    """
+    return np.mean(np.abs(x), axis=tuple(range(len(x.shape) - 1)))
+
+
+def dead_channels(
+        scores: np.ndarray,
+        strategy: "PruneStrategy",
+        **kwargs) -> np.ndarray:
+    """
+    boolean mask of the channels a structured strategy removes
+
+    :param scores: [cout] channel scores
+    :param strategy: CHANNEL_MINIMUM_THRESHOLD or CHANNEL_DROP_BOTTOM
+    :return: [cout] mask
+    """
+    if strategy == PruneStrategy.CHANNEL_MINIMUM_THRESHOLD:
+        minimum_threshold = kwargs["minimum_threshold"]
+        return np.logical_or(scores < minimum_threshold, scores <= 0.0)
+    elif strategy == PruneStrategy.CHANNEL_DROP_BOTTOM:
+        percentage = kwargs["percentage"]
+        mask = scores <= 0.0
+        mask[np.argsort(scores, kind="stable")[:int(np.round(len(scores) * percentage))]] = True
+        return mask
+    raise ValueError(f"[{strategy}] is not a structured strategy")
+
+
+# ---------------------------------------------------------------------
+
+
 class PruneStrategy(Enum):
     """
     do nothing, experimental
@@ -96,6 +146,24 @@ class PruneStrategy(Enum):
     """
     DROP_BOTTOM = 5
 
+    """
+    every conv2d filter with mean absolute weight below a threshold becomes zero,
+    prune_channels removes them from the model
+    """
+    CHANNEL_MINIMUM_THRESHOLD = 6
+
+    """
+    sorts the conv2d filters by mean absolute weight and zeros out the bottom X percent,
+    prune_channels removes them from the model
+    """
+    CHANNEL_DROP_BOTTOM = 7
+
+    def is_structured(self) -> bool:
+        return self in [
+            PruneStrategy.CHANNEL_MINIMUM_THRESHOLD,
+            PruneStrategy.CHANNEL_DROP_BOTTOM
+        ]
+
     @staticmethod
     def from_string(type_str: str) -> "PruneStrategy":
         # --- argument checking
@@ -201,6 +269,16 @@ def prune_strategy_helper(
             x_threshold = x_sorted[x_threshold_index]
             x_p[np.abs(x_p) < x_threshold] = 0.0
             return x_p
+    elif strategy.is_structured():
+        def fn(x: np.ndarray) -> np.ndarray:
+            x_p = x.copy()
+            # only conv2d kernels have filters,
+            # biases and depthwise kernels are left as they are
+            if len(x_p.shape) != 4 or x_p.shape[3] <= 1:
+                return x_p
+            mask = dead_channels(channel_scores(x_p), strategy, **kwargs)
+            x_p[..., mask] = 0.0
+            return x_p
     elif strategy == PruneStrategy.NONE:
         def fn(x: np.ndarray) -> np.ndarray:
             return x
@@ -337,3 +415,362 @@ def get_conv2d_weights(
     return np.concatenate(weights)
 
 # ---------------------------------------------------------------------
+
+
+def _is_per_channel(node) -> bool:
+    """
+    true for nodes that act on every channel independently
+    """
+    layer = node.layer
+    if len(node.flat_input_ids) != 1:
+        return False
+    if isinstance(layer, (keras.layers.Activation, keras.layers.ReLU)):
+        return True
+    if isinstance(layer, keras.layers.DepthwiseConv2D):
+        return layer.depth_multiplier == 1
+    if isinstance(layer, keras.layers.BatchNormalization):
+        axis = layer.axis if isinstance(layer.axis, (list, tuple)) else [layer.axis]
+        rank = node.keras_inputs[0].shape.rank
+        return rank == 4 and len(axis) == 1 and axis[0] in [-1, rank - 1]
+    return False
+
+
+def _constant_through(
+        node,
+        v: np.ndarray) -> np.ndarray:
+    """
+    output of a per channel node for a spatially constant input per channel
+    """
+    layer = node.layer
+    if isinstance(layer, keras.layers.BatchNormalization):
+        mean = layer.moving_mean.numpy()
+        variance = layer.moving_variance.numpy()
+        gamma = layer.gamma.numpy() if layer.scale else 1.0
+        beta = layer.beta.numpy() if layer.center else 0.0
+        return gamma * (v - mean) / np.sqrt(variance + layer.epsilon) + beta
+    if isinstance(layer, keras.layers.DepthwiseConv2D):
+        v = v * np.sum(layer.depthwise_kernel.numpy()[:, :, :, 0], axis=(0, 1))
+        if layer.use_bias:
+            v = v + layer.bias.numpy()
+        return layer.activation(tf.constant(v, dtype=tf.float32)).numpy()
+    return layer(tf.constant(v[np.newaxis, np.newaxis, np.newaxis, :], dtype=tf.float32)).numpy()[0, 0, 0]
+
+
+def _export_config(layer) -> Dict:
+    # pruned copies are for inference, regularizers (possibly custom) are dropped
+    config = layer.get_config()
+    for key in list(config.keys()):
+        if key.endswith("_regularizer") or key.endswith("_constraint"):
+            config[key] = None
+    return config
+
+
+def _sliced_layer(layer, keep: np.ndarray):
+    """
+    copy of a per channel layer keeping only the given channels
+    """
+    if isinstance(layer, (keras.layers.Activation, keras.layers.ReLU)):
+        return layer
+    new_layer = layer.__class__.from_config(_export_config(layer))
+    new_layer.build(tf.TensorShape([None, None, None, len(keep)]))
+    if isinstance(layer, keras.layers.DepthwiseConv2D):
+        weights = [layer.depthwise_kernel.numpy()[:, :, keep, :]]
+        if layer.use_bias:
+            weights.append(layer.bias.numpy()[keep])
+    else:
+        weights = [w[keep] for w in layer.get_weights()]
+    new_layer.set_weights(weights)
+    return new_layer
+
+
+def _pruned_conv2d(
+        conv: keras.layers.Conv2D,
+        input_keep: np.ndarray = None,
+        input_constants: np.ndarray = None,
+        output_keep: np.ndarray = None) -> keras.layers.Conv2D:
+    """
+    copy of a conv2d without the removed input / output channels, the
+    constant value of every removed input channel is moved into the bias
+    """
+    kernel = conv.kernel.numpy()
+    bias = np.zeros(kernel.shape[3], dtype=kernel.dtype)
+    if conv.use_bias:
+        bias = conv.bias.numpy()
+    use_bias = conv.use_bias
+
+    if input_keep is not None:
+        # input_keep holds per group local indices of the kept input channels
+        groups = conv.groups
+        cin_group = kernel.shape[2]
+        cout_group = kernel.shape[3] // groups
+        new_kernel = []
+        for g in range(groups):
+            outputs = slice(g * cout_group, (g + 1) * cout_group)
+            kernel_group = kernel[:, :, :, outputs]
+            removed = np.setdiff1d(np.arange(cin_group), input_keep[g])
+            constants = input_constants[g * cin_group + removed]
+            bias[outputs] += \
+                np.sum(
+                    kernel_group[:, :, removed, :] *
+                    constants[np.newaxis, np.newaxis, :, np.newaxis],
+                    axis=(0, 1, 2))
+            new_kernel.append(kernel_group[:, :, input_keep[g], :])
+        kernel = np.concatenate(new_kernel, axis=3)
+        use_bias = True
+
+    if output_keep is not None:
+        kernel = kernel[..., output_keep]
+        bias = bias[output_keep]
+
+    config = _export_config(conv)
+    config["filters"] = kernel.shape[3]
+    config["use_bias"] = use_bias
+    config["bias_initializer"] = "zeros"
+    layer = keras.layers.Conv2D.from_config(config)
+    layer.build(tf.TensorShape([None, None, None, kernel.shape[2] * conv.groups]))
+    weights = [kernel]
+    if use_bias:
+        weights.append(bias)
+    layer.set_weights(weights)
+    return layer
+
+# ---------------------------------------------------------------------
+
+
+def _plan_channel_pruning(
+        model: keras.Model,
+        strategy: PruneStrategy,
+        channel_multiple: int,
+        **kwargs):
+    """
+    finds conv -> (per channel layers) -> conv chains inside a functional
+    model and the channels of the first conv that can be removed
+
+    :return: dropped node ids (always empty), replacement layers by node id
+    """
+    graph = FunctionalGraph(model)
+    nodes = graph.nodes
+    output_ids = graph.output_ids
+    consumers = graph.consumers
+    single_use = graph.single_use
+
+    output_keep = {}
+    input_keep = {}
+    input_constants = {}
+    chain_keep = {}
+    for node in nodes:
+        producer = node.layer
+        if not is_plain_conv2d(producer) or \
+                producer.groups != 1 or \
+                not single_use(producer):
+            continue
+        # --- follow per channel layers to the consuming convolution
+        chain = []
+        consumer = None
+        t_id = node.flat_output_ids[0]
+        while t_id not in output_ids and len(consumers[t_id]) == 1:
+            c = consumers[t_id][0]
+            if len(c.flat_input_ids) != 1 or not single_use(c.layer):
+                break
+            if is_plain_conv2d(c.layer):
+                consumer = c
+                break
+            if not _is_per_channel(c):
+                break
+            chain.append(c)
+            t_id = c.flat_output_ids[0]
+        if consumer is None or id(consumer) in input_keep:
+            continue
+        # the constant of a removed channel is exact in the bias only
+        # when no zero padding reaches the consumer kernel
+        if not is_unpadded_conv2d(consumer.layer):
+            continue
+
+        # --- pick channels, balanced over the consumer groups
+        kernel = producer.kernel.numpy()
+        scores = channel_scores(kernel)
+        groups = consumer.layer.groups
+        cin_group = len(scores) // groups
+        # the rule is applied per group so percentages stay balanced
+        alive = [
+            int(np.sum(~dead_channels(
+                scores[g * cin_group:(g + 1) * cin_group], strategy, **kwargs)))
+            for g in range(groups)
+        ]
+        k = max(max(alive), 1)
+        k = min(int(np.ceil(k / channel_multiple)) * channel_multiple, cin_group)
+        if k == cin_group:
+            continue
+        keep_local = [
+            np.sort(np.argsort(-scores[g * cin_group:(g + 1) * cin_group], kind="stable")[:k])
+            for g in range(groups)
+        ]
+        keep = np.concatenate([
+            g * cin_group + keep_local[g]
+            for g in range(groups)
+        ])
+
+        # --- constant value of every channel once its filter is removed
+        v = np.zeros(len(scores), dtype=np.float32)
+        if producer.use_bias:
+            v = producer.bias.numpy()
+        v = producer.activation(tf.constant(v)).numpy()
+        for c in chain:
+            v = _constant_through(c, v)
+
+        output_keep[id(node)] = (node, keep)
+        input_keep[id(consumer)] = (consumer, keep_local)
+        input_constants[id(consumer)] = v
+        for c in chain:
+            chain_keep[id(c)] = (c, keep)
+
+    replaced = {}
+    for node_id in set(output_keep.keys()).union(input_keep.keys()):
+        node = output_keep.get(node_id, input_keep.get(node_id))[0]
+        replaced[node_id] = \
+            _pruned_conv2d(
+                conv=node.layer,
+                input_keep=input_keep.get(node_id, (None, None))[1],
+                input_constants=input_constants.get(node_id, None),
+                output_keep=output_keep.get(node_id, (None, None))[1])
+    for node_id, (node, keep) in chain_keep.items():
+        replaced[node_id] = _sliced_layer(node.layer, keep)
+    return set(), replaced
+
+# ---------------------------------------------------------------------
+
+
+def prune_channels(
+        model: keras.Model,
+        strategy: PruneStrategy = PruneStrategy.CHANNEL_MINIMUM_THRESHOLD,
+        channel_multiple: int = DEFAULT_CHANNEL_MULTIPLE,
+        **kwargs) -> keras.Model:
+    """
+    removes whole channels of conv2d layers and rebuilds a physically smaller
+    model with the surviving weights copied in
+
+    a channel is removable when its conv2d feeds a single 1x1 (or valid
+    padded) conv2d through per channel layers only (batch normalization,
+    depthwise scaling, activations), as inside the resnet blocks, the
+    constant a removed channel still contributes is moved into the bias of
+    the consuming conv2d, consumers with zero padding are skipped since the
+    constant would be wrong at the borders
+
+    :param model: functional keras model with trained weights
+    :param strategy: CHANNEL_MINIMUM_THRESHOLD (minimum_threshold)
+        or CHANNEL_DROP_BOTTOM (percentage)
+    :param channel_multiple: surviving channels per layer are rounded up
+        to a multiple of this, weakest channels are kept to fill it
+    :return: pruned model, the input model is not modified
+    """
+    # --- argument checking
+    if model is None:
+        raise ValueError("model cannot be None")
+    if not strategy.is_structured():
+        raise ValueError(f"[{strategy}] is not a structured strategy")
+    if channel_multiple <= 0:
+        raise ValueError("channel_multiple must be > 0")
+
+    def plan_fn(m: keras.Model):
+        return _plan_channel_pruning(m, strategy, channel_multiple, **kwargs)
+
+    pruned = rebuild_functional_model(model, plan_fn=plan_fn)
+    logger.info(
+        f"pruned channels of [{model.name}] with [{strategy.to_string()}], "
+        f"parameters [{model.count_params()}] -> [{pruned.count_params()}]")
+    return pruned
+
+# ---------------------------------------------------------------------
+
+
+def count_flops(
+        model: keras.Model,
+        input_shape: List[int]) -> int:
+    """
+    floating point operations of a single forward pass
+
+    :param model: keras model
+    :param input_shape: [H, W, C] of the input
+    :return: flops
+    """
+    from tensorflow.python.framework.convert_to_constants import \
+        convert_variables_to_constants_v2_as_graph
+
+    concrete_function = \
+        tf.function(lambda x: model(x, training=False)).get_concrete_function(
+            tf.TensorSpec(shape=[1] + list(input_shape), dtype=tf.float32))
+    _, graph_def = \
+        convert_variables_to_constants_v2_as_graph(concrete_function)
+    with tf.Graph().as_default() as graph:
+        tf.graph_util.import_graph_def(graph_def, name="")
+        options = \
+            tf.compat.v1.profiler.ProfileOptionBuilder(
+                tf.compat.v1.profiler.ProfileOptionBuilder.float_operation()
+            ).with_empty_output().build()
+        profile = \
+            tf.compat.v1.profiler.profile(
+                graph=graph,
+                run_meta=tf.compat.v1.RunMetadata(),
+                cmd="op",
+                options=options)
+    return int(profile.total_float_ops)
+
+
+def measure_latency(
+        model: keras.Model,
+        input_shape: List[int],
+        iterations: int = DEFAULT_LATENCY_ITERATIONS) -> float:
+    """
+    median cpu latency of a single forward pass in milliseconds
+
+    :param model: keras model
+    :param input_shape: [H, W, C] of the input
+    :param iterations: timed runs
+    :return: latency in milliseconds
+    """
+    fn = tf.function(lambda x: model(x, training=False))
+    x = \
+        tf.random.uniform(
+            shape=[1] + list(input_shape),
+            minval=-0.5,
+            maxval=+0.5)
+    _ = fn(x)
+    latencies = []
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        _ = tf.nest.map_structure(lambda y: y.numpy(), fn(x))
+        latencies.append(time.perf_counter() - start_time)
+    return float(np.median(latencies) * 1000.0)
+
+
+def channel_pruning_report(
+        model: keras.Model,
+        pruned: keras.Model,
+        input_shape: List[int],
+        iterations: int = DEFAULT_LATENCY_ITERATIONS) -> Dict:
+    """
+    flops, parameters and latency before and after channel pruning
+
+    :param model: original model
+    :param pruned: pruned model
+    :param input_shape: [H, W, C] of the input
+    :param iterations: timed runs
+    :return: report dictionary
+    """
+    report = {
+        "input_shape": list(input_shape),
+        "parameters_before": int(model.count_params()),
+        "parameters_after": int(pruned.count_params()),
+        "flops_before": count_flops(model, input_shape),
+        "flops_after": count_flops(pruned, input_shape),
+        "latency_ms_before": measure_latency(model, input_shape, iterations),
+        "latency_ms_after": measure_latency(pruned, input_shape, iterations)
+    }
+    report["flops_ratio"] = \
+        report["flops_after"] / max(report["flops_before"], 1)
+    report["speedup"] = \
+        report["latency_ms_before"] / max(report["latency_ms_after"], 1e-6)
+    logger.info(f"channel pruning report: {report}")
+    return report
+
+# ---------------------------------------------------------------------
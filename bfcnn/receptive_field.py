@@ -0,0 +1,266 @@
+r"""receptive field and alignment calculation for built denoiser graphs"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import numpy as np
+from tensorflow import keras
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+
+ReceptiveField = namedtuple(
+    "ReceptiveField",
+    [
+        # how far (in input pixels) a pixel's influence reaches
+        "radius",
+        # full extent of the receptive field (2 * radius + 1)
+        "size",
+        # input dimensions must be a multiple of this
+        "alignment",
+        # stride of the output relative to the input
+        "output_stride",
+        # true if some part of the graph depends on the whole image
+        "is_global"
+    ])
+
+# ---------------------------------------------------------------------
+
+# receptive field of a single tensor,
+# radius and jump are expressed in input pixels
+Field = namedtuple(
+    "Field",
+    [
+        "radius",
+        "jump",
+        "alignment",
+        "is_global"
+    ])
+
+# ---------------------------------------------------------------------
+
+
+def _as_pair(x) -> List:
+    if isinstance(x, (list, tuple)):
+        return list(x)
+    return [x, x]
+
+# ---------------------------------------------------------------------
+
+
+def _merge_fields(
+        fields: List[Optional[Field]]) -> Optional[Field]:
+    """
+    pointwise combination of several tensors
+    """
+    fields = [f for f in fields if f is not None]
+    if len(fields) == 0:
+        return None
+    return Field(
+        radius=max(f.radius for f in fields),
+        jump=min(f.jump for f in fields),
+        alignment=max(f.alignment for f in fields),
+        is_global=any(f.is_global for f in fields))
+
+# ---------------------------------------------------------------------
+
+
+def _is_spatial_reduction(layer, output_tensors) -> bool:
+    """
+    true if the layer collapses the spatial dimensions
+    (global pooling, global mean / sigma lambdas)
+    """
+    if isinstance(layer, (keras.layers.GlobalAveragePooling2D,
+                          keras.layers.GlobalMaxPooling2D)):
+        return True
+    for t in output_tensors:
+        shape = t.shape
+        if shape.rank is None:
+            continue
+        if shape.rank < 4:
+            return True
+        if shape[1] == 1 and shape[2] == 1:
+            return True
+    return False
+
+# ---------------------------------------------------------------------
+
+
+def _layer_field(
+        layer,
+        input_fields: List[Optional[Field]],
+        output_tensors) -> List[Optional[Field]]:
+    """
+    propagate the receptive field through a single layer
+
+    :param layer: keras layer
+    :param input_fields: fields of the layer inputs
+    :param output_tensors: output tensors of the layer
+    :return: fields of the layer outputs
+    """
+    # --- nested models are walked recursively
+    if isinstance(layer, keras.Model):
+        return _model_fields(layer, input_fields)
+
+    field = _merge_fields(input_fields)
+    if field is None:
+        return [None] * len(output_tensors)
+
+    # --- convolutions and pooling
+    kernel_size = None
+    strides = None
+    dilation_rate = [1, 1]
+    if isinstance(layer, keras.layers.Conv2DTranspose):
+        raise ValueError("transpose convolutions are not supported")
+    if isinstance(layer, (keras.layers.Conv2D,
+                          keras.layers.DepthwiseConv2D,
+                          keras.layers.SeparableConv2D)):
+        kernel_size = _as_pair(layer.kernel_size)
+        strides = _as_pair(layer.strides)
+        dilation_rate = _as_pair(layer.dilation_rate)
+    elif isinstance(layer, (keras.layers.AveragePooling2D,
+                            keras.layers.MaxPooling2D)):
+        kernel_size = _as_pair(layer.pool_size)
+        strides = _as_pair(layer.strides)
+
+    if kernel_size is not None:
+        half_extent = \
+            max((k - 1) * d / 2.0 for k, d in zip(kernel_size, dilation_rate))
+        jump = field.jump * max(strides)
+        field = Field(
+            radius=field.radius + half_extent * field.jump,
+            jump=jump,
+            alignment=max(field.alignment, jump),
+            is_global=field.is_global)
+    elif isinstance(layer, keras.layers.UpSampling2D):
+        size = max(_as_pair(layer.size))
+        # bilinear interpolation reaches one low resolution pixel
+        reach = 1.0 if layer.interpolation != "nearest" else 0.0
+        field = Field(
+            radius=field.radius + reach * field.jump,
+            jump=field.jump / size,
+            alignment=field.alignment,
+            is_global=field.is_global)
+    elif _is_spatial_reduction(layer, output_tensors):
+        field = Field(
+            radius=field.radius,
+            jump=field.jump,
+            alignment=field.alignment,
+            is_global=True)
+
+    # everything else is pointwise
+    return [field] * len(output_tensors)
+
+# ---------------------------------------------------------------------
+
+
+def _model_fields(
+        model: keras.Model,
+        input_fields: List[Optional[Field]]) -> List[Optional[Field]]:
+    """
+    walk a functional model from its inputs to its outputs
+
+    :param model: functional keras model
+    :param input_fields: fields of the model inputs
+    :return: fields of the model outputs
+    """
+    if len(model.inputs) != len(input_fields):
+        raise ValueError(
+            f"model [{model.name}] expects [{len(model.inputs)}] inputs, "
+            f"got [{len(input_fields)}]")
+
+    fields = {
+        id(t): f
+        for t, f in zip(model.inputs, input_fields)
+    }
+
+    nodes_by_depth = model._nodes_by_depth
+    for depth in sorted(nodes_by_depth.keys(), reverse=True):
+        for node in nodes_by_depth[depth]:
+            layer = node.layer
+            if isinstance(layer, keras.layers.InputLayer):
+                continue
+            inputs = node.keras_inputs
+            outputs = node.outputs
+            if not isinstance(outputs, (list, tuple)):
+                outputs = [outputs]
+            outputs = list(outputs)
+            node_fields = \
+                _layer_field(
+                    layer=layer,
+                    input_fields=[fields.get(id(t), None) for t in inputs],
+                    output_tensors=outputs)
+            for t, f in zip(outputs, node_fields):
+                fields[id(t)] = f
+
+    return [fields.get(id(t), None) for t in model.outputs]
+
+# ---------------------------------------------------------------------
+
+
+def receptive_field(
+        model: keras.Model) -> ReceptiveField:
+    """
+    walks a (possibly nested) functional model and reports
+    the receptive field and the alignment constraints of its outputs
+
+    :param model: functional keras model, for example the denoiser
+        produced by model_builder
+    :return: ReceptiveField
+    """
+    # --- argument checking
+    if model is None:
+        raise ValueError("model cannot be None")
+    if not isinstance(model, keras.Model):
+        raise ValueError("model must be a keras.Model")
+
+    input_fields = [
+        Field(radius=0.0, jump=1.0, alignment=1.0, is_global=False)
+        for _ in model.inputs
+    ]
+    output_fields = _model_fields(model, input_fields)
+    output_field = _merge_fields(output_fields)
+    if output_field is None:
+        raise ValueError(
+            f"model [{model.name}] outputs do not depend on its inputs")
+
+    radius = int(np.ceil(output_field.radius))
+    result = \
+        ReceptiveField(
+            radius=radius,
+            size=2 * radius + 1,
+            alignment=int(np.ceil(output_field.alignment)),
+            output_stride=float(output_field.jump),
+            is_global=bool(output_field.is_global))
+    logger.info(f"model [{model.name}] receptive field: {result}")
+    return result
+
+# ---------------------------------------------------------------------
+
+
+def receptive_field_to_dict(
+        field: ReceptiveField) -> Dict:
+    """
+    converts a ReceptiveField to a json serializable dictionary
+    """
+    return {
+        "radius": int(field.radius),
+        "size": int(field.size),
+        "alignment": int(field.alignment),
+        "output_stride": float(field.output_stride),
+        "is_global": bool(field.is_global)
+    }
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,268 @@
+r"""process wide cache of loaded saved models with warm-up"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import time
+import threading
+import tensorflow as tf
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Tuple, Callable
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+
+DEFAULT_MAX_MODELS = 4
+# no memory limit
+DEFAULT_MAX_BYTES = -1
+# [batch, height, width], the channels come from the model
+DEFAULT_WARMUP_SHAPES = [(1, 256, 256)]
+
+# ---------------------------------------------------------------------
+
+
+def model_input_spec(model) -> Tuple[int, tf.DType]:
+    """
+    number of input channels and input dtype of a loaded saved_model,
+    3 channels uint8 if the model has no input signature
+    """
+    try:
+        spec = model.__call__.concrete_functions[0].structured_input_signature
+        return int(spec[0][0].shape[-1]), spec[0][0].dtype
+    except Exception:
+        return 3, tf.uint8
+
+
+def model_channels(model) -> int:
+    """
+    number of input channels of a loaded saved_model
+    """
+    return model_input_spec(model)[0]
+
+
+def directory_bytes(path: str) -> int:
+    """
+    size of the files of a saved_model, a proxy of its memory
+    """
+    if not os.path.isdir(path):
+        return 0
+    return sum([
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    ])
+
+
+def rss_bytes() -> int:
+    """
+    resident memory of the process, -1 if not available
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return -1
+
+# ---------------------------------------------------------------------
+
+
+class ModelRegistry:
+    """
+    thread safe cache of loaded models keyed by path
+
+    every path is loaded once, threads asking for a model that is being
+    loaded wait for the same load, a loaded model is called once on every
+    warm-up shape so the first request does not pay for the graph
+    initialization, the least recently used models are evicted when there
+    are more than max_models or their files exceed max_bytes
+    """
+
+    def __init__(
+            self,
+            max_models: int = DEFAULT_MAX_MODELS,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            warmup_shapes: List[Tuple[int, int, int]] = None,
+            loader: Callable = None):
+        """
+        :param max_models: maximum number of cached models, -1 for no limit
+        :param max_bytes: maximum size of the cached models, -1 for no limit
+        :param warmup_shapes: [batch, height, width] inputs to warm up with
+        :param loader: function loading a path, tf.saved_model.load by default
+        """
+        if max_models == 0:
+            raise ValueError("max_models must be > 0 or -1")
+        self._max_models = max_models
+        self._max_bytes = max_bytes
+        self._warmup_shapes = \
+            DEFAULT_WARMUP_SHAPES if warmup_shapes is None else warmup_shapes
+        self._loader = tf.saved_model.load if loader is None else loader
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._loads = 0
+        self._failed = 0
+        self._evictions = 0
+
+    # ---------------------------------------------------------------------
+
+    def _warmup(self, model) -> float:
+        start_time = time.time()
+        channels, dtype = model_input_spec(model)
+        for batch, height, width in self._warmup_shapes:
+            model(tf.zeros(shape=(batch, height, width, channels), dtype=dtype))
+        return time.time() - start_time
+
+    def _load(self, path: str, entry: Dict):
+        rss_before = rss_bytes()
+        start_time = time.time()
+        model = self._loader(path)
+        entry["load_seconds"] = time.time() - start_time
+        entry["warmup_seconds"] = self._warmup(model)
+        entry["bytes"] = directory_bytes(path)
+        if rss_before >= 0:
+            entry["rss_delta_bytes"] = rss_bytes() - rss_before
+        logger.info(
+            f"loaded model [{path}] in [{entry['load_seconds']:.2f}] sec, "
+            f"warm-up [{entry['warmup_seconds']:.2f}] sec")
+        return model
+
+    def _evict(self, keep: str):
+        # least recently used first, models still loading are skipped
+        def over_limit():
+            loaded = [
+                e for e in self._entries.values() if e["future"].done()
+            ]
+            if 0 < self._max_models < len(loaded):
+                return True
+            return 0 <= self._max_bytes < sum([e["bytes"] for e in loaded])
+
+        while over_limit():
+            candidates = [
+                p for p, e in self._entries.items()
+                if p != keep and e["future"].done()
+            ]
+            if len(candidates) == 0:
+                break
+            self._entries.pop(candidates[0])
+            self._evictions += 1
+            logger.info(f"evicted model [{candidates[0]}]")
+
+    # ---------------------------------------------------------------------
+
+    def get(self, path: str):
+        """
+        the cached model of a path, loaded and warmed up on first use
+
+        :param path: saved_model directory
+        :return: loaded model
+        """
+        path = str(path)
+        with self._lock:
+            entry = self._entries.get(path, None)
+            owner = entry is None
+            if owner:
+                entry = {
+                    "future": Future(),
+                    "bytes": 0,
+                    "hits": 0,
+                    "load_seconds": 0.0,
+                    "warmup_seconds": 0.0,
+                    "rss_delta_bytes": -1
+                }
+                self._entries[path] = entry
+            else:
+                self._entries.move_to_end(path)
+                entry["hits"] += 1
+                self._hits += 1
+
+        if owner:
+            try:
+                model = self._load(path, entry)
+            except BaseException as e:
+                with self._lock:
+                    # the next request tries again
+                    if self._entries.get(path, None) is entry:
+                        self._entries.pop(path)
+                    self._failed += 1
+                entry["future"].set_exception(e)
+                raise
+            entry["future"].set_result(model)
+            with self._lock:
+                self._loads += 1
+                self._evict(keep=path)
+
+        return entry["future"].result()
+
+    def evict(self, path: str) -> bool:
+        """
+        forgets a cached model, callers holding it keep it alive
+
+        :param path: saved_model directory
+        :return: true if the model was cached
+        """
+        with self._lock:
+            entry = self._entries.pop(str(path), None)
+            if entry is not None:
+                self._evictions += 1
+            return entry is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """
+        load time and memory statistics of the registry and its models
+        """
+        with self._lock:
+            models = {
+                p: {
+                    "bytes": e["bytes"],
+                    "hits": e["hits"],
+                    "load_seconds": e["load_seconds"],
+                    "warmup_seconds": e["warmup_seconds"],
+                    "rss_delta_bytes": e["rss_delta_bytes"]
+                }
+                for p, e in self._entries.items()
+                if e["future"].done()
+            }
+            return {
+                "models": models,
+                "hits": self._hits,
+                "loads": self._loads,
+                "failed": self._failed,
+                "evictions": self._evictions,
+                "bytes": sum([m["bytes"] for m in models.values()]),
+                "rss_bytes": rss_bytes()
+            }
+
+# ---------------------------------------------------------------------
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def default_registry() -> ModelRegistry:
+    """
+    the process wide registry used by bfcnn.load_model
+    """
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = ModelRegistry()
+        return _default_registry
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,544 @@
+r"""dynamic micro-batching inference server with a local http endpoint"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+import numpy as np
+import tensorflow as tf
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple, Callable
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+from .registry import model_channels
+
+# ---------------------------------------------------------------------
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_LATENCY_MS = 10.0
+DEFAULT_LATENCY_WINDOW = 1024
+
+# ---------------------------------------------------------------------
+
+
+class ServerStats:
+    """thread safe throughput, queue depth and latency statistics"""
+
+    def __init__(
+            self,
+            window: int = DEFAULT_LATENCY_WINDOW):
+        """
+        :param window: how many recent latencies to keep for the percentiles
+        """
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self._latencies = deque(maxlen=window)
+        self._batch_sizes = deque(maxlen=window)
+        self._completed = 0
+        self._failed = 0
+        self._batches = 0
+        self._queue_depth = 0
+
+    def enqueued(self):
+        with self._lock:
+            self._queue_depth += 1
+
+    def dequeued(self, n: int):
+        with self._lock:
+            self._queue_depth -= n
+
+    def batch_done(
+            self,
+            latencies: List[float],
+            failed: bool = False):
+        with self._lock:
+            self._batches += 1
+            self._batch_sizes.append(len(latencies))
+            if failed:
+                self._failed += len(latencies)
+            else:
+                self._completed += len(latencies)
+                self._latencies.extend(latencies)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            elapsed = max(time.time() - self._start_time, 1e-6)
+            latencies = np.array(self._latencies, dtype=np.float64)
+            batch_sizes = np.array(self._batch_sizes, dtype=np.float64)
+            result = {
+                "completed": self._completed,
+                "failed": self._failed,
+                "batches": self._batches,
+                "queue_depth": self._queue_depth,
+                "uptime_s": elapsed,
+                "throughput_images_per_s": self._completed / elapsed,
+                "mean_batch_size":
+                    float(np.mean(batch_sizes)) if len(batch_sizes) > 0 else 0.0,
+                "latency_p50_ms": 0.0,
+                "latency_p99_ms": 0.0
+            }
+            if len(latencies) > 0:
+                result["latency_p50_ms"] = \
+                    float(np.percentile(latencies, 50) * 1000.0)
+                result["latency_p99_ms"] = \
+                    float(np.percentile(latencies, 99) * 1000.0)
+            return result
+
+# ---------------------------------------------------------------------
+
+
+class MicroBatcher:
+    """
+    groups same-shape requests into batches within a latency deadline
+    and runs them on a thread pool
+    """
+
+    def __init__(
+            self,
+            model_fn: Callable,
+            max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+            max_latency_ms: float = DEFAULT_MAX_LATENCY_MS,
+            workers: int = DEFAULT_WORKERS,
+            stats: ServerStats = None):
+        """
+        :param model_fn: callable that maps a uint8 [B, H, W, C] batch
+            to a [B, H, W, C] batch
+        :param max_batch_size: maximum images per batch
+        :param max_latency_ms: maximum time a request waits for a batch to fill
+        :param workers: number of threads running batches
+        :param stats: statistics collector, created if None
+        """
+        # --- argument checking
+        if model_fn is None:
+            raise ValueError("model_fn cannot be None")
+        if max_batch_size <= 0:
+            raise ValueError("max_batch_size must be > 0")
+        if max_latency_ms < 0:
+            raise ValueError("max_latency_ms must be >= 0")
+        if workers <= 0:
+            raise ValueError("workers must be > 0")
+
+        self._model_fn = model_fn
+        self._max_batch_size = max_batch_size
+        self._max_latency = max_latency_ms / 1000.0
+        self._stats = stats if stats is not None else ServerStats()
+        self._queue = queue.Queue()
+        self._executor = \
+            ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix="bfcnn_batch")
+        # guards closing against requests queued behind the sentinel
+        self._lock = threading.Lock()
+        self._closed = False
+        self._running = True
+        self._dispatcher = \
+            threading.Thread(
+                target=self._dispatch,
+                name="bfcnn_dispatcher",
+                daemon=True)
+        self._dispatcher.start()
+
+    @property
+    def stats(self) -> ServerStats:
+        return self._stats
+
+    def submit(self, image: np.ndarray) -> Future:
+        """
+        queue a single uint8 [H, W, C] image
+
+        :return: future that resolves to the denoised [H, W, C] image
+        """
+        image = np.asarray(image)
+        if len(image.shape) != 3:
+            raise ValueError("image must be [H, W, C]")
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("batcher is closed")
+            self._stats.enqueued()
+            self._queue.put((image, future, time.time()))
+        return future
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        return self.submit(image).result()
+
+    def _run_batch(
+            self,
+            requests: List[Tuple[np.ndarray, Future, float]]):
+        self._stats.dequeued(len(requests))
+        try:
+            batch = np.stack([r[0] for r in requests], axis=0)
+            results = np.asarray(self._model_fn(batch))
+        except Exception as e:
+            logger.error(f"batch of [{len(requests)}] failed: {e}")
+            for _, future, _ in requests:
+                future.set_exception(e)
+            self._stats.batch_done([0.0] * len(requests), failed=True)
+            return
+        now = time.time()
+        latencies = []
+        for i, (_, future, enqueue_time) in enumerate(requests):
+            future.set_result(results[i])
+            latencies.append(now - enqueue_time)
+        self._stats.batch_done(latencies)
+
+    def _dispatch(self):
+        # shape -> list of pending requests
+        pending = {}
+        while self._running or len(pending) > 0:
+            # --- wait until the oldest pending request expires
+            timeout = None
+            if len(pending) > 0:
+                oldest = min(v[0][2] for v in pending.values())
+                timeout = max(oldest + self._max_latency - time.time(), 0.0)
+            try:
+                request = self._queue.get(timeout=timeout)
+                if request is None:
+                    self._running = False
+                else:
+                    pending.setdefault(request[0].shape, []).append(request)
+            except queue.Empty:
+                pass
+
+            # --- flush full or expired groups
+            now = time.time()
+            for shape in list(pending.keys()):
+                group = pending[shape]
+                while len(group) >= self._max_batch_size:
+                    self._executor.submit(
+                        self._run_batch, group[:self._max_batch_size])
+                    group = group[self._max_batch_size:]
+                expired = \
+                    len(group) > 0 and \
+                    (now - group[0][2] >= self._max_latency or
+                     not self._running)
+                if expired:
+                    self._executor.submit(self._run_batch, group)
+                    group = []
+                if len(group) > 0:
+                    pending[shape] = group
+                else:
+                    del pending[shape]
+
+    def close(self):
+        """
+        flush everything pending and stop the worker threads
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+# ---------------------------------------------------------------------
+
+
+def _encode_image(image: np.ndarray, image_format: str) -> bytes:
+    image = tf.convert_to_tensor(image)
+    if image.dtype != tf.uint8:
+        image = \
+            tf.cast(
+                tf.clip_by_value(tf.round(image), 0, 255),
+                dtype=tf.uint8)
+    if image_format == "jpeg":
+        return tf.io.encode_jpeg(image).numpy()
+    return tf.io.encode_png(image).numpy()
+
+# ---------------------------------------------------------------------
+
+
+def build_request_handler(
+        batcher: MicroBatcher,
+        channels: int):
+    """
+    builds the http request handler class bound to a batcher
+
+    endpoints:
+        POST /denoise : encoded png/jpeg image in, png (or jpeg) image out
+        GET  /stats   : json statistics
+        GET  /health  : liveness
+
+    :param batcher: micro batcher that runs the model
+    :param channels: number of channels the model expects
+    """
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self):
+            # unix sockets have no (host, port) client address
+            if isinstance(self.client_address, tuple):
+                return super().address_string()
+            return "unix"
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+        def _reply(self, code: int, body: bytes, content_type: str):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _reply_json(self, code: int, data: Dict):
+            self._reply(
+                code,
+                json.dumps(data).encode("utf-8"),
+                "application/json")
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply_json(200, batcher.stats.to_dict())
+            elif self.path == "/health":
+                self._reply_json(200, {"status": "ok"})
+            else:
+                self._reply_json(404, {"error": f"unknown path [{self.path}]"})
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/denoise":
+                self._reply_json(404, {"error": f"unknown path [{self.path}]"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                data = self.rfile.read(length)
+                image = \
+                    tf.io.decode_image(
+                        data,
+                        channels=channels,
+                        expand_animations=False).numpy()
+            except Exception as e:
+                self._reply_json(400, {"error": f"could not decode image: {e}"})
+                return
+            try:
+                result = batcher(image)
+            except Exception as e:
+                self._reply_json(500, {"error": str(e)})
+                return
+            image_format = "png"
+            if "jpeg" in self.headers.get("Accept", ""):
+                image_format = "jpeg"
+            self._reply(
+                200,
+                _encode_image(result, image_format),
+                f"image/{image_format}")
+
+    return RequestHandler
+
+# ---------------------------------------------------------------------
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """threaded http server over a unix socket"""
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+# ---------------------------------------------------------------------
+
+
+class DenoiseServer:
+    """loads a model once and serves it over http with micro batching"""
+
+    def __init__(
+            self,
+            model_fn: Callable,
+            channels: int = 3,
+            host: str = DEFAULT_HOST,
+            port: int = DEFAULT_PORT,
+            unix_socket: str = None,
+            max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+            max_latency_ms: float = DEFAULT_MAX_LATENCY_MS,
+            workers: int = DEFAULT_WORKERS):
+        """
+        :param model_fn: callable that maps a uint8 [B, H, W, C] batch
+        :param channels: number of channels the model expects
+        :param host: host to bind, ignored when unix_socket is set
+        :param port: port to bind, 0 picks a free port
+        :param unix_socket: path of a unix socket to bind instead of tcp
+        :param max_batch_size: maximum images per batch
+        :param max_latency_ms: maximum time a request waits for a batch to fill
+        :param workers: number of threads running batches
+        """
+        self.batcher = \
+            MicroBatcher(
+                model_fn=model_fn,
+                max_batch_size=max_batch_size,
+                max_latency_ms=max_latency_ms,
+                workers=workers)
+        handler = \
+            build_request_handler(
+                batcher=self.batcher,
+                channels=channels)
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            self.httpd = UnixHTTPServer(unix_socket, handler)
+        else:
+            self.httpd = ThreadingHTTPServer((host, port), handler)
+            self.httpd.daemon_threads = True
+        self.unix_socket = unix_socket
+        self._thread = None
+        # shutdown waits for serve_forever, it hangs if that never ran
+        self._started = False
+
+    @property
+    def address(self):
+        if self.unix_socket is not None:
+            return self.unix_socket
+        return self.httpd.server_address
+
+    def serve_forever(self):
+        logger.info(f"serving on [{self.address}]")
+        self._started = True
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.close()
+
+    def start(self) -> "DenoiseServer":
+        """
+        serve on a background thread
+        """
+        self._thread = \
+            threading.Thread(
+                target=self.httpd.serve_forever,
+                name="bfcnn_server",
+                daemon=True)
+        self._started = True
+        self._thread.start()
+        logger.info(f"serving on [{self.address}]")
+        return self
+
+    def close(self):
+        if self._started:
+            self.httpd.shutdown()
+            self._started = False
+        self.httpd.server_close()
+        self.batcher.close()
+        if self.unix_socket is not None and \
+                os.path.exists(self.unix_socket):
+            os.remove(self.unix_socket)
+
+# ---------------------------------------------------------------------
+
+
+def main(args):
+    # --- load model once
+    from . import load_model
+    model = load_model(args.model)
+    channels = model_channels(model)
+
+    def model_fn(x: np.ndarray) -> np.ndarray:
+        return model(tf.convert_to_tensor(x, dtype=tf.uint8)).numpy()
+
+    server = \
+        DenoiseServer(
+            model_fn=model_fn,
+            channels=channels,
+            host=args.host,
+            port=args.port,
+            unix_socket=args.unix_socket,
+            max_batch_size=args.max_batch_size,
+            max_latency_ms=args.max_latency_ms,
+            workers=args.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("shutting down")
+
+    return 0
+
+# ---------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    # define arguments
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--model",
+        required=True,
+        type=str,
+        dest="model",
+        help="pretrained model name or path to a saved_model")
+
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        type=str,
+        dest="host",
+        help="host to bind")
+
+    parser.add_argument(
+        "--port",
+        default=DEFAULT_PORT,
+        type=int,
+        dest="port",
+        help="port to bind")
+
+    parser.add_argument(
+        "--unix-socket",
+        default=None,
+        type=str,
+        dest="unix_socket",
+        help="bind to a unix socket instead of tcp")
+
+    parser.add_argument(
+        "--max-batch-size",
+        default=DEFAULT_MAX_BATCH_SIZE,
+        type=int,
+        dest="max_batch_size",
+        help="maximum images per batch")
+
+    parser.add_argument(
+        "--max-latency-ms",
+        default=DEFAULT_MAX_LATENCY_MS,
+        type=float,
+        dest="max_latency_ms",
+        help="maximum time a request waits for a batch to fill")
+
+    parser.add_argument(
+        "--workers",
+        default=DEFAULT_WORKERS,
+        type=int,
+        dest="workers",
+        help="number of threads running batches")
+
+    parser.add_argument(
+        "--version",
+        action="version",
+        version="%(prog)s (version {version})".format(version=__version__))
+
+    # parse the arguments and pass them to main
+    args = parser.parse_args()
+
+    sys.exit(main(args))
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,367 @@
+r"""streaming denoiser for video and frame sequences"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import time
+import queue
+import threading
+import numpy as np
+from collections import deque
+from typing import Dict, List, Iterable, Iterator, Callable
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_LATENCY_WINDOW = 1024
+
+STAGES = ["decode", "denoise", "encode"]
+
+# no temporal context, every frame is denoised on its own
+TEMPORAL_NONE = "none"
+# the previous denoised frame is concatenated to the channels of the input,
+# for models built with temporal_context (see model_denoise.py)
+TEMPORAL_CONCAT = "concat"
+# the denoised frame is blended with the previous denoised frame where they
+# agree, works with every model
+TEMPORAL_BLEND = "blend"
+
+TEMPORAL_MODES = [TEMPORAL_NONE, TEMPORAL_CONCAT, TEMPORAL_BLEND]
+
+DEFAULT_TEMPORAL_STRENGTH = 0.5
+# mean absolute difference in [0, 255] above which a pixel is moving
+DEFAULT_TEMPORAL_THRESHOLD = 10.0
+
+# ---------------------------------------------------------------------
+
+
+class StreamStats:
+    """thread safe frame counts, dropped frames and per stage latencies"""
+
+    def __init__(
+            self,
+            target_fps: float = None,
+            window: int = DEFAULT_LATENCY_WINDOW,
+            clock: Callable = time.time):
+        """
+        :param target_fps: the frame rate the stream should sustain
+        :param window: how many recent latencies to keep for the percentiles
+        :param clock: returns the current time in seconds
+        """
+        self._lock = threading.Lock()
+        self._clock = clock
+        self._target_fps = target_fps
+        self._start_time = clock()
+        self._latencies = {s: deque(maxlen=window) for s in STAGES}
+        self._frames_in = 0
+        self._frames_out = 0
+        self._dropped = 0
+
+    def frame_in(self):
+        with self._lock:
+            self._frames_in += 1
+
+    def frame_out(self):
+        with self._lock:
+            self._frames_out += 1
+
+    def dropped(self):
+        with self._lock:
+            self._dropped += 1
+
+    def stage_done(self, stage: str, latency: float):
+        with self._lock:
+            self._latencies[stage].append(latency)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            elapsed = max(self._clock() - self._start_time, 1e-6)
+            result = {
+                "frames_in": self._frames_in,
+                "frames_out": self._frames_out,
+                "dropped": self._dropped,
+                "elapsed_s": elapsed,
+                "fps": self._frames_out / elapsed,
+                "target_fps": self._target_fps
+            }
+            for stage in STAGES:
+                latencies = np.array(self._latencies[stage], dtype=np.float64)
+                result[f"{stage}_p50_ms"] = 0.0
+                result[f"{stage}_p99_ms"] = 0.0
+                if len(latencies) > 0:
+                    result[f"{stage}_p50_ms"] = \
+                        float(np.percentile(latencies, 50) * 1000.0)
+                    result[f"{stage}_p99_ms"] = \
+                        float(np.percentile(latencies, 99) * 1000.0)
+            return result
+
+# ---------------------------------------------------------------------
+
+
+def temporal_blend(
+        denoised: np.ndarray,
+        previous: np.ndarray,
+        strength: float = DEFAULT_TEMPORAL_STRENGTH,
+        threshold: float = DEFAULT_TEMPORAL_THRESHOLD) -> np.ndarray:
+    """
+    recursive temporal filter, moves every pixel of the denoised frame
+    towards the previous denoised frame by up to strength, less so
+    the more the two differ, so moving pixels keep the current frame
+
+    :param denoised: [H, W, C] denoised frame
+    :param previous: [H, W, C] previous output frame
+    :param strength: weight of the previous frame where nothing moves
+    :param threshold: difference at which the weight falls to 1/e
+    :return: [H, W, C] blended frame, same dtype as denoised
+    """
+    x = denoised.astype(np.float32)
+    p = previous.astype(np.float32)
+    difference = np.mean(np.abs(x - p), axis=-1, keepdims=True)
+    weight = strength * np.exp(-np.square(difference / threshold))
+    x += weight * (p - x)
+    if np.issubdtype(denoised.dtype, np.integer):
+        info = np.iinfo(denoised.dtype)
+        x = np.clip(np.round(x), info.min, info.max)
+    return x.astype(denoised.dtype)
+
+# ---------------------------------------------------------------------
+
+
+class StreamingDenoiser:
+    """
+    denoises a stream of frames, decode, denoise and encode run on their own
+    threads connected by bounded queues, so the stages of consecutive frames
+    overlap
+
+    with a target fps the source is read at that rate, a frame that finds
+    the denoise queue full replaces the oldest queued frame, which is
+    dropped, so latency stays bounded when the model is slower than the
+    stream, without a target fps the stages block and nothing is dropped
+    """
+
+    def __init__(
+            self,
+            model_fn: Callable,
+            decode_fn: Callable = None,
+            encode_fn: Callable = None,
+            target_fps: float = None,
+            queue_size: int = DEFAULT_QUEUE_SIZE,
+            temporal: str = TEMPORAL_NONE,
+            temporal_strength: float = DEFAULT_TEMPORAL_STRENGTH,
+            temporal_threshold: float = DEFAULT_TEMPORAL_THRESHOLD,
+            clock: Callable = time.time,
+            sleep: Callable = time.sleep):
+        """
+        :param model_fn: denoiser, [1, H, W, C] -> [1, H, W, C]
+        :param decode_fn: source item -> [H, W, C] frame, identity if None
+        :param encode_fn: [H, W, C] denoised frame -> output, identity if None
+        :param target_fps: rate to sustain, frames are dropped to keep it
+        :param queue_size: frames waiting between two stages
+        :param temporal: none, concat or blend
+        :param temporal_strength: weight of the previous frame, blend only
+        :param temporal_threshold: motion threshold, blend only
+        :param clock: returns the current time in seconds, for the pacing
+            and the latencies
+        :param sleep: waits for a number of seconds, for the pacing
+        """
+        # --- argument checking
+        if model_fn is None:
+            raise ValueError("model_fn cannot be None")
+        if target_fps is not None and target_fps <= 0:
+            raise ValueError("target_fps must be > 0")
+        if queue_size <= 0:
+            raise ValueError("queue_size must be > 0")
+        if temporal not in TEMPORAL_MODES:
+            raise ValueError(
+                f"temporal [{temporal}] must be one of {TEMPORAL_MODES}")
+        if not 0.0 <= temporal_strength < 1.0:
+            raise ValueError("temporal_strength must be in [0, 1)")
+        if temporal_threshold <= 0:
+            raise ValueError("temporal_threshold must be > 0")
+
+        self._model_fn = model_fn
+        self._decode_fn = decode_fn
+        self._encode_fn = encode_fn
+        self._target_fps = target_fps
+        self._queue_size = queue_size
+        self._temporal = temporal
+        self._temporal_strength = temporal_strength
+        self._temporal_threshold = temporal_threshold
+        self._clock = clock
+        self._sleep = sleep
+        self._stats = StreamStats(target_fps=target_fps, clock=clock)
+
+    def stats(self) -> Dict:
+        return self._stats.to_dict()
+
+    # ---------------------------------------------------------------------
+
+    def _denoise(self, frame: np.ndarray, previous: np.ndarray) -> np.ndarray:
+        x = frame
+        if self._temporal == TEMPORAL_CONCAT:
+            # the first frame is its own context
+            context = frame if previous is None else previous
+            x = np.concatenate([frame, context], axis=-1)
+        y = np.asarray(self._model_fn(x[np.newaxis, ...]))[0]
+        if self._temporal == TEMPORAL_BLEND and previous is not None:
+            y = \
+                temporal_blend(
+                    denoised=y,
+                    previous=previous,
+                    strength=self._temporal_strength,
+                    threshold=self._temporal_threshold)
+        return y
+
+    def run(self, frames: Iterable) -> Iterator:
+        """
+        denoises the frames of a source
+
+        :param frames: iterable of source items, a generator for live streams
+        :return: iterator over the encoded denoised frames, in order
+        """
+        stop = threading.Event()
+        end = object()
+        errors = []
+        decoded = queue.Queue(maxsize=self._queue_size)
+        denoised = queue.Queue(maxsize=self._queue_size)
+        encoded = queue.Queue(maxsize=self._queue_size)
+
+        def put(q: queue.Queue, item):
+            # blocks until there is room unless the stream is stopped
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def put_or_drop(q: queue.Queue, item):
+            # keeps the newest frames, the oldest queued one is dropped
+            while not stop.is_set():
+                try:
+                    q.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                        self._stats.dropped()
+                    except queue.Empty:
+                        pass
+
+        def get(q: queue.Queue):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return end
+
+        def stage(fn: Callable):
+            def wrapper():
+                try:
+                    fn()
+                except BaseException as e:
+                    logger.error(f"stream stage failed: {e}")
+                    errors.append(e)
+                    stop.set()
+            return wrapper
+
+        def decode_stage():
+            period = None if self._target_fps is None else 1.0 / self._target_fps
+            next_time = self._clock()
+            for item in frames:
+                if stop.is_set():
+                    return
+                self._stats.frame_in()
+                start_time = self._clock()
+                frame = item if self._decode_fn is None else self._decode_fn(item)
+                frame = np.asarray(frame)
+                self._stats.stage_done("decode", self._clock() - start_time)
+                if period is None:
+                    put(decoded, frame)
+                else:
+                    put_or_drop(decoded, frame)
+                    # pace the source at the target rate
+                    next_time = max(next_time + period, self._clock() - period)
+                    delay = next_time - self._clock()
+                    if delay > 0:
+                        self._sleep(delay)
+            put(decoded, end)
+
+        def denoise_stage():
+            previous = None
+            while True:
+                frame = get(decoded)
+                if frame is end:
+                    break
+                # a new resolution starts a new sequence
+                if previous is not None and previous.shape[0:2] != frame.shape[0:2]:
+                    previous = None
+                start_time = self._clock()
+                previous = self._denoise(frame, previous)
+                self._stats.stage_done("denoise", self._clock() - start_time)
+                put(denoised, previous)
+            put(denoised, end)
+
+        def encode_stage():
+            while True:
+                frame = get(denoised)
+                if frame is end:
+                    break
+                start_time = self._clock()
+                output = frame if self._encode_fn is None else self._encode_fn(frame)
+                self._stats.stage_done("encode", self._clock() - start_time)
+                put(encoded, output)
+            put(encoded, end)
+
+        threads = [
+            threading.Thread(target=stage(fn), name=f"bfcnn-stream-{name}", daemon=True)
+            for name, fn in zip(STAGES, [decode_stage, denoise_stage, encode_stage])
+        ]
+        for t in threads:
+            t.start()
+
+        try:
+            while True:
+                output = get(encoded)
+                if output is end:
+                    break
+                self._stats.frame_out()
+                yield output
+        finally:
+            # the consumer stopped early or a stage failed
+            stop.set()
+            for t in threads:
+                t.join()
+        if len(errors) > 0:
+            raise errors[0]
+
+# ---------------------------------------------------------------------
+
+
+def denoise_stream(
+        model_fn: Callable,
+        frames: Iterable,
+        **kwargs) -> Iterator:
+    """
+    denoises the frames of a source, see StreamingDenoiser
+
+    :param model_fn: denoiser, [1, H, W, C] -> [1, H, W, C]
+    :param frames: iterable of source items
+    :param kwargs: arguments of the StreamingDenoiser
+    :return: iterator over the encoded denoised frames
+    """
+    return StreamingDenoiser(model_fn=model_fn, **kwargs).run(frames)
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,207 @@
+r"""run exported tflite denoisers without tensorflow"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import os
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Dict, Union
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+
+# ---------------------------------------------------------------------
+
+# threads of every interpreter, parallelism comes from the pool
+DEFAULT_INTERPRETER_THREADS = 1
+
+# ---------------------------------------------------------------------
+
+
+def interpreter_class():
+    """
+    the tflite interpreter, from tflite_runtime if installed
+    so deployments do not need tensorflow
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+# ---------------------------------------------------------------------
+
+
+class _PooledInterpreter:
+    """
+    an interpreter with the input shape it is allocated for
+    """
+
+    def __init__(self, model_content: bytes, num_threads: int):
+        self.interpreter = \
+            interpreter_class()(
+                model_content=model_content,
+                num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.input_shape = None
+
+    def run(self, x: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        # tensors are reallocated only when the shape changes
+        if self.input_shape != x.shape:
+            self.interpreter.resize_tensor_input(
+                self.input_index, x.shape, strict=False)
+            self.interpreter.allocate_tensors()
+            self.input_shape = x.shape
+        # write into and read from the interpreter buffers directly,
+        # the views must be released before the next invoke
+        np.copyto(self.interpreter.tensor(self.input_index)(), x)
+        self.interpreter.invoke()
+        output = self.interpreter.tensor(self.output_index)()
+        if out is None:
+            out = output.copy()
+        else:
+            np.copyto(out, output)
+        del output
+        return out
+
+# ---------------------------------------------------------------------
+
+
+class TFLiteRunner:
+    """
+    thread safe tflite denoiser called like the saved_model
+
+    every concurrent call gets its own interpreter from a pool, the pool
+    grows up to max_interpreters (the number of worker threads) and idle
+    interpreters are reused, most recently released first, so a steady
+    stream of one shape never reallocates
+    """
+
+    def __init__(
+            self,
+            model_path: Union[str, Path] = None,
+            model_content: bytes = None,
+            max_interpreters: int = -1,
+            num_threads: int = DEFAULT_INTERPRETER_THREADS):
+        """
+        :param model_path: path of a .tflite file
+        :param model_content: tflite flatbuffer, instead of model_path
+        :param max_interpreters: maximum concurrent calls, -1 for no limit
+        :param num_threads: threads of every interpreter
+        """
+        # --- argument checking
+        if (model_path is None) == (model_content is None):
+            raise ValueError("exactly one of model_path, model_content")
+        if max_interpreters == 0:
+            raise ValueError("max_interpreters must be > 0 or -1")
+        if num_threads <= 0:
+            raise ValueError("num_threads must be > 0")
+        if model_content is None:
+            if not os.path.isfile(str(model_path)):
+                raise ValueError(
+                    "model_path [{0}] does not exist".format(model_path))
+            with open(str(model_path), "rb") as f:
+                model_content = f.read()
+
+        self._model_content = model_content
+        self._max_interpreters = max_interpreters
+        self._num_threads = num_threads
+        self._condition = threading.Condition()
+        self._idle = []
+        self._created = 1
+        # the first interpreter is created here, so errors show early
+        self._idle.append(self._create())
+        details = self._idle[0].interpreter.get_input_details()[0]
+        self.dtype = details["dtype"]
+        self.channels = int(details["shape_signature"][-1])
+
+    def _create(self) -> _PooledInterpreter:
+        logger.info(f"creating tflite interpreter [{self._created}]")
+        return _PooledInterpreter(self._model_content, self._num_threads)
+
+    def _acquire(self) -> _PooledInterpreter:
+        with self._condition:
+            while len(self._idle) == 0:
+                if self._max_interpreters < 0 or \
+                        self._created < self._max_interpreters:
+                    # reserve the slot, build outside the lock
+                    self._created += 1
+                    break
+                self._condition.wait()
+            else:
+                return self._idle.pop()
+        try:
+            return self._create()
+        except BaseException:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, interpreter: _PooledInterpreter):
+        with self._condition:
+            self._idle.append(interpreter)
+            self._condition.notify()
+
+    # ---------------------------------------------------------------------
+
+    def __call__(self, x, out: np.ndarray = None) -> np.ndarray:
+        """
+        denoises a [B, H, W, C] batch
+
+        :param x: numpy array or tensor, cast to the model input dtype
+        :param out: optional array the result is written into
+        :return: [B, H, W, C] denoised batch
+        """
+        x = np.asarray(x)
+        if x.dtype != self.dtype:
+            x = x.astype(self.dtype)
+        interpreter = self._acquire()
+        try:
+            return interpreter.run(x, out=out)
+        finally:
+            self._release(interpreter)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                "interpreters": self._created,
+                "idle": len(self._idle)
+            }
+
+# ---------------------------------------------------------------------
+
+
+def load_tflite_model(
+        model_path: Union[str, Path],
+        **kwargs) -> TFLiteRunner:
+    """
+    tflite runner of a pretrained model name or a .tflite file
+
+    :param model_path: pretrained model name or path of a .tflite file
+    :param kwargs: arguments of the TFLiteRunner
+    :return: runner
+    """
+    from . import pretrained_models
+
+    # --- argument checking
+    if model_path is None or len(str(model_path)) <= 0:
+        raise ValueError("model_path cannot be empty")
+
+    if model_path in pretrained_models:
+        model_path = pretrained_models[model_path]["tflite"]
+    return TFLiteRunner(model_path=model_path, **kwargs)
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,424 @@
+r"""tiled, overlap-blended inference for arbitrarily large images"""
+
+# ---------------------------------------------------------------------
+
+__author__ = "Nikolas Markou"
+__version__ = "1.0.0"
+__license__ = "MIT"
+
+# ---------------------------------------------------------------------
+
+import numpy as np
+from typing import Dict, List, Tuple, Callable, Union
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+from .custom_logger import logger
+from .constants import \
+    TYPE_STR, \
+    MODEL_DENOISE_STR, \
+    RECEPTIVE_FIELD_STR
+
+# ---------------------------------------------------------------------
+
+DEFAULT_TILE_SIZE = 256
+DEFAULT_BATCH_SIZE = 4
+
+# ---------------------------------------------------------------------
+
+
+def alignment_from_config(
+        config: Dict) -> int:
+    """
+    computes the spatial multiple that the input of a denoiser
+    must respect so the stride-2 pooling / upsampling pairs line up
+
+    :param config: model_denoise configuration dictionary
+        (or a full pipeline configuration)
+    :return: required multiple in pixels
+    """
+    # --- exported pipelines carry the exact value
+    if RECEPTIVE_FIELD_STR in config:
+        return int(config[RECEPTIVE_FIELD_STR]["alignment"])
+    if MODEL_DENOISE_STR in config:
+        config = config[MODEL_DENOISE_STR]
+    pyramid_config = config.get("pyramid", None)
+    pyramid_levels = 1
+    if pyramid_config is not None:
+        pyramid_levels = pyramid_config.get("levels", 1)
+    model_levels = 1
+    if config.get(TYPE_STR, "resnet") in ["unet", "lunet"]:
+        model_levels = config.get("no_levels", 1)
+    return 2 ** (max(pyramid_levels - 1, 0) + max(model_levels - 1, 0))
+
+# ---------------------------------------------------------------------
+
+
+def is_global_from_config(
+        config: Dict) -> bool:
+    """
+    true if every output pixel depends on the whole image (e.g. global
+    normalization), only known for exported pipelines
+
+    :param config: pipeline configuration
+    :return: true if the receptive field is global
+    """
+    return bool(config.get(RECEPTIVE_FIELD_STR, {}).get("is_global", False))
+
+# ---------------------------------------------------------------------
+
+
+def receptive_field_from_config(
+        config: Dict) -> int:
+    """
+    conservative estimate (in full resolution pixels) of how far
+    the influence of a pixel reaches, derived from the configuration
+
+    :param config: model_denoise configuration dictionary
+        (or a full pipeline configuration)
+    :return: receptive field radius in pixels
+    """
+    # --- exported pipelines carry the exact value
+    if RECEPTIVE_FIELD_STR in config:
+        if is_global_from_config(config):
+            raise ValueError(
+                "the receptive field of the model is global, "
+                "it has no radius")
+        return int(config[RECEPTIVE_FIELD_STR]["radius"])
+    if MODEL_DENOISE_STR in config:
+        config = config[MODEL_DENOISE_STR]
+    model_type = config.get(TYPE_STR, "resnet")
+    no_layers = config.get("no_layers", 5)
+    no_levels = config.get("no_levels", 1)
+    kernel_size = config.get("kernel_size", 3)
+    add_var = config.get("add_var", False)
+    local_normalization = config.get("local_normalization", -1)
+    pyramid_config = config.get("pyramid", None)
+
+    # --- base conv, every resnet block has a single 3x3 conv
+    base_radius = (kernel_size - 1) // 2
+    block_radius = no_layers
+
+    if model_type in ["unet", "lunet"]:
+        # every level goes down and up again with a 3x3 pooling
+        # and a bilinear upsampling, and runs resnet blocks both ways
+        radius = base_radius
+        for level in range(no_levels):
+            radius += (2 ** level) * (2 * block_radius + 2)
+    else:
+        radius = base_radius + block_radius
+
+    # --- mean_sigma_local runs two pooling passes
+    if add_var:
+        radius += 2 * 2
+    if local_normalization > 0:
+        radius += 2 * (local_normalization // 2)
+
+    # --- pyramid levels multiply the radius of the deeper levels
+    if pyramid_config is None:
+        return int(radius)
+
+    levels = pyramid_config.get("levels", 1)
+    pyramid_kernel = pyramid_config.get("kernel_size", [5, 5])
+    if isinstance(pyramid_kernel, int):
+        pyramid_kernel = [pyramid_kernel, pyramid_kernel]
+    pooling_radius = (max(pyramid_kernel) - 1) // 2 + 1
+    # summing over levels keeps it safe for residual between models
+    total_radius = 0
+    for level in range(levels):
+        total_radius += (2 ** level) * (radius + pooling_radius)
+    return int(total_radius)
+
+# ---------------------------------------------------------------------
+
+
+def tile_ranges(
+        size: int,
+        tile_size: int,
+        halo: int,
+        alignment: int = 1) -> List[Tuple[int, int, int, int]]:
+    """
+    splits a dimension into cores of tile_size and windows grown by halo
+
+    :param size: size of the dimension
+    :param tile_size: size of each core tile
+    :param halo: extra context on each side of the core
+    :param alignment: window starts are aligned to this multiple
+    :return: list of (core_start, core_end, window_start, window_end)
+    """
+    # --- argument checking
+    if size <= 0:
+        raise ValueError("size must be > 0")
+    if tile_size <= 0:
+        raise ValueError("tile_size must be > 0")
+    if halo < 0:
+        raise ValueError("halo must be >= 0")
+    if alignment <= 0:
+        raise ValueError("alignment must be > 0")
+
+    result = []
+    for core_start in range(0, size, tile_size):
+        core_end = min(core_start + tile_size, size)
+        window_start = max(core_start - halo, 0)
+        window_start = (window_start // alignment) * alignment
+        window_end = min(core_end + halo, size)
+        result.append((core_start, core_end, window_start, window_end))
+    return result
+
+# ---------------------------------------------------------------------
+
+
+def blend_weights(
+        length: int,
+        ramp_start: int,
+        ramp_end: int) -> np.ndarray:
+    """
+    1d blending weights, linear ramp at each side and flat in the middle
+
+    :param length: length of the contribution
+    :param ramp_start: length of the rising ramp at the start
+    :param ramp_end: length of the falling ramp at the end
+    :return: float32 array of weights in (0, 1]
+    """
+    w = np.ones(shape=(length,), dtype=np.float32)
+    if ramp_start > 0:
+        w[:ramp_start] = \
+            np.arange(1, ramp_start + 1, dtype=np.float32) / (ramp_start + 1)
+    if ramp_end > 0:
+        w[length - ramp_end:] = \
+            np.arange(ramp_end, 0, -1, dtype=np.float32) / (ramp_end + 1)
+    return w
+
+# ---------------------------------------------------------------------
+
+
+def _pad_to_multiple(
+        x: np.ndarray,
+        multiple: int) -> np.ndarray:
+    """
+    reflect pad a [B, H, W, C] batch at the bottom/right to a multiple
+    """
+    if multiple <= 1:
+        return x
+    pad_h = (-x.shape[1]) % multiple
+    pad_w = (-x.shape[2]) % multiple
+    if pad_h == 0 and pad_w == 0:
+        return x
+    mode = "reflect"
+    if pad_h >= x.shape[1] or pad_w >= x.shape[2]:
+        mode = "symmetric"
+    return np.pad(
+        x,
+        pad_width=((0, 0), (0, pad_h), (0, pad_w), (0, 0)),
+        mode=mode)
+
+# ---------------------------------------------------------------------
+
+
+def tiled_inference(
+        model_fn: Callable,
+        image: np.ndarray,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        halo: int = 0,
+        overlap: int = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        alignment: int = 1) -> np.ndarray:
+    """
+    denoise an image tile by tile, so peak memory is bounded
+    by the tile (and a single strip of tiles) instead of the image
+
+    every tile is grown by halo pixels of context, tiles of the same shape
+    are denoised together in batches and the results are blended back
+    with linear ramps over overlap pixels
+
+    :param model_fn: callable that maps a uint8 [B, H, W, C] batch to
+        a [B, H, W, C] batch (saved_model, inference module)
+    :param image: uint8 [H, W, C] or [1, H, W, C] image
+    :param tile_size: size of the core of each tile
+    :param halo: context pixels around each core (receptive field)
+    :param overlap: blending pixels between neighbouring cores,
+        None defaults to half the halo
+    :param batch_size: how many tiles to denoise per call
+    :param alignment: tile windows are aligned (and padded) to this multiple
+    :return: denoised image with the same shape and dtype as the input
+    """
+    # --- argument checking
+    if model_fn is None:
+        raise ValueError("model_fn cannot be None")
+    if image is None:
+        raise ValueError("image cannot be None")
+    if batch_size <= 0:
+        raise ValueError("batch_size must be > 0")
+    image = np.asarray(image)
+    squeeze = False
+    if len(image.shape) == 4:
+        if image.shape[0] != 1:
+            raise ValueError("only a single image can be tiled at a time")
+        image = image[0]
+        squeeze = True
+    if len(image.shape) != 3:
+        raise ValueError("image must be [H, W, C] or [1, H, W, C]")
+    if overlap is None:
+        overlap = halo // 2
+    if overlap < 0:
+        raise ValueError("overlap must be >= 0")
+    # the core must be aligned so that the windows stay aligned
+    tile_size = max(int(np.ceil(tile_size / alignment)) * alignment, alignment)
+    # blending cannot reach further than the halo
+    overlap = min(overlap, halo, tile_size // 2)
+
+    height, width, channels = image.shape
+    output = np.zeros_like(image)
+    rows = tile_ranges(height, tile_size, halo, alignment)
+    cols = tile_ranges(width, tile_size, halo, alignment)
+
+    # --- contribution of a core grown by the overlap
+    def contribution(core_start, core_end, size):
+        c0 = max(core_start - overlap, 0)
+        c1 = min(core_end + overlap, size)
+        return c0, c1, \
+            blend_weights(
+                length=c1 - c0,
+                ramp_start=core_start - c0,
+                ramp_end=c1 - core_end)
+
+    # --- strip accumulators, only keep the rows that are still open
+    acc_start = 0
+    acc = np.zeros(shape=(0, width, channels), dtype=np.float32)
+    acc_weights = np.zeros(shape=(0, width, 1), dtype=np.float32)
+
+    for row_index, (r_core_start, r_core_end, r_start, r_end) in \
+            enumerate(rows):
+        r0, r1, r_weights = contribution(r_core_start, r_core_end, height)
+
+        # grow the strip to cover this row of tiles
+        grow = (r1 - acc_start) - acc.shape[0]
+        if grow > 0:
+            acc = np.concatenate([
+                acc,
+                np.zeros(shape=(grow, width, channels), dtype=np.float32)],
+                axis=0)
+            acc_weights = np.concatenate([
+                acc_weights,
+                np.zeros(shape=(grow, width, 1), dtype=np.float32)],
+                axis=0)
+
+        # group windows of the same shape so they can be batched
+        groups = {}
+        for col in cols:
+            c_start, c_end = col[2], col[3]
+            key = (r_end - r_start, c_end - c_start)
+            groups.setdefault(key, []).append(col)
+
+        for _, group in groups.items():
+            for i in range(0, len(group), batch_size):
+                batch_cols = group[i:i + batch_size]
+                batch = np.stack([
+                    image[r_start:r_end, c[2]:c[3], :]
+                    for c in batch_cols
+                ], axis=0)
+                batch_padded = _pad_to_multiple(batch, alignment)
+                result = np.asarray(model_fn(batch_padded))
+                result = \
+                    result[:, :batch.shape[1], :batch.shape[2], :]
+                result = result.astype(np.float32)
+
+                for j, (c_core_start, c_core_end, c_start, c_end) in \
+                        enumerate(batch_cols):
+                    c0, c1, c_weights = \
+                        contribution(c_core_start, c_core_end, width)
+                    w = r_weights[:, None, None] * c_weights[None, :, None]
+                    tile = \
+                        result[j,
+                               (r0 - r_start):(r1 - r_start),
+                               (c0 - c_start):(c1 - c_start),
+                               :]
+                    acc[(r0 - acc_start):(r1 - acc_start), c0:c1, :] += \
+                        tile * w
+                    acc_weights[(r0 - acc_start):(r1 - acc_start), c0:c1, :] += \
+                        w
+
+        # --- flush the rows no other tile will contribute to
+        if row_index + 1 < len(rows):
+            final_row = max(rows[row_index + 1][0] - overlap, acc_start)
+        else:
+            final_row = height
+        done = final_row - acc_start
+        if done > 0:
+            values = acc[:done] / np.maximum(acc_weights[:done], 1e-6)
+            if np.issubdtype(output.dtype, np.integer):
+                info = np.iinfo(output.dtype)
+                values = np.clip(np.round(values), info.min, info.max)
+            output[acc_start:final_row] = values.astype(output.dtype)
+            acc = acc[done:]
+            acc_weights = acc_weights[done:]
+            acc_start = final_row
+
+    if squeeze:
+        output = np.expand_dims(output, axis=0)
+    return output
+
+# ---------------------------------------------------------------------
+
+
+def tiled_denoiser_builder(
+        model_fn: Callable,
+        config: Dict = None,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        halo: int = None,
+        overlap: int = None,
+        batch_size: int = DEFAULT_BATCH_SIZE) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    wraps a denoiser into a tiled denoiser,
+    halo and alignment are derived from the configuration if not given
+
+    :param model_fn: callable that maps a uint8 [B, H, W, C] batch
+    :param config: pipeline or model_denoise configuration
+    :param tile_size: size of the core of each tile
+    :param halo: context pixels around each core, None to derive from config
+    :param overlap: blending pixels between neighbouring cores
+    :param batch_size: how many tiles to denoise per call
+    :return: callable that denoises a single (possibly huge) image
+    """
+    # --- argument checking
+    if model_fn is None:
+        raise ValueError("model_fn cannot be None")
+    if halo is None and config is None:
+        raise ValueError("either halo or config must be given")
+
+    if config is not None and is_global_from_config(config):
+        raise ValueError(
+            "the receptive field of the model is global, tiles would not "
+            "match whole image inference, denoise the image in one call")
+
+    alignment = 1
+    if config is not None:
+        alignment = alignment_from_config(config)
+        if halo is None:
+            halo = receptive_field_from_config(config)
+    # keep the halo aligned so windows line up with the pyramid
+    halo = int(np.ceil(halo / alignment)) * alignment
+
+    logger.info(
+        f"building tiled denoiser with "
+        f"tile_size:{tile_size}, "
+        f"halo:{halo}, "
+        f"alignment:{alignment}, "
+        f"batch_size:{batch_size}")
+
+    def fn(image: np.ndarray) -> np.ndarray:
+        return \
+            tiled_inference(
+                model_fn=model_fn,
+                image=image,
+                tile_size=tile_size,
+                halo=halo,
+                overlap=overlap,
+                batch_size=batch_size,
+                alignment=alignment)
+
+    return fn
+
+# ---------------------------------------------------------------------
@@ -9,8 +9,10 @@ __license__ = "MIT"
 # ---------------------------------------------------------------------
 
 import os
+import copy
 import time
 import tensorflow as tf
+from tensorflow import keras
 from pathlib import Path
 from typing import Union, Dict
 
@@ -24,12 +26,20 @@ from .custom_logger import logger
 from .utilities import load_config
 from .loss import loss_function_builder
 from .optimizer import optimizer_builder
-from .model_denoise import model_builder as model_denoise_builder
+from .distribute import \
+    strategy_builder, \
+    is_chief, \
+    write_directory, \
+    remove_write_directory
+from .model_denoise import \
+    model_builder as model_denoise_builder, \
+    mixed_precision_policy
 from .pruning import prune_function_builder, PruneStrategy, get_conv2d_weights
 from .dataset import \
     dataset_builder, \
     DATASET_TESTING_FN_STR, \
     DATASET_FN_STR, \
+    DATASET_CACHE_STR, \
     AUGMENTATION_FN_STR
 
 
@@ -68,24 +78,58 @@ def train_loop(
             raise ValueError("Model directory [{0}] is not valid".format(
                 model_dir))
 
+    # --- build the distribution strategy before any other op,
+    # only the chief writes summaries and keeps its checkpoints
+    strategy = strategy_builder(config["train"].get("distribute", None))
+    distributed = strategy is not tf.distribute.get_strategy()
+    chief = is_chief(strategy)
+    no_replicas = strategy.num_replicas_in_sync
+    write_dir = write_directory(model_dir, strategy)
+
     # --- build dataset
     dataset_res = dataset_builder(config=config["dataset"])
     dataset = dataset_res[DATASET_FN_STR]
-    augmentation_fn = tf.function(dataset_res[AUGMENTATION_FN_STR])
+    augmentation_fn = \
+        tf.function(
+            dataset_res[AUGMENTATION_FN_STR],
+            reduce_retracing=True)
+    # the dataset produces (clean, noisy) pairs,
+    # no augmentation on the training thread
+    noise_in_pipeline = config["dataset"].get("noise_in_pipeline", False)
+    # decoded image caches whose statistics are logged every epoch
+    dataset_caches = [dataset_res[DATASET_CACHE_STR]]
+    if distributed:
+        dataset_caches = []
+
+        # every input pipeline reads its own shard with the per replica batch size
+        def dataset_fn(input_context):
+            res = \
+                dataset_builder(
+                    config=config["dataset"],
+                    input_context=input_context)
+            dataset_caches.append(res[DATASET_CACHE_STR])
+            return res[DATASET_FN_STR]
+
+        dataset = strategy.distribute_datasets_from_function(dataset_fn)
+    dataset_caches = [c for c in dataset_caches if c is not None]
 
     # --- build loss function
     loss_fn = loss_function_builder(config=config["loss"])
 
     # --- build optimizer
-    optimizer, lr_schedule = \
-        optimizer_builder(config=config["train"]["optimizer"])
+    with strategy.scope():
+        optimizer, lr_schedule = \
+            optimizer_builder(config=config["train"]["optimizer"])
 
     # --- create the help variables
     global_step = tf.Variable(
         0, trainable=False, dtype=tf.dtypes.int64, name="global_step")
     global_epoch = tf.Variable(
         0, trainable=False, dtype=tf.dtypes.int64, name="global_epoch")
-    summary_writer = tf.summary.create_file_writer(model_dir)
+    if chief:
+        summary_writer = tf.summary.create_file_writer(model_dir)
+    else:
+        summary_writer = tf.summary.create_noop_writer()
 
     # --- get the train configuration
     train_config = config["train"]
@@ -93,6 +137,30 @@ def train_loop(
     global_total_epochs = tf.Variable(
         epochs, trainable=False, dtype=tf.dtypes.int64, name="global_total_epochs")
     trace_every = train_config.get("trace_every", 100)
+    # compile the optimization step with xla
+    jit_compile = train_config.get("jit_compile", False)
+    # train steps run on device before returning to python
+    steps_per_execution = train_config.get("steps_per_execution", 1)
+    if steps_per_execution <= 0:
+        raise ValueError("steps_per_execution must be > 0")
+    # micro batches whose gradients are summed before a single update,
+    # steps count micro batches, the optimizer counts updates
+    gradient_accumulation_steps = \
+        train_config.get("gradient_accumulation_steps", 1)
+    if gradient_accumulation_steps <= 0:
+        raise ValueError("gradient_accumulation_steps must be > 0")
+    accumulate_gradients = gradient_accumulation_steps > 1
+    # low precision compute in the denoiser with float32 master weights,
+    # float16 (not bfloat16) needs loss scaling to keep small gradients
+    mixed_precision = \
+        mixed_precision_policy(
+            train_config.get(
+                "mixed_precision",
+                config[MODEL_DENOISE_STR].get("mixed_precision", False)))
+    use_loss_scaling = mixed_precision == "mixed_float16"
+    if use_loss_scaling:
+        with strategy.scope():
+            optimizer = keras.mixed_precision.LossScaleOptimizer(optimizer)
     weight_buckets = train_config.get("weight_buckets", 100)
     error_buckets = train_config.get("error_buckets", 255)
     total_steps = \
@@ -123,6 +191,17 @@ def train_loop(
     random_batch_size = \
         [visualization_number] + \
         train_config.get("random_batch_size", [128, 128, 3])
+    # loss values written to tensorboard
+    loss_summaries = [
+        ("loss/mae", MAE_LOSS_STR),
+        ("loss/total", MEAN_TOTAL_LOSS_STR),
+        ("loss/nae", NAE_PREDICTION_LOSS_STR),
+        ("loss/regularization", REGULARIZATION_LOSS_STR),
+        ("loss/mae_decomposition", MAE_DECOMPOSITION_LOSS_STR),
+        ("quality/nae_noise", NAE_NOISE_STR),
+        ("quality/signal_to_noise_ratio", SNR_STR),
+        ("quality/nae_improvement", NAE_IMPROVEMENT_QUALITY_STR)
+    ]
     # --- prune strategy
     prune_config = \
         train_config.get("prune", {"strategies": []})
@@ -152,8 +231,11 @@ def train_loop(
     # --- build the denoise model
     tf.summary.trace_on(graph=True, profiler=False)
     with summary_writer.as_default():
-        models = \
-            model_denoise_builder(config=config[MODEL_DENOISE_STR])
+        model_denoise_config = copy.deepcopy(config[MODEL_DENOISE_STR])
+        model_denoise_config["mixed_precision"] = mixed_precision
+        with strategy.scope():
+            models = \
+                model_denoise_builder(config=model_denoise_config)
 
         # The function to be traced.
         @tf.function
@@ -185,7 +267,7 @@ def train_loop(
     denoiser.summary(print_fn=logger.info)
     # save model so we can visualize it easier
     denoiser.save(
-        filepath=os.path.join(model_dir, MODEL_DENOISE_DEFAULT_NAME_STR),
+        filepath=os.path.join(write_dir, MODEL_DENOISE_DEFAULT_NAME_STR),
         include_optimizer=False)
 
     # --- create random image and iterate through the model
@@ -212,11 +294,32 @@ def train_loop(
 
     # --- train the model
     with summary_writer.as_default():
+        # preallocated gradient accumulators, local to every replica,
+        # a partial accumulation carries over to the next epoch
+        # and is checkpointed so a resumed run continues it
+        gradient_accumulators = []
+        accumulated_steps = \
+            tf.Variable(
+                0, trainable=False, dtype=tf.dtypes.int64,
+                name="accumulated_steps")
+        if accumulate_gradients:
+            with strategy.scope():
+                gradient_accumulators = [
+                    tf.Variable(
+                        tf.zeros(shape=w.shape, dtype=w.dtype),
+                        trainable=False,
+                        synchronization=tf.VariableSynchronization.ON_READ,
+                        aggregation=tf.VariableAggregation.SUM)
+                    for w in denoiser_decomposition.trainable_weights
+                ]
+
         checkpoint = \
             tf.train.Checkpoint(
                 step=global_step,
                 epoch=global_epoch,
                 optimizer=optimizer,
+                accumulated_steps=accumulated_steps,
+                gradient_accumulators=gradient_accumulators,
                 model_denoise=denoiser,
                 model_normalize=normalizer,
                 model_denormalize=denormalizer,
@@ -224,14 +327,15 @@ def train_loop(
         manager = \
             tf.train.CheckpointManager(
                 checkpoint=checkpoint,
-                directory=model_dir,
+                directory=write_dir,
                 max_to_keep=checkpoints_to_keep)
+        # every worker resumes from the checkpoints of the chief
         status = \
-            checkpoint.restore(manager.latest_checkpoint).expect_partial()
+            checkpoint.restore(
+                tf.train.latest_checkpoint(str(model_dir))).expect_partial()
 
         # --- define denoise fn
         if inverse_pyramid is not None:
-            @tf.function
             def denoise_fn(x):
                 # denoised decomposition
                 x0 = \
@@ -248,7 +352,6 @@ def train_loop(
                     denormalizer(x1, training=False)
                 return x0, x1, x2
         else:
-            @tf.function
             def denoise_fn(x):
                 # denoised decomposition
                 x0 = None
@@ -262,6 +365,209 @@ def train_loop(
                     denormalizer(x1, training=False)
                 return x0, x1, x2
 
+        # --- define the optimization step,
+        # normalization, forward, loss, gradient and update in one graph
+        def gradient_step_fn(input_batch, noisy_batch):
+            # normalize input and noisy batch
+            normalized_input_batch = normalizer(input_batch, training=False)
+            normalized_noisy_batch = normalizer(noisy_batch, training=False)
+
+            if pyramid is not None:
+                # split input image into pyramid levels
+                normalized_input_batch_decomposition = \
+                    pyramid(
+                        normalized_input_batch,
+                        training=False)
+            else:
+                normalized_input_batch_decomposition = None
+
+            # Open a GradientTape to record the operations run
+            # during the forward pass,
+            # which enables auto-differentiation.
+            with tf.GradientTape() as tape:
+                # run the forward pass of the layer.
+                # The operations that the layer applies
+                # to its inputs are going to be recorded
+                # on the GradientTape.
+                denoised_batch_decomposition, \
+                denoised_batch, \
+                denormalized_denoised_batch = \
+                    denoise_fn(normalized_noisy_batch)
+
+                # compute the loss value for this mini-batch
+                loss_map = \
+                    loss_fn(
+                        input_batch=input_batch,
+                        noisy_batch=noisy_batch,
+                        model_losses=denoiser.losses,
+                        prediction_batch=denormalized_denoised_batch,
+                        prediction_batch_decomposition=denoised_batch_decomposition,
+                        input_batch_decomposition=normalized_input_batch_decomposition
+                    )
+                total_loss = loss_map[MEAN_TOTAL_LOSS_STR]
+                # gradients are summed over the replicas
+                if no_replicas > 1:
+                    total_loss = total_loss / no_replicas
+                if use_loss_scaling:
+                    total_loss = optimizer.get_scaled_loss(total_loss)
+
+            # use the gradient tape to automatically retrieve
+            # the gradients of the trainable variables
+            # with respect to the loss.
+            trainable_weights = denoiser_decomposition.trainable_weights
+            grads = \
+                tape.gradient(
+                    target=total_loss,
+                    sources=trainable_weights)
+            if use_loss_scaling:
+                grads = optimizer.get_unscaled_gradients(grads)
+
+            return loss_map, denormalized_denoised_batch, grads
+
+        def optimization_step_builder(gradient_step):
+            def optimization_step_fn(input_batch, noisy_batch):
+                loss_map, denormalized_denoised_batch, grads = \
+                    gradient_step(input_batch, noisy_batch)
+
+                # run one step of gradient descent by updating
+                # the value of the variables to minimize the loss,
+                # gradients are all-reduced over the replicas here
+                optimizer.apply_gradients(
+                    grads_and_vars=zip(
+                        grads, denoiser_decomposition.trainable_weights))
+
+                return loss_map, denormalized_denoised_batch
+            return optimization_step_fn
+
+        # --- define the gradient accumulation, every micro batch adds
+        # its gradients to the accumulators, every
+        # gradient_accumulation_steps their mean is applied once
+        def accumulation_step_builder(gradient_step):
+            def accumulation_step_fn(input_batch, noisy_batch):
+                loss_map, denormalized_denoised_batch, grads = \
+                    gradient_step(input_batch, noisy_batch)
+                for accumulator, grad in zip(gradient_accumulators, grads):
+                    if grad is not None:
+                        accumulator.assign_add(grad)
+                return loss_map, denormalized_denoised_batch
+            return accumulation_step_fn
+
+        def apply_accumulated_gradients_fn():
+            grads = [
+                accumulator / gradient_accumulation_steps
+                for accumulator in gradient_accumulators
+            ]
+            optimizer.apply_gradients(
+                grads_and_vars=zip(
+                    grads, denoiser_decomposition.trainable_weights))
+            for accumulator in gradient_accumulators:
+                accumulator.assign(tf.zeros_like(accumulator))
+
+        # --- define the train step, the augmentation ops
+        # have no xla kernels so they stay outside the compiled step
+        def train_step_builder(compile_step: bool):
+            if accumulate_gradients:
+                step_builder = accumulation_step_builder
+            else:
+                step_builder = optimization_step_builder
+            if distributed:
+                # the gradient all-reduce cannot be nested in a tf.function
+                # under strategy.run, only the gradients are compiled
+                optimization_step = \
+                    step_builder(
+                        tf.function(
+                            gradient_step_fn,
+                            jit_compile=compile_step,
+                            reduce_retracing=True))
+            else:
+                optimization_step = \
+                    tf.function(
+                        step_builder(gradient_step_fn),
+                        jit_compile=compile_step,
+                        reduce_retracing=True)
+
+            # traced as part of the multi step execution
+            def step(batch):
+                if noise_in_pipeline:
+                    # (clean, noisy) pairs from the input pipeline
+                    input_batch, noisy_batch = batch
+                else:
+                    # augment data
+                    input_batch = batch
+                    noisy_batch = augmentation_fn(input_batch)
+                loss_map, denormalized_denoised_batch = \
+                    optimization_step(input_batch, noisy_batch)
+                return loss_map, input_batch, noisy_batch, denormalized_denoised_batch
+            return step
+
+        # --- define the multi step execution, runs up to no_steps train
+        # steps on device and sums the losses so python is only
+        # visited once every steps_per_execution steps,
+        # losses are averaged over the replicas and the batches
+        # of the first local replica are kept for visualization
+        def train_steps_builder(step_fn):
+            def local(x):
+                return strategy.experimental_local_results(x)[0]
+
+            @tf.function(reduce_retracing=True)
+            def steps_fn(iterator, no_steps):
+                loss_sums = tf.zeros(shape=(len(loss_summaries),), dtype=tf.float32)
+                steps = tf.constant(0, dtype=tf.int64)
+                input_batch = tf.zeros(shape=(0, 0, 0, 0), dtype=tf.float32)
+                noisy_batch = tf.zeros(shape=(0, 0, 0, 0), dtype=tf.float32)
+                prediction_batch = tf.zeros(shape=(0, 0, 0, 0), dtype=tf.float32)
+                for _ in tf.range(no_steps):
+                    tf.autograph.experimental.set_loop_options(
+                        shape_invariants=[
+                            (input_batch, tf.TensorShape([None, None, None, None])),
+                            (noisy_batch, tf.TensorShape([None, None, None, None])),
+                            (prediction_batch, tf.TensorShape([None, None, None, None]))
+                        ])
+                    element = iterator.get_next_as_optional()
+                    if not element.has_value():
+                        break
+                    loss_map, input_batch, noisy_batch, prediction_batch = \
+                        strategy.run(
+                            step_fn,
+                            args=(element.get_value(),))
+                    loss_sums += tf.stack([
+                        tf.cast(
+                            strategy.reduce(
+                                tf.distribute.ReduceOp.MEAN,
+                                loss_map[key],
+                                axis=None),
+                            dtype=tf.float32)
+                        for _, key in loss_summaries
+                    ])
+                    input_batch = local(input_batch)
+                    noisy_batch = local(noisy_batch)
+                    prediction_batch = local(prediction_batch)
+                    steps += 1
+                    if accumulate_gradients:
+                        accumulated_steps.assign_add(1)
+                        if accumulated_steps % gradient_accumulation_steps == 0:
+                            strategy.run(apply_accumulated_gradients_fn)
+                loss_means = \
+                    loss_sums / tf.cast(tf.maximum(steps, 1), dtype=tf.float32)
+                return loss_means, steps, input_batch, noisy_batch, prediction_batch
+            return steps_fn
+
+        def crossed(step_start: int, no_steps: int, every: int) -> bool:
+            # true if any of the executed steps is a multiple of every
+            if every <= 0 or no_steps <= 0:
+                return False
+            return \
+                (step_start + no_steps - 1) // every > \
+                (step_start - 1) // every
+
+        train_step = train_step_builder(jit_compile)
+        train_steps = train_steps_builder(train_step)
+
+        # create the optimizer slots outside the traced step,
+        # restored slot values are assigned here
+        with strategy.scope():
+            optimizer.build(denoiser_decomposition.trainable_weights)
+
         # ---
 
         while global_epoch < global_total_epochs:
@@ -274,89 +580,54 @@ def train_loop(
                 denoiser_decomposition = \
                     prune_fn(model=denoiser_decomposition)
 
-            model_denoise_weights = \
-                denoiser_decomposition.trainable_weights
-
             # --- iterate over the batches of the dataset
-            for input_batch in dataset:
+            iterator = iter(dataset)
+            while True:
                 start_time = time.time()
-
-                # augment data
-                noisy_batch = augmentation_fn(input_batch)
-
-                # normalize input and noisy batch
-                normalized_input_batch = normalizer(input_batch, training=False)
-                normalized_noisy_batch = normalizer(noisy_batch, training=False)
-
-                if pyramid is not None:
-                    # split input image into pyramid levels
-                    normalized_input_batch_decomposition = \
-                        pyramid(
-                            normalized_input_batch,
-                            training=False)
-                else:
-                    normalized_input_batch_decomposition = None
-
-                # Open a GradientTape to record the operations run
-                # during the forward pass,
-                # which enables auto-differentiation.
-                with tf.GradientTape() as tape:
-                    # run the forward pass of the layer.
-                    # The operations that the layer applies
-                    # to its inputs are going to be recorded
-                    # on the GradientTape.
-                    denoised_batch_decomposition, \
-                    denoised_batch, \
-                    denormalized_denoised_batch = \
-                        denoise_fn(normalized_noisy_batch)
-
-                    # compute the loss value for this mini-batch
-                    loss_map = \
-                        loss_fn(
-                            input_batch=input_batch,
-                            noisy_batch=noisy_batch,
-                            model_losses=denoiser.losses,
-                            prediction_batch=denormalized_denoised_batch,
-                            prediction_batch_decomposition=denoised_batch_decomposition,
-                            input_batch_decomposition=normalized_input_batch_decomposition
-                        )
-
-                    # use the gradient tape to automatically retrieve
-                    # the gradients of the trainable variables
-                    # with respect to the loss.
-                    grads = \
-                        tape.gradient(
-                            target=loss_map[MEAN_TOTAL_LOSS_STR],
-                            sources=model_denoise_weights)
-
-                # run one step of gradient descent by updating
-                # the value of the variables to minimize the loss.
-                optimizer.apply_gradients(
-                    grads_and_vars=zip(grads, model_denoise_weights))
+                step_start = int(global_step)
+                no_steps = steps_per_execution
+                if total_steps > 0:
+                    no_steps = min(no_steps, int(total_steps) - step_start)
+                if no_steps <= 0:
+                    break
+
+                try:
+                    loss_means, steps, input_batch, noisy_batch, denormalized_denoised_batch = \
+                        train_steps(iterator, tf.constant(no_steps, dtype=tf.int64))
+                except tf.errors.UnimplementedError as e:
+                    # some gradients (bilinear resize in the pyramids)
+                    # have no xla kernel on every device,
+                    # nothing is applied when compilation fails
+                    if not jit_compile:
+                        raise e
+                    logger.warning(
+                        f"xla cannot compile the train step, "
+                        f"falling back to jit_compile=False: {e.message}")
+                    jit_compile = False
+                    train_step = train_step_builder(jit_compile)
+                    train_steps = train_steps_builder(train_step)
+                    continue
+                steps = int(steps)
+                if steps == 0:
+                    break
+                global_step.assign_add(steps)
+                # summaries refer to the last executed step
+                step = step_start + steps - 1
 
                 # --- add loss summaries for tensorboard
-                for name, key in [
-                    ("loss/mae", MAE_LOSS_STR),
-                    ("loss/total", MEAN_TOTAL_LOSS_STR),
-                    ("loss/nae", NAE_PREDICTION_LOSS_STR),
-                    ("loss/regularization", REGULARIZATION_LOSS_STR),
-                    ("loss/mae_decomposition", MAE_DECOMPOSITION_LOSS_STR),
-                    ("quality/nae_noise", "nae_noise"),
-                    ("quality/signal_to_noise_ratio", "snr"),
-                    ("quality/nae_improvement", NAE_IMPROVEMENT_QUALITY_STR)
-                ]:
-                    if key not in loss_map:
-                        continue
+                for i, (name, _) in enumerate(loss_summaries):
                     tf.summary.scalar(
                         name=name,
-                        data=loss_map[key],
-                        step=global_step)
+                        data=loss_means[i],
+                        step=step)
 
-                # --- add image prediction for tensorboard
-                if (global_step % visualization_every) == 0:
+                # --- add image prediction for tensorboard,
+                # on every worker since reading the batch normalization
+                # statistics of a distributed model is a collective op
+                if crossed(step_start, steps, int(visualization_every)):
                     random_batch = create_random_batch()
                     visualize(
-                        global_step=global_step,
+                        global_step=step,
                         input_batch=input_batch,
                         noisy_batch=noisy_batch,
                         random_batch=random_batch,
@@ -368,7 +639,7 @@ def train_loop(
                             model=denoiser)
                     tf.summary.histogram(
                         data=weights,
-                        step=global_step,
+                        step=step,
                         buckets=weight_buckets,
                         name="training/weights")
 
@@ -379,22 +650,20 @@ def train_loop(
                         tf.reshape(input_prediction_error, shape=[-1])
                     tf.summary.histogram(
                         data=input_prediction_error,
-                        step=global_step,
+                        step=step,
                         buckets=error_buckets,
                         name="training/error_distribution")
 
                 if use_prune and (global_epoch >= prune_start_epoch) and \
-                        (int(prune_steps) != -1) and (global_step % prune_steps == 0):
-                    logger.info(f"pruning weights at step [{int(global_step)}]")
+                        crossed(step_start, steps, int(prune_steps)):
+                    logger.info(f"pruning weights at step [{step}]")
                     denoiser = \
                         prune_fn(model=denoiser)
 
                 # --- check if it is time to save a checkpoint
-                if checkpoint_every > 0:
-                    if (global_step % checkpoint_every == 0):
-                        logger.info("checkpoint at step: {0}".format(
-                            int(global_step)))
-                        manager.save()
+                if crossed(step_start, steps, int(checkpoint_every)):
+                    logger.info("checkpoint at step: {0}".format(step))
+                    manager.save()
 
                 # --- keep time of steps per second
                 stop_time = time.time()
@@ -402,38 +671,42 @@ def train_loop(
 
                 tf.summary.scalar(
                     "training/steps_per_second",
-                    1.0 / (step_time + 0.00001),
-                    step=global_step)
+                    steps / (step_time + 0.00001),
+                    step=step)
 
                 tf.summary.scalar(
                     "training/epoch",
                     int(global_epoch),
-                    step=global_step)
+                    step=step)
 
                 tf.summary.scalar(
                     "training/learning_rate",
-                    lr_schedule(int(global_step)),
-                    step=global_step)
-
-                # ---
-                global_step.assign_add(1)
+                    lr_schedule(optimizer.iterations),
+                    step=step)
 
-                # --- check if total steps reached
-                if total_steps > 0:
-                    if total_steps <= global_step:
-                        logger.info("total_steps reached [{0}]".format(
-                            int(total_steps)))
-                        break
+                # --- check if the epoch is over
+                if steps < no_steps:
+                    break
 
             # --- end of the epoch
+            for cache in dataset_caches:
+                cache.log_statistics(step=int(global_step))
             logger.info("checkpoint at end of epoch: {0}".format(
                 int(global_epoch)))
             global_epoch.assign_add(1)
             manager.save()
             # save model so we can visualize it easier
             denoiser.save(
-                os.path.join(model_dir, MODEL_DENOISE_DEFAULT_NAME_STR))
+                os.path.join(write_dir, MODEL_DENOISE_DEFAULT_NAME_STR))
+
+            # --- check if total steps reached
+            if total_steps > 0:
+                if total_steps <= global_step:
+                    logger.info("total_steps reached [{0}]".format(
+                        int(total_steps)))
+                    break
 
+    remove_write_directory(model_dir, strategy)
     logger.info("finished training")
 
 # ---------------------------------------------------------------------
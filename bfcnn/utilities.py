@@ -5,6 +5,7 @@ import itertools
 import numpy as np
 import tensorflow as tf
 from pathlib import Path
+from collections import defaultdict
 from typing import List, Tuple, Union, Dict, Iterable
 
 # ---------------------------------------------------------------------
@@ -613,3 +614,135 @@ def build_denormalize_model(
 
 
 # ---------------------------------------------------------------------
+
+
+def is_plain_conv2d(layer) -> bool:
+    # depthwise and separable convolutions subclass Conv2D
+    return type(layer) is keras.layers.Conv2D
+
+
+def is_unpadded_conv2d(layer) -> bool:
+    """
+    true for plain convolutions that no zero padding reaches,
+    (1x1 kernels or valid padding), so a per channel affine or
+    constant input can be moved into their kernel and bias exactly
+    """
+    if not is_plain_conv2d(layer):
+        return False
+    if layer.padding == "valid":
+        return True
+    return tuple(layer.kernel_size) == (1, 1)
+
+
+class FunctionalGraph:
+    """
+    nodes of a functional model, the nodes consuming every tensor
+    and the number of calls of every layer inside this graph
+    """
+
+    def __init__(self, model: keras.Model):
+        self.nodes = [
+            node
+            for depth in model._nodes_by_depth.values()
+            for node in depth
+            if not node.is_input
+        ]
+        self.output_ids = set([str(id(x)) for x in model.outputs])
+        self.consumers = defaultdict(list)
+        for node in self.nodes:
+            for t_id in node.flat_input_ids:
+                self.consumers[t_id].append(node)
+        # calls of every layer inside this graph, rebuilt copies of the
+        # model call the same layers again so _inbound_nodes is not usable
+        self.layer_calls = defaultdict(int)
+        for node in self.nodes:
+            self.layer_calls[id(node.layer)] += 1
+
+    def single_use(self, layer) -> bool:
+        return self.layer_calls[id(layer)] == 1
+
+# ---------------------------------------------------------------------
+
+
+class _TensorLookup(dict):
+    """
+    maps keras tensor ids to computed tensors,
+    every lookup returns a fresh list so node.map_arguments can pop it
+    """
+
+    def __getitem__(self, key):
+        return [dict.__getitem__(self, key)]
+
+# ---------------------------------------------------------------------
+
+
+def rebuild_functional_model(
+        model: keras.Model,
+        plan_fn,
+        cache: Dict = None) -> keras.Model:
+    """
+    rebuilds a functional model node by node, the plan decides which nodes
+    are dropped (their first input passes through) and which nodes call a
+    replacement layer, nested functional models are rebuilt recursively
+    with the same plan and shared ones stay shared through the cache
+
+    :param model: functional model
+    :param plan_fn: callable that maps a functional model to
+        (dropped node ids, {node id: replacement layer})
+    :param cache: rebuilt models by id of the original model
+    :return: rebuilt model, the input model is not modified
+    """
+    if cache is None:
+        cache = {}
+    if id(model) in cache:
+        return cache[id(model)]
+
+    dropped, replaced = plan_fn(model)
+
+    # --- new inputs mirroring the old ones
+    inputs = [
+        keras.Input(
+            shape=x.shape[1:],
+            dtype=x.dtype,
+            name=layer.name)
+        for x, layer in zip(model.inputs, model._input_layers)
+    ]
+    tensors = _TensorLookup()
+    for x, y in zip(model.inputs, inputs):
+        tensors[str(id(x))] = y
+
+    # --- run the graph on the new inputs
+    depth_keys = sorted(model._nodes_by_depth.keys(), reverse=True)
+    for depth in depth_keys:
+        for node in model._nodes_by_depth[depth]:
+            if node.is_input:
+                continue
+            if id(node) in dropped:
+                tensors[node.flat_output_ids[0]] = \
+                    dict.__getitem__(tensors, node.flat_input_ids[0])
+                continue
+            layer = node.layer
+            if id(node) in replaced:
+                layer = replaced[id(node)]
+            elif isinstance(layer, keras.Model) and \
+                    getattr(layer, "_is_graph_network", False):
+                layer = rebuild_functional_model(layer, plan_fn, cache)
+            args, kwargs = node.map_arguments(tensors)
+            outputs = layer(*args, **kwargs)
+            for t_id, y in zip(node.flat_output_ids, tf.nest.flatten(outputs)):
+                tensors[t_id] = y
+
+    outputs = [
+        dict.__getitem__(tensors, str(id(x)))
+        for x in model.outputs
+    ]
+    rebuilt = \
+        keras.Model(
+            name=model.name,
+            trainable=model.trainable,
+            inputs=inputs,
+            outputs=tf.nest.pack_sequence_as(model._nested_outputs, outputs))
+    cache[id(model)] = rebuilt
+    return rebuilt
+
+# ---------------------------------------------------------------------
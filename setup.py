@@ -37,6 +37,7 @@ setuptools.setup(
         "tensorflow>=2.6.2",
         "matplotlib>=3.3.4",
         "tensorflow-addons",
+        "Pillow",
     ],
     url="https://github.com/NikolasMarkou/blind_image_denoising",
     include_package_data=True,
@@ -0,0 +1,134 @@
+import pytest
+
+import os
+import sys
+import numpy as np
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.model_denoise import module_denoiser_builder
+from bfcnn.batching import \
+    bucket_shape, \
+    pad_to_shape, \
+    bucketed_inference, \
+    bucketed_denoiser_builder, \
+    benchmark_bucketed_inference
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "height,width,multiple,granularity", [
+        (100, 130, 1, 64),
+        (1080, 1920, 4, 64),
+        (3024, 4032, 4, 64),
+        (17, 33, 4, 1)])
+def test_bucket_shape(height, width, multiple, granularity):
+    h, w = bucket_shape(height, width, multiple, granularity)
+    assert h >= height and w >= width
+    assert h % multiple == 0 and w % multiple == 0
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "shape,target", [((10, 12, 3), (16, 16)), ((5, 5, 1), (32, 32))])
+def test_pad_to_shape(shape, target):
+    image = np.random.randint(0, 256, size=shape).astype(np.uint8)
+    padded = pad_to_shape(image, target[0], target[1])
+    assert padded.shape == target + (shape[2],)
+    assert (padded[:shape[0], :shape[1], :] == image).all()
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "shape,multiple", [((100, 100), 1), ((100, 100), 4), ((64, 64), 8)])
+def test_bucketed_inference_same_shape_one_call(shape, multiple):
+    calls = []
+
+    def model_fn(x):
+        calls.append(x.shape)
+        return x
+
+    images = [
+        np.random.randint(0, 256, size=shape + (3,)).astype(np.uint8)
+        for _ in range(8)
+    ]
+    results = \
+        bucketed_inference(
+            model_fn=model_fn,
+            images=images,
+            multiple=multiple,
+            batch_size=8)
+    # the rounding to the bucket does not count against the padding budget
+    assert len(calls) == 1
+    assert calls[0][0] == 8
+    for image, result in zip(images, results):
+        assert np.array_equal(image, result)
+
+# ---------------------------------------------------------------------
+
+
+def test_bucketed_inference_matches_per_image():
+    config = [
+        c for c in bfcnn.configs
+        if c["model_denoise"]["input_shape"][2] == 3 and
+        "pyramid" in c["model_denoise"]
+    ][0]
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    module = \
+        module_denoiser_builder(
+            model_denoise=models.denoiser,
+            model_normalize=models.normalizer,
+            model_denormalize=models.denormalizer,
+            training_channels=3)
+
+    def model_fn(x):
+        return module(x).numpy()
+
+    rf = bfcnn.receptive_field(models.denoiser)
+    shapes = [(96, 128), (92, 120), (128, 96), (64, 64), (60, 100)]
+    images = [
+        np.random.randint(0, 256, size=s + (3,)).astype(np.uint8)
+        for s in shapes
+    ]
+    denoiser = \
+        bucketed_denoiser_builder(
+            model_fn=model_fn,
+            config=config,
+            granularity=64,
+            batch_size=4)
+    results = denoiser(images)
+    assert len(results) == len(images)
+    for image, result in zip(images, results):
+        assert result.shape == image.shape
+        # compare with a single image call on an aligned image
+        h, w = bucket_shape(image.shape[0], image.shape[1], rf.alignment, 1)
+        expected = model_fn(np.expand_dims(pad_to_shape(image, h, w), 0))[0]
+        expected = expected[:image.shape[0], :image.shape[1], :]
+        diff = np.abs(result.astype(np.float32) - expected.astype(np.float32))
+        # away from the padded border the results must agree
+        interior = diff[:max(image.shape[0] - rf.radius, 0),
+                        :max(image.shape[1] - rf.radius, 0), :]
+        if interior.size > 0:
+            assert np.max(interior) <= 1
+
+    benchmark = \
+        benchmark_bucketed_inference(
+            model_fn=model_fn,
+            images=images,
+            multiple=rf.alignment,
+            granularity=64,
+            batch_size=4)
+    assert benchmark["per_image_images_per_s"] > 0
+    assert benchmark["bucketed_images_per_s"] > 0
+
+# ---------------------------------------------------------------------
@@ -3,6 +3,7 @@ import pytest
 import os
 import sys
 import numpy as np
+import tensorflow as tf
 
 from .constants import *
 
@@ -144,3 +145,128 @@ def test_dataset_builder_build(config):
 
 
 # ---------------------------------------------------------------------
+
+@pytest.mark.parametrize("no_pipelines", [2, 3])
+def test_dataset_builder_input_context(no_pipelines):
+    # no augmentation so every image can be identified by its sum
+    config = {
+        "batch_size": no_pipelines,
+        "input_shape": [128, 384, 3],
+        "inputs": [{
+            "dataset_shape": [128, 384],
+            "directory": str(KITTI_DIR)
+        }]
+    }
+    images = []
+    for i in range(no_pipelines):
+        input_context = \
+            tf.distribute.InputContext(
+                num_input_pipelines=no_pipelines,
+                input_pipeline_id=i,
+                num_replicas_in_sync=no_pipelines)
+        dataset = \
+            bfcnn.dataset.dataset_builder(
+                config=config,
+                input_context=input_context)[bfcnn.dataset.DATASET_FN_STR]
+        for input_batch in dataset:
+            # per replica batch size
+            assert input_batch.shape[0] == 1
+            images.append(float(np.sum(input_batch)))
+
+    # the pipelines split the images between them
+    assert len(images) == len(KITTI_IMAGES)
+    assert len(set(images)) == len(KITTI_IMAGES)
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.parametrize("batch_size", [1, 16])
+def test_augmentation_per_sample(batch_size):
+    config = {
+        "batch_size": batch_size,
+        "random_blur": True,
+        "subsample_size": 3,
+        "quantization": 4,
+        "input_shape": [64, 64, 3],
+        "multiplicative_noise": [0.1, 0.2],
+        "additional_noise": [1, 5, 10, 20, 40],
+        "inputs": [{
+            "dataset_shape": [64, 64],
+            "directory": str(KITTI_DIR)
+        }]
+    }
+    dataset_results = bfcnn.dataset.dataset_builder(config=config)
+    augmentation_fn = dataset_results[bfcnn.dataset.AUGMENTATION_FN_STR]
+    input_batch = tf.random.uniform((batch_size, 64, 64, 3), 0, 255)
+    input_batch = tf.round(input_batch)
+
+    # no python branches, so it runs in a tf.data map
+    dataset = \
+        tf.data.Dataset.from_tensors(input_batch) \
+            .repeat(8) \
+            .map(augmentation_fn, num_parallel_calls=tf.data.AUTOTUNE)
+    residuals = []
+    for noisy_batch in dataset:
+        # subsample_size 3 does not divide 64, the shape is kept
+        assert noisy_batch.shape == input_batch.shape
+        assert noisy_batch.dtype == tf.float32
+        assert np.max(noisy_batch) <= 255
+        assert np.min(noisy_batch) >= 0
+        residuals += \
+            list(np.round(np.std(
+                (noisy_batch - input_batch).numpy().reshape((batch_size, -1)),
+                axis=1), decimals=1))
+
+    # noise type and strength are drawn per sample
+    assert len(set(residuals)) > 1
+
+# ---------------------------------------------------------------------
+
+
+def test_dataset_builder_noise_in_pipeline():
+    # no crop or flips so the pairs only depend on the seed
+    config = {
+        "seed": 1,
+        "batch_size": 4,
+        "noise_in_pipeline": True,
+        "prefetch_buffer_size": -1,
+        "random_blur": True,
+        "subsample_size": 2,
+        "input_shape": [128, 384, 3],
+        "additional_noise": [5, 10, 20],
+        "multiplicative_noise": [0.1, 0.2],
+        "inputs": [{
+            "dataset_shape": [128, 384],
+            "directory": str(KITTI_DIR)
+        }]
+    }
+
+    def epochs(dataset, no_epochs: int):
+        return [
+            [(c.numpy(), n.numpy()) for c, n in dataset]
+            for _ in range(no_epochs)
+        ]
+
+    dataset = \
+        bfcnn.dataset.dataset_builder(config=config)[bfcnn.dataset.DATASET_FN_STR]
+    pairs = epochs(dataset, no_epochs=2)
+    for clean_batch, noisy_batch in pairs[0]:
+        assert clean_batch.shape == noisy_batch.shape
+        assert noisy_batch.dtype == np.float32
+        assert np.max(noisy_batch) <= 255
+        assert np.min(noisy_batch) >= 0
+    assert any([np.any(c != n) for c, n in pairs[0]])
+
+    # the same seed gives the same pairs, every epoch new noise
+    dataset = \
+        bfcnn.dataset.dataset_builder(config=config)[bfcnn.dataset.DATASET_FN_STR]
+    pairs_again = epochs(dataset, no_epochs=1)
+    for (c0, n0), (c1, n1) in zip(pairs[0], pairs_again[0]):
+        assert np.array_equal(c0, c1)
+        assert np.array_equal(n0, n1)
+    noise = [
+        sorted([float(np.sum(n - c)) for c, n in epoch])
+        for epoch in pairs
+    ]
+    assert noise[0] != noise[1]
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,108 @@
+import pytest
+
+import os
+import sys
+import tempfile
+import numpy as np
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.dataset import \
+    dataset_builder, \
+    DATASET_FN_STR, \
+    DATASET_CACHE_STR
+
+# ---------------------------------------------------------------------
+
+IMAGE_BYTES = 128 * 384 * 3
+
+# ---------------------------------------------------------------------
+
+
+def build_config(cache, dataset_shape=(128, 384)):
+    # no augmentation so the images come out as cached
+    return {
+        "batch_size": 2,
+        "input_shape": list(dataset_shape) + [3],
+        "cache": cache,
+        "inputs": [{
+            "dataset_shape": list(dataset_shape),
+            "directory": str(KITTI_DIR)
+        }]
+    }
+
+
+def run_epochs(dataset_results, no_epochs: int):
+    stats = []
+    images = []
+    for _ in range(no_epochs):
+        images = []
+        for input_batch in dataset_results[DATASET_FN_STR]:
+            images += list(input_batch.numpy())
+        stats.append(dataset_results[DATASET_CACHE_STR].log_statistics())
+    return stats, images
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "memory_budget, no_cached", [
+        (-1, len(KITTI_IMAGES)),
+        (2 * IMAGE_BYTES, 2),
+        (0, 0)
+    ])
+def test_memory_cache(memory_budget, no_cached):
+    results = \
+        dataset_builder(
+            build_config({"type": "memory", "memory_budget": memory_budget}))
+    stats, images = run_epochs(results, no_epochs=3)
+
+    # the first epoch decodes everything
+    assert stats[0]["images"] == len(KITTI_IMAGES)
+    assert stats[0]["hit_rate"] == 0.0
+    for s in stats[1:]:
+        assert s["images"] == len(KITTI_IMAGES)
+        assert s["hits"] == no_cached
+
+    # same images as decoding the directory
+    reference = \
+        dataset_builder(
+            build_config(None))[DATASET_FN_STR]
+    reference = sorted([x for b in reference for x in b.numpy()], key=np.sum)
+    for a, b in zip(sorted(images, key=np.sum), reference):
+        assert np.max(np.abs(a - b)) <= 0.5 + 1e-3
+
+# ---------------------------------------------------------------------
+
+
+def test_file_cache():
+    cache_directory = tempfile.mkdtemp()
+    config = build_config({"type": "file", "directory": cache_directory})
+    stats, _ = run_epochs(dataset_builder(config), no_epochs=2)
+    assert stats[0]["hit_rate"] == 0.0
+    assert stats[1]["hit_rate"] == 1.0
+    cache_files = set(os.listdir(cache_directory))
+    assert len(cache_files) > 0
+
+    # a new run reuses the cache from the first epoch
+    stats, _ = run_epochs(dataset_builder(config), no_epochs=1)
+    assert stats[0]["hit_rate"] == 1.0
+
+    # a new dataset_shape rebuilds it and evicts the stale one
+    config = \
+        build_config(
+            {"type": "file", "directory": cache_directory},
+            dataset_shape=(64, 192))
+    stats, images = run_epochs(dataset_builder(config), no_epochs=1)
+    assert stats[0]["hit_rate"] == 0.0
+    assert images[0].shape == (64, 192, 3)
+    assert len(cache_files.intersection(os.listdir(cache_directory))) == 0
+
+# ---------------------------------------------------------------------
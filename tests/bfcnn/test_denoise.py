@@ -0,0 +1,214 @@
+import pytest
+
+import os
+import sys
+import shutil
+import argparse
+import threading
+import numpy as np
+from PIL import Image
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.denoise import denoise_directory, main
+
+# ---------------------------------------------------------------------
+
+
+class InvertModel:
+    # uint8 255 - x, records the batch sizes
+    def __init__(self):
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        assert x.dtype == np.uint8 and len(x.shape) == 4
+        with self._lock:
+            self.batch_sizes.append(x.shape[0])
+        return 255 - x
+
+
+@pytest.fixture
+def images_directory(tmp_path):
+    # a few formats, modes and shapes in nested directories
+    rng = np.random.default_rng(0)
+    directory = tmp_path / "input"
+    (directory / "nested").mkdir(parents=True)
+    for i in range(5):
+        Image.fromarray(rng.integers(0, 255, (32, 48, 3), dtype=np.uint8)) \
+            .save(directory / f"{i}.png")
+    exif = Image.Exif()
+    exif[0x010f] = "bfcnn camera"
+    Image.fromarray(rng.integers(0, 255, (40, 40, 3), dtype=np.uint8)) \
+        .save(directory / "nested" / "photo.jpg", quality=90, exif=exif)
+    Image.fromarray(rng.integers(0, 255, (24, 24), dtype=np.uint8)) \
+        .save(directory / "nested" / "gray.png")
+    Image.fromarray(rng.integers(0, 255, (24, 24, 4), dtype=np.uint8), mode="RGBA") \
+        .save(directory / "nested" / "alpha.png")
+    (directory / "notes.txt").write_text("not an image")
+    return directory
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_denoise_directory(images_directory, tmp_path, workers):
+    output_directory = tmp_path / "output"
+    model = InvertModel()
+    report = \
+        denoise_directory(
+            model_fn=model,
+            input_directory=images_directory,
+            output_directory=output_directory,
+            batch_size=4,
+            workers=workers)
+    assert report["images"] == 8
+    assert report["failed"] == 0
+    assert report["images_per_s"] > 0
+    # images of the same shape are batched, 4 + 1 of the 32x48 pngs,
+    # the 24x24 gray and alpha pngs together and the jpg alone
+    assert sorted(model.batch_sizes) == [1, 1, 2, 4]
+
+    for i in range(5):
+        x = np.asarray(Image.open(images_directory / f"{i}.png"))
+        y = np.asarray(Image.open(output_directory / f"{i}.png"))
+        assert np.array_equal(y, 255 - x)
+
+    # format, mode, alpha and metadata are kept
+    with Image.open(output_directory / "nested" / "photo.jpg") as image:
+        assert image.format == "JPEG"
+        assert image.getexif()[0x010f] == "bfcnn camera"
+    with Image.open(output_directory / "nested" / "gray.png") as image:
+        assert image.mode == "L"
+    x = np.asarray(Image.open(images_directory / "nested" / "alpha.png"))
+    with Image.open(output_directory / "nested" / "alpha.png") as image:
+        assert image.mode == "RGBA"
+        y = np.asarray(image)
+        assert np.array_equal(y[..., 3], x[..., 3])
+        assert np.array_equal(y[..., 0:3], 255 - x[..., 0:3])
+    assert not (output_directory / "notes.txt").exists()
+    assert len(list(output_directory.rglob("*.tmp"))) == 0
+
+
+def test_denoise_directory_resume(images_directory, tmp_path):
+    output_directory = tmp_path / "output"
+    denoise_directory(
+        model_fn=InvertModel(),
+        input_directory=images_directory,
+        output_directory=output_directory)
+    os.remove(output_directory / "3.png")
+    model = InvertModel()
+    report = \
+        denoise_directory(
+            model_fn=model,
+            input_directory=images_directory,
+            output_directory=output_directory)
+    assert report["images"] == 1
+    assert report["skipped"] == 7
+    assert model.batch_sizes == [1]
+    report = \
+        denoise_directory(
+            model_fn=InvertModel(),
+            input_directory=images_directory,
+            output_directory=output_directory,
+            overwrite=True)
+    assert report["images"] == 8
+
+
+def test_denoise_directory_resume_output_inside_input(images_directory):
+    output_directory = images_directory / "output"
+    report = \
+        denoise_directory(
+            model_fn=InvertModel(),
+            input_directory=images_directory,
+            output_directory=output_directory)
+    assert report["images"] == 8
+    # the outputs of the first run are not inputs of the second
+    model = InvertModel()
+    report = \
+        denoise_directory(
+            model_fn=model,
+            input_directory=images_directory,
+            output_directory=output_directory)
+    assert report["images"] == 0
+    assert report["skipped"] == 8
+    assert model.batch_sizes == []
+    assert not (output_directory / "output").exists()
+
+
+def test_denoise_directory_failures(images_directory, tmp_path):
+    (images_directory / "broken.png").write_bytes(b"not a png")
+    report = \
+        denoise_directory(
+            model_fn=InvertModel(),
+            input_directory=images_directory,
+            output_directory=tmp_path / "output")
+    assert report["images"] == 8
+    assert report["failed"] == 1
+    with pytest.raises(ValueError):
+        denoise_directory(
+            model_fn=InvertModel(),
+            input_directory=images_directory,
+            output_directory=images_directory)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_denoise_directory_mixed_shapes_bounded(tmp_path, workers):
+    # every image has its own shape, none of them fills a batch
+    directory = tmp_path / "input"
+    directory.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(40):
+        Image.fromarray(rng.integers(0, 255, (16 + i, 16, 3), dtype=np.uint8)) \
+            .save(directory / f"{i:02d}.png")
+    model = InvertModel()
+    report = \
+        denoise_directory(
+            model_fn=model,
+            input_directory=directory,
+            output_directory=tmp_path / "output",
+            batch_size=4,
+            workers=workers)
+    assert report["images"] == 40
+    assert len(model.batch_sizes) == 40
+    # decoded images waiting for a batch stay within the window
+    assert 0 < report["max_pending"] <= workers + 4 + 1
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.skipif(
+    len(bfcnn.pretrained_models) == 0,
+    reason="no pretrained models")
+@pytest.mark.parametrize("tflite", [False, True])
+def test_denoise_main_pretrained(tmp_path, tflite):
+    model_name = sorted(bfcnn.pretrained_models.keys())[0]
+    input_directory = tmp_path / "input"
+    input_directory.mkdir()
+    for path in KITTI_IMAGES[0:2]:
+        shutil.copy(path, input_directory)
+
+    args = \
+        argparse.Namespace(
+            model=model_name,
+            tflite=tflite,
+            input_directory=str(input_directory),
+            output_directory=str(tmp_path / "output"),
+            batch_size=2,
+            workers=2,
+            overwrite=False)
+    assert main(args) == 0
+    for path in KITTI_IMAGES[0:2]:
+        x = np.asarray(Image.open(path))
+        y = np.asarray(Image.open(tmp_path / "output" / path.name))
+        assert y.shape == x.shape
+        assert np.mean(np.abs(y.astype(np.float32) - x)) < 10
+
+# ---------------------------------------------------------------------
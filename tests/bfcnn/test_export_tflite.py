@@ -0,0 +1,257 @@
+import pytest
+
+import os
+import sys
+import copy
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.model_denoise import module_denoiser_builder
+from bfcnn.export_tflite import \
+    psnr, \
+    TFLitePrecision, \
+    export_int8_tflite, \
+    split_representative_files, \
+    select_tflite_variant, \
+    export_tflite_variants, \
+    export_sparse_tflite, \
+    benchmark_sparse_tflite, \
+    benchmark_dataset_builder
+
+# ---------------------------------------------------------------------
+
+
+def build_representative_directory(no_images: int = 6) -> str:
+    directory = tempfile.mkdtemp()
+    for i in range(no_images):
+        image = \
+            np.random.randint(
+                low=0,
+                high=256,
+                size=(80, 96, 3)).astype(np.uint8)
+        tf.io.write_file(
+            os.path.join(directory, f"{i}.png"),
+            tf.io.encode_png(image))
+    return directory
+
+# ---------------------------------------------------------------------
+
+
+def test_psnr():
+    x = np.zeros((8, 8, 3), dtype=np.uint8)
+    assert psnr(x, x) > 90
+    assert abs(psnr(x, x + 1) - 48.13) < 0.01
+
+# ---------------------------------------------------------------------
+
+
+def test_precision_from_string():
+    assert TFLitePrecision.from_string("int8") == TFLitePrecision.INT8
+    assert TFLitePrecision.from_string(" fp32 ") == TFLitePrecision.FP32
+    assert TFLitePrecision.from_string("dynamic-range") == \
+           TFLitePrecision.DYNAMIC_RANGE
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("use_directory", [False, True])
+def test_benchmark_dataset_is_fixed(use_directory):
+    directory = None
+    if use_directory:
+        directory = build_representative_directory()
+    first = benchmark_dataset_builder([32, 48, 3], directory, no_samples=4)
+    second = benchmark_dataset_builder([32, 48, 3], directory, no_samples=4)
+    for a, b in zip(first[0] + first[1], second[0] + second[1]):
+        assert a.shape == (1, 32, 48, 3)
+        assert a.dtype == np.uint8
+        assert (a == b).all()
+
+# ---------------------------------------------------------------------
+
+
+def build_module():
+    config = [
+        c for c in bfcnn.configs
+        if c["model_denoise"]["input_shape"][2] == 3 and
+        "pyramid" in c["model_denoise"]
+    ][0]
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    module = \
+        module_denoiser_builder(
+            model_denoise=models.denoiser,
+            model_normalize=models.normalizer,
+            model_denormalize=models.denormalizer,
+            training_channels=3)
+    dataset_config = copy.deepcopy(config["dataset"])
+    dataset_config["input_shape"] = [64, 64, 3]
+    return module, dataset_config
+
+# ---------------------------------------------------------------------
+
+
+def test_export_int8_tflite():
+    module, dataset_config = build_module()
+    output_directory = tempfile.mkdtemp()
+
+    report = \
+        export_int8_tflite(
+            module=module,
+            dataset_config=dataset_config,
+            representative_directory=build_representative_directory(),
+            output_directory=output_directory,
+            no_calibration_samples=4,
+            no_evaluation_samples=2)
+
+    for key in ["fp32", "int8", "psnr_delta", "size_ratio", "speedup"]:
+        assert key in report
+    # 6 images split by file in proportion to the samples
+    assert report["calibration_files"] == 4
+    assert report["evaluation_files"] == 2
+    assert report["int8"]["size_bytes"] < report["fp32"]["size_bytes"]
+    assert report["int8"]["latency_ms"] > 0
+
+    # uint8 pixels in and out with identity quantization
+    interpreter = \
+        tf.lite.Interpreter(
+            model_path=os.path.join(output_directory, "model_int8.tflite"))
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+    assert input_details["dtype"] == np.uint8
+    assert output_details["dtype"] == np.uint8
+    assert input_details["quantization"] == (1.0, 0)
+    assert output_details["quantization"] == (1.0, 0)
+    assert os.path.isfile(os.path.join(output_directory, "model_int8.json"))
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "no_images, no_calibration_samples, no_evaluation_samples", [
+        (6, 4, 2),
+        (3, 64, 16),
+        (20, 4, 16),
+    ])
+def test_split_representative_files(
+        no_images, no_calibration_samples, no_evaluation_samples):
+    directory = build_representative_directory(no_images=no_images)
+    calibration, evaluation = \
+        split_representative_files(
+            directory=directory,
+            no_calibration_samples=no_calibration_samples,
+            no_evaluation_samples=no_evaluation_samples)
+    # held-out evaluation images, never calibrated on
+    assert len(calibration) > 0
+    assert len(evaluation) > 0
+    assert len(set(calibration).intersection(evaluation)) == 0
+    assert len(calibration) + len(evaluation) == no_images
+
+
+def test_export_int8_tflite_too_few_images():
+    module, dataset_config = build_module()
+    with pytest.raises(ValueError):
+        export_int8_tflite(
+            module=module,
+            dataset_config=dataset_config,
+            representative_directory=build_representative_directory(no_images=1),
+            output_directory=tempfile.mkdtemp(),
+            no_calibration_samples=4,
+            no_evaluation_samples=2)
+
+# ---------------------------------------------------------------------
+
+
+def test_export_tflite_variants():
+    module, dataset_config = build_module()
+    output_directory = tempfile.mkdtemp()
+
+    result = \
+        export_tflite_variants(
+            module=module,
+            dataset_config=dataset_config,
+            precisions=[
+                TFLitePrecision.FP16,
+                TFLitePrecision.DYNAMIC_RANGE
+            ],
+            output_directory=output_directory,
+            no_benchmark_samples=2)
+
+    precisions = [v["precision"] for v in result["variants"]]
+    assert precisions == ["FP32", "FP16", "DYNAMIC_RANGE"]
+    for variant in result["variants"]:
+        assert os.path.isfile(os.path.join(output_directory, variant["path"]))
+        assert variant["latency_ms"] > 0
+        assert variant["size_bytes"] > 0
+    sizes = {v["precision"]: v["size_bytes"] for v in result["variants"]}
+    assert sizes["FP16"] < sizes["FP32"]
+    assert sizes["DYNAMIC_RANGE"] < sizes["FP16"]
+
+    selected = \
+        select_tflite_variant(
+            directory=output_directory,
+            max_psnr_loss=100.0,
+            iterations=1)
+    assert selected["precision"] in precisions
+    assert os.path.isfile(selected["path"])
+
+    # a zero loss budget can always fall back to fp32
+    selected = \
+        select_tflite_variant(
+            directory=output_directory,
+            max_psnr_loss=0.0,
+            measure_latency=False)
+    assert selected["psnr_loss"] <= 0.0
+
+# ---------------------------------------------------------------------
+
+
+def test_export_sparse_tflite():
+    module, dataset_config = build_module()
+    bfcnn.pruning.prune_function_builder({
+        "type": "drop_bottom",
+        "config": {"percentage": 0.8}
+    })(module._model_denoise)
+    output_directory = tempfile.mkdtemp()
+
+    report = \
+        export_sparse_tflite(
+            module=module,
+            dataset_config=dataset_config,
+            output_directory=output_directory,
+            no_benchmark_samples=2)
+
+    assert report["sparsity"] > 0.7
+    assert report["sparse"]["size_bytes"] < report["dense"]["size_bytes"]
+    # the encoding is lossless
+    assert report["psnr_sparse_vs_dense"] > 90
+    assert os.path.isfile(os.path.join(output_directory, "model_sparse.tflite"))
+    assert os.path.isfile(os.path.join(output_directory, "sparse.json"))
+
+# ---------------------------------------------------------------------
+
+
+def test_benchmark_sparse_tflite():
+    # converting every configuration takes minutes,
+    # the full sweep is run by hand with bfcnn.configs
+    configs = bfcnn.configs[:2]
+    reports = \
+        benchmark_sparse_tflite(
+            configs=configs,
+            input_shape=[32, 32],
+            no_samples=1)
+    assert len(reports) == len(configs)
+    for report in reports:
+        assert report["size_ratio"] < 1.0
+        assert report["dense"]["latency_ms"] > 0
+        assert report["sparse"]["latency_ms"] > 0
+
+# ---------------------------------------------------------------------
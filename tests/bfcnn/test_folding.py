@@ -0,0 +1,104 @@
+import keras
+import pytest
+
+import os
+import sys
+import numpy as np
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.folding import \
+    folding_error, \
+    fold_batch_normalization, \
+    count_batch_normalization, \
+    DEFAULT_FOLDING_TOLERANCE
+
+# ---------------------------------------------------------------------
+
+
+def randomize_batch_normalization(model: keras.Model):
+    # fresh layers have identity statistics which would hide folding errors
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.BatchNormalization):
+            shape = layer.moving_mean.shape
+            layer.moving_mean.assign(np.random.normal(0.0, 0.5, shape))
+            layer.moving_variance.assign(np.random.uniform(0.5, 2.0, shape))
+            if layer.scale:
+                layer.gamma.assign(np.random.uniform(0.5, 1.5, shape))
+            if layer.center:
+                layer.beta.assign(np.random.normal(0.0, 0.5, shape))
+        elif isinstance(layer, keras.Model):
+            randomize_batch_normalization(layer)
+
+# ---------------------------------------------------------------------
+
+
+def test_fold_only_where_exact():
+    input_layer = keras.Input(shape=(None, None, 8))
+    # bn -> 1x1 conv, folded
+    x = keras.layers.BatchNormalization(center=False)(input_layer)
+    x = keras.layers.Conv2D(
+        filters=8, kernel_size=1, use_bias=False, activation="relu")(x)
+    # bn -> 3x3 same conv, kept because of the zero padding
+    x = keras.layers.BatchNormalization()(x)
+    x = keras.layers.Conv2D(
+        filters=8, kernel_size=3, padding="same", activation="linear")(x)
+    # linear conv -> bn, folded
+    x = keras.layers.BatchNormalization()(x)
+    # bn -> grouped 1x1 conv, folded
+    x = keras.layers.BatchNormalization()(x)
+    x = keras.layers.Conv2D(filters=4, kernel_size=1, groups=2)(x)
+    model = keras.Model(inputs=input_layer, outputs=x)
+    randomize_batch_normalization(model)
+
+    folded = fold_batch_normalization(model)
+    assert count_batch_normalization(model) == 4
+    assert count_batch_normalization(folded) == 1
+    assert folding_error(model, folded, [32, 32, 8]) < DEFAULT_FOLDING_TOLERANCE
+
+
+
+def test_fold_keeps_zero_bias_out():
+    input_layer = keras.Input(shape=(None, None, 8))
+    # bn without offset and zero mean -> 1x1 conv without bias
+    x = keras.layers.BatchNormalization(center=False)(input_layer)
+    x = keras.layers.Conv2D(
+        filters=8, kernel_size=1, use_bias=False, activation="relu")(x)
+    # bn with offset -> 1x1 conv without bias, the offset needs a bias
+    x = keras.layers.BatchNormalization()(x)
+    x = keras.layers.Conv2D(filters=8, kernel_size=1, use_bias=False)(x)
+    model = keras.Model(inputs=input_layer, outputs=x)
+    randomize_batch_normalization(model)
+    model.layers[1].moving_mean.assign(np.zeros((8,)))
+
+    folded = fold_batch_normalization(model)
+    convs = [
+        layer for layer in folded.layers
+        if isinstance(layer, keras.layers.Conv2D)
+    ]
+    assert [c.use_bias for c in convs] == [False, True]
+    assert folding_error(model, folded, [32, 32, 8]) < DEFAULT_FOLDING_TOLERANCE
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", bfcnn.configs)
+def test_fold_denoiser(config):
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    randomize_batch_normalization(models.denoiser)
+    folded = fold_batch_normalization(models.denoiser)
+    input_shape = [64, 64, config["model_denoise"]["input_shape"][2]]
+    assert count_batch_normalization(folded) <= \
+           count_batch_normalization(models.denoiser)
+    assert folding_error(models.denoiser, folded, input_shape) < \
+           DEFAULT_FOLDING_TOLERANCE
+
+# ---------------------------------------------------------------------
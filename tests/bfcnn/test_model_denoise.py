@@ -3,7 +3,9 @@ import pytest
 
 import os
 import sys
+import copy
 import numpy as np
+import tensorflow as tf
 
 from .constants import *
 
@@ -14,6 +16,7 @@ sys.path.append(os.getcwd() + "/../")
 # ---------------------------------------------------------------------
 
 import bfcnn
+from bfcnn.model_denoise import module_denoiser_builder, reflect_indices
 
 
 # ---------------------------------------------------------------------
@@ -31,3 +34,131 @@ def test_model_builder(config):
     assert isinstance(models.denormalizer, keras.Model)
 
 # ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", [
+        c for c in bfcnn.configs
+        if "pyramid" in c["model_denoise"]
+    ])
+def test_module_denoiser_arbitrary_shape(config):
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    no_channels = config["model_denoise"]["input_shape"][2]
+    module = \
+        module_denoiser_builder(
+            model_denoise=models.denoiser,
+            model_normalize=models.normalizer,
+            model_denormalize=models.denormalizer,
+            training_channels=no_channels)
+    for shape in [(1, 37, 53), (2, 64, 64), (1, 30, 97)]:
+        x = \
+            np.random.randint(
+                low=0,
+                high=256,
+                size=shape + (no_channels,)).astype(np.uint8)
+        y = module(x).numpy()
+        assert y.shape == x.shape
+        assert y.dtype == np.uint8
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", bfcnn.configs)
+def test_model_builder_mixed_precision(config):
+    model_config = dict(config["model_denoise"])
+    model_config["mixed_precision"] = True
+    models = bfcnn.model_builder(config=model_config)
+    no_channels = model_config["input_shape"][2]
+    x = \
+        np.random.uniform(
+            low=-0.5,
+            high=+0.5,
+            size=(1, 64, 64, no_channels)).astype(np.float32)
+    # float32 master weights and outputs
+    assert all([w.dtype == "float32" for w in models.denoiser.weights])
+    assert models.denoiser(x).dtype == "float32"
+    assert models.normalizer.compute_dtype == "float32"
+    assert keras.mixed_precision.global_policy().name == "float32"
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", [
+        c for c in bfcnn.configs
+        if "pyramid" in c["model_denoise"]
+    ][0:1])
+def test_module_denoiser_tiny_shape(config):
+    # inputs smaller than the pad multiple
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    no_channels = config["model_denoise"]["input_shape"][2]
+    module = \
+        module_denoiser_builder(
+            model_denoise=models.denoiser,
+            model_normalize=models.normalizer,
+            model_denormalize=models.denormalizer,
+            training_channels=no_channels,
+            pad_multiple=8)
+    for shape in [(1, 1, 1), (1, 3, 3), (2, 2, 7), (1, 5, 16)]:
+        x = \
+            np.random.randint(
+                low=0,
+                high=256,
+                size=shape + (no_channels,)).astype(np.uint8)
+        y = module(x).numpy()
+        assert y.shape == x.shape
+        assert y.dtype == np.uint8
+
+
+def test_reflect_indices():
+    # same as tf.pad REFLECT where that is defined
+    x = tf.reshape(tf.range(5), (1, 5, 1, 1))
+    for pad in range(5):
+        expected = \
+            tf.pad(x, paddings=[[0, 0], [0, pad], [0, 0], [0, 0]], mode="REFLECT")
+        y = tf.gather(x, reflect_indices(5, 5 + pad), axis=1)
+        assert np.array_equal(y.numpy(), expected.numpy())
+    # and keeps reflecting past it
+    assert reflect_indices(3, 9).numpy().tolist() == [0, 1, 2, 1, 0, 1, 2, 1, 0]
+    assert reflect_indices(1, 4).numpy().tolist() == [0, 0, 0, 0]
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", [
+        [c for c in bfcnn.configs
+         if c["model_denoise"]["type"] == "resnet" and
+         (pyramid == ("pyramid" in c["model_denoise"]))][0]
+        for pyramid in [False, True]
+    ])
+def test_model_builder_temporal_context(config):
+    config = copy.deepcopy(config["model_denoise"])
+    config["temporal_context"] = True
+    no_channels = config["input_shape"][2]
+    models = bfcnn.model_builder(config=config)
+    # [frame, previous denoised frame] in, denoised frame out
+    assert models.denoiser.input_shape[-1] == no_channels * 2
+    x = np.random.uniform(-0.5, 0.5, size=(1, 64, 64, no_channels * 2))
+    y = models.denoiser(x, training=False)
+    if isinstance(y, list):
+        y = y[0]
+    assert y.shape == (1, 64, 64, no_channels)
+    # another previous frame changes the output
+    x_other = np.copy(x)
+    x_other[..., no_channels:] = 0.0
+    y_other = models.denoiser(x_other, training=False)
+    if isinstance(y_other, list):
+        y_other = y_other[0]
+    assert not np.allclose(y, y_other)
+
+    config = copy.deepcopy([
+        c for c in bfcnn.configs
+        if c["model_denoise"]["type"] == "unet"
+    ][0]["model_denoise"])
+    config["temporal_context"] = True
+    with pytest.raises(ValueError):
+        bfcnn.model_builder(config=config)
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,100 @@
+import pytest
+
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.patch_sampler import sample_patches
+
+# ---------------------------------------------------------------------
+
+
+def find_patch(image: np.ndarray, patch: np.ndarray) -> bool:
+    # true if the patch is a crop of the image
+    h, w = patch.shape[0:2]
+    for y in range(image.shape[0] - h + 1):
+        for x in np.nonzero(np.all(image[y, :, :] == patch[0, 0, :], axis=-1))[0]:
+            if x + w <= image.shape[1] and \
+                    np.array_equal(image[y:y + h, x:x + w, :], patch):
+                return True
+    return False
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "image_path", [MEGADEPTH_IMAGES[0], KITTI_IMAGES[0]])
+def test_sample_patches_native_resolution(image_path):
+    contents = tf.io.read_file(str(image_path))
+    image = tf.io.decode_image(contents, channels=3).numpy()
+    patches = \
+        sample_patches(
+            contents=contents,
+            patch_shape=[32, 48],
+            patches_per_image=4,
+            channels=3,
+            seed=tf.constant([1, 2], dtype=tf.int64)).numpy()
+    assert patches.shape == (4, 32, 48, 3)
+    assert patches.dtype == np.uint8
+    # partially decoded jpeg patches are the same pixels as a full decode
+    for patch in patches:
+        assert find_patch(image, patch)
+
+
+def test_sample_patches_small_image():
+    image = tf.cast(tf.random.uniform((20, 200, 3), 0, 255), tf.uint8)
+    patches = \
+        sample_patches(
+            contents=tf.io.encode_jpeg(image),
+            patch_shape=[32, 48],
+            patches_per_image=3,
+            channels=3,
+            seed=tf.constant([1, 2], dtype=tf.int64))
+    assert patches.shape == (3, 32, 48, 3)
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("patches_per_image", [1, 3])
+def test_dataset_builder_patches(patches_per_image):
+    config = {
+        "seed": 1,
+        "batch_size": 4,
+        "input_shape": [64, 64, 3],
+        "inputs": [{
+            "directory": str(MEGADEPTH_DIR),
+            "patches_per_image": patches_per_image
+        }, {
+            "directory": str(KITTI_DIR),
+            "patches_per_image": patches_per_image
+        }]
+    }
+
+    def patches():
+        dataset = \
+            bfcnn.dataset.dataset_builder(config)[bfcnn.dataset.DATASET_FN_STR]
+        result = []
+        for input_batch in dataset:
+            assert input_batch.shape[1:] == (64, 64, 3)
+            assert input_batch.dtype == tf.float32
+            result += list(input_batch.numpy())
+        return result
+
+    result = patches()
+    assert len(result) == \
+        patches_per_image * (len(MEGADEPTH_IMAGES) + len(KITTI_IMAGES))
+    # the same seed samples the same patches
+    for a, b in zip(result, patches()):
+        assert np.array_equal(a, b)
+
+# ---------------------------------------------------------------------
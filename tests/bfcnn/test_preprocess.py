@@ -0,0 +1,115 @@
+import pytest
+
+import os
+import sys
+import tempfile
+import numpy as np
+import tensorflow as tf
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.preprocess import preprocess_images, shards_dataset
+
+# ---------------------------------------------------------------------
+
+
+def build_config(**inputs):
+    # no augmentation so the images come out as stored
+    return {
+        "batch_size": 2,
+        "input_shape": [128, 384, 3],
+        "inputs": [dict(dataset_shape=[128, 384], **inputs)]
+    }
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("no_shards", [1, 4])
+def test_preprocess_images(no_shards):
+    output_directory = tempfile.mkdtemp()
+    metadata = \
+        preprocess_images(
+            directory=KITTI_DIR,
+            output_directory=output_directory,
+            dataset_shape=[128, 384],
+            no_shards=no_shards)
+    assert metadata["shape"] == [128, 384, 3]
+    assert metadata["no_images"] == len(KITTI_IMAGES)
+    assert len(metadata["files"]) == no_shards
+    for f in metadata["files"]:
+        assert os.path.isfile(os.path.join(output_directory, f))
+
+    # the shards hold the resized images of the directory
+    config = build_config(directory=str(KITTI_DIR))
+    config["batch_size"] = len(KITTI_IMAGES)
+    images = \
+        next(iter(
+            bfcnn.dataset.dataset_builder(config)[bfcnn.dataset.DATASET_FN_STR]))
+    images = sorted(list(images.numpy()), key=np.sum)
+    images_shards = \
+        sorted(list(shards_dataset(output_directory).as_numpy_iterator()), key=np.sum)
+    assert len(images_shards) == len(images)
+    for a, b in zip(images, images_shards):
+        assert np.max(np.abs(a - b)) <= 0.5 + 1e-3
+
+# ---------------------------------------------------------------------
+
+
+def test_preprocess_images_patches():
+    output_directory = tempfile.mkdtemp()
+    metadata = \
+        preprocess_images(
+            directory=KITTI_DIR,
+            output_directory=output_directory,
+            dataset_shape=[128, 384],
+            patch_shape=[64, 64],
+            color_mode="grayscale")
+    assert metadata["shape"] == [64, 64, 1]
+    assert metadata["no_images"] == len(KITTI_IMAGES) * 2 * 6
+    dataset = shards_dataset(output_directory, channels=3)
+    for x in dataset.take(4):
+        assert x.shape == (64, 64, 3)
+        assert x.dtype == tf.float32
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("no_pipelines", [1, 2, 3])
+def test_dataset_builder_shards(no_pipelines):
+    output_directory = tempfile.mkdtemp()
+    preprocess_images(
+        directory=KITTI_DIR,
+        output_directory=output_directory,
+        dataset_shape=[128, 384],
+        no_shards=2)
+    config = build_config(shards=output_directory)
+    config["batch_size"] = no_pipelines
+
+    images = []
+    for i in range(no_pipelines):
+        input_context = \
+            tf.distribute.InputContext(
+                num_input_pipelines=no_pipelines,
+                input_pipeline_id=i,
+                num_replicas_in_sync=no_pipelines)
+        dataset = \
+            bfcnn.dataset.dataset_builder(
+                config=config,
+                input_context=input_context)[bfcnn.dataset.DATASET_FN_STR]
+        for input_batch in dataset:
+            assert input_batch.shape[1:] == (128, 384, 3)
+            assert input_batch.dtype == tf.float32
+            images += [float(np.sum(x)) for x in input_batch.numpy()]
+
+    # every image exactly once over the pipelines
+    assert len(images) == len(KITTI_IMAGES)
+    assert len(set(images)) == len(KITTI_IMAGES)
+
+# ---------------------------------------------------------------------
@@ -24,6 +24,8 @@ import bfcnn
     "model_name", bfcnn.pretrained_models.keys())
 def test_pretrained_models(model_name):
     model_structure = bfcnn.pretrained_models[model_name]
+    if not os.path.isfile(model_structure["tf"]):
+        pytest.skip(f"no saved_model.pb for [{model_name}]")
     model = model_structure["load_tf"]()
     for img_path in KITTI_IMAGES:
         # load image
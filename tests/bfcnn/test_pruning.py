@@ -1,5 +1,7 @@
 import os
 import sys
+import keras
+import argparse
 import pytest
 import numpy as np
 
@@ -17,6 +19,8 @@ import bfcnn
 from bfcnn.pruning import \
     prune_strategy_helper, \
     PruneStrategy, \
+    prune_channels, \
+    channel_pruning_report, \
     reshape_to_4d_to_2d, \
     reshape_to_2d_to_4d
 
@@ -201,3 +205,138 @@ def test_drop_bottom_strategy(shape):
 
 
 # ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "shape", KERNEL_SHAPES)
+def test_channel_drop_bottom_strategy(shape):
+    percentage = 0.5
+    fn = \
+        prune_strategy_helper(
+            strategy=PruneStrategy.CHANNEL_DROP_BOTTOM,
+            percentage=percentage)
+    x = np.random.random(size=shape)
+    x_p = fn(x)
+    assert x.shape == x_p.shape
+    zero_filters = np.all(x_p == 0, axis=(0, 1, 2))
+    assert np.sum(zero_filters) == int(np.round(shape[3] * percentage))
+    # surviving filters are untouched
+    assert (x_p[..., ~zero_filters] == x[..., ~zero_filters]).all()
+    # biases are left as they are
+    bias = np.random.random(size=(shape[3],))
+    assert (fn(bias) == bias).all()
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("groups", [1, 2])
+@pytest.mark.parametrize(
+    "kernel_size, padding", [(1, "same"), (3, "valid"), (3, "same")])
+def test_prune_channels_removes_dead_channels(groups, kernel_size, padding):
+    input_layer = keras.Input(shape=(None, None, 4))
+    x = keras.layers.Conv2D(
+        filters=16, kernel_size=1, activation="relu")(input_layer)
+    x = keras.layers.BatchNormalization()(x)
+    x = keras.layers.Conv2D(
+        filters=8, kernel_size=kernel_size, padding=padding,
+        groups=groups, use_bias=False)(x)
+    model = keras.Model(inputs=input_layer, outputs=x)
+    conv = model.layers[1]
+    bn = model.layers[2]
+    # dead filters with a bias become constant channels
+    kernel, bias = conv.get_weights()
+    kernel[..., ::2] = 0.0
+    conv.set_weights([kernel, np.random.normal(size=bias.shape)])
+    bn.moving_mean.assign(np.random.normal(size=(16,)))
+    bn.beta.assign(np.random.normal(size=(16,)))
+
+    pruned = \
+        prune_channels(
+            model=model,
+            strategy=PruneStrategy.CHANNEL_MINIMUM_THRESHOLD,
+            channel_multiple=1,
+            minimum_threshold=0.0)
+    if kernel_size == 3 and padding == "same":
+        # the zero padding makes the removed constants wrong at the borders
+        assert pruned.layers[1].filters == 16
+    else:
+        assert pruned.layers[1].filters == 8
+        assert pruned.count_params() < model.count_params()
+    # exact everywhere, borders included
+    x = np.random.uniform(size=(2, 16, 16, 4)).astype(np.float32)
+    y = model(x, training=False).numpy()
+    y_pruned = pruned(x, training=False).numpy()
+    assert np.max(np.abs(y - y_pruned)) < 1e-4
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", bfcnn.configs)
+def test_prune_channels_configs(config):
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    pruned = \
+        prune_channels(
+            model=models.denoiser,
+            strategy=PruneStrategy.CHANNEL_DROP_BOTTOM,
+            percentage=0.5)
+    no_channels = config["model_denoise"]["input_shape"][2]
+    x = np.random.uniform(-0.5, 0.5, size=(1, 32, 32, no_channels))
+    y = models.denoiser(x, training=False)
+    y_pruned = pruned(x, training=False)
+    if isinstance(y, list):
+        y = y[0]
+        y_pruned = y_pruned[0]
+    assert y.shape == y_pruned.shape
+    assert pruned.count_params() <= models.denoiser.count_params()
+
+# ---------------------------------------------------------------------
+
+
+def test_channel_pruning_report():
+    config = [
+        c for c in bfcnn.configs
+        if c["model_denoise"]["type"] == "resnet"
+    ][0]
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    pruned = \
+        prune_channels(
+            model=models.denoiser,
+            strategy=PruneStrategy.CHANNEL_DROP_BOTTOM,
+            percentage=0.5)
+    input_shape = [32, 32, config["model_denoise"]["input_shape"][2]]
+    report = \
+        channel_pruning_report(
+            model=models.denoiser,
+            pruned=pruned,
+            input_shape=input_shape,
+            iterations=2)
+    assert report["flops_after"] < report["flops_before"]
+    assert report["parameters_after"] < report["parameters_before"]
+    assert report["latency_ms_before"] > 0
+    assert report["latency_ms_after"] > 0
+
+# ---------------------------------------------------------------------
+
+
+def test_prune_channels_strategy_flags():
+    from bfcnn.export import prune_channels_strategy
+    args = \
+        argparse.Namespace(
+            prune_channels_threshold=0.0,
+            prune_channels_fraction=None)
+    assert prune_channels_strategy(args)["type"] == "channel_minimum_threshold"
+    args.prune_channels_fraction = 0.25
+    with pytest.raises(ValueError):
+        prune_channels_strategy(args)
+    args.prune_channels_threshold = None
+    strategy = prune_channels_strategy(args)
+    assert strategy["type"] == "channel_drop_bottom"
+    assert strategy["config"]["percentage"] == 0.25
+    # a fraction, not a percentage
+    for fraction in [-0.1, 1.5, 10.0]:
+        args.prune_channels_fraction = fraction
+        with pytest.raises(ValueError):
+            prune_channels_strategy(args)
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,99 @@
+import keras
+import pytest
+
+import os
+import sys
+import numpy as np
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "kernel_sizes,expected_radius", [
+        ([1], 0), ([3], 1), ([5], 2), ([3, 3], 2), ([5, 3, 1], 3)])
+def test_receptive_field_conv_stack(kernel_sizes, expected_radius):
+    input_layer = keras.Input(shape=(None, None, 3))
+    x = input_layer
+    for k in kernel_sizes:
+        x = keras.layers.Conv2D(filters=4, kernel_size=k, padding="same")(x)
+    model = keras.Model(inputs=input_layer, outputs=x)
+    rf = bfcnn.receptive_field(model)
+    assert rf.radius == expected_radius
+    assert rf.size == 2 * expected_radius + 1
+    assert rf.alignment == 1
+    assert rf.output_stride == 1.0
+    assert not rf.is_global
+
+# ---------------------------------------------------------------------
+
+
+def test_receptive_field_pooling_upsampling():
+    input_layer = keras.Input(shape=(None, None, 3))
+    x = keras.layers.AveragePooling2D(
+        pool_size=(3, 3), strides=(2, 2), padding="same")(input_layer)
+    x = keras.layers.Conv2D(filters=3, kernel_size=3, padding="same")(x)
+    x = keras.layers.UpSampling2D(size=(2, 2), interpolation="bilinear")(x)
+    x = keras.layers.Add()([x, input_layer])
+    model = keras.Model(inputs=input_layer, outputs=x)
+    rf = bfcnn.receptive_field(model)
+    # pooling 1, conv 1 * 2, bilinear 1 * 2
+    assert rf.radius == 5
+    assert rf.alignment == 2
+    assert rf.output_stride == 1.0
+
+# ---------------------------------------------------------------------
+
+
+def test_receptive_field_global():
+    input_layer = keras.Input(shape=(None, None, 3))
+    g = keras.layers.GlobalAveragePooling2D(keepdims=True)(input_layer)
+    x = keras.layers.Multiply()([input_layer, g])
+    model = keras.Model(inputs=input_layer, outputs=x)
+    assert bfcnn.receptive_field(model).is_global
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", bfcnn.configs)
+def test_receptive_field_bounds_impulse_response(config):
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    rf = bfcnn.receptive_field(models.denoiser)
+    assert rf.alignment >= 1
+    assert rf.output_stride == 1.0
+    if rf.is_global:
+        return
+    # perturb a single pixel and measure how far the output changes
+    size = 2 * rf.radius + 64
+    size = int(np.ceil(size / rf.alignment)) * rf.alignment
+    center = size // 2
+    no_channels = config["model_denoise"]["input_shape"][2]
+    x = \
+        np.random.uniform(
+            low=-0.5,
+            high=+0.5,
+            size=(1, size, size, no_channels)).astype(np.float32)
+    x_perturbed = x.copy()
+    x_perturbed[0, center, center, :] += 0.5
+    y = models.denoiser(x, training=False)
+    y_perturbed = models.denoiser(x_perturbed, training=False)
+    if isinstance(y, list):
+        y = y[0]
+        y_perturbed = y_perturbed[0]
+    diff = np.abs(np.array(y_perturbed) - np.array(y))
+    changed = np.max(diff, axis=(0, 3)) > 1e-6
+    rows, cols = np.nonzero(changed)
+    assert np.max(np.abs(rows - center)) <= rf.radius
+    assert np.max(np.abs(cols - center)) <= rf.radius
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,157 @@
+import pytest
+
+import os
+import sys
+import time
+import threading
+import tensorflow as tf
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.registry import ModelRegistry
+
+# ---------------------------------------------------------------------
+
+
+class FakeLoader:
+    # counts the loads and records the warm-up inputs of every model
+    def __init__(self, delay: float = 0.0, fail: int = 0):
+        self.delay = delay
+        self.fail = fail
+        self.loads = []
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, path: str):
+        time.sleep(self.delay)
+        with self._lock:
+            self.loads.append(path)
+            if self.fail > 0:
+                self.fail -= 1
+                raise IOError(f"cannot load [{path}]")
+
+        def model(x):
+            self.calls.append((path, tuple(x.shape), x.dtype))
+            return x
+        return model
+
+# ---------------------------------------------------------------------
+
+
+def test_registry_threads_share_one_load():
+    loader = FakeLoader(delay=0.2)
+    registry = ModelRegistry(loader=loader)
+    results = [None] * 8
+
+    def get(i):
+        results[i] = registry.get("model")
+
+    threads = [threading.Thread(target=get, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert loader.loads == ["model"]
+    assert all([r is results[0] for r in results])
+    stats = registry.stats()
+    assert stats["loads"] == 1
+    assert stats["hits"] == 7
+    assert stats["models"]["model"]["load_seconds"] >= 0.2
+
+
+def test_registry_warmup():
+    loader = FakeLoader()
+    registry = \
+        ModelRegistry(
+            loader=loader,
+            warmup_shapes=[(1, 64, 64), (4, 128, 96)])
+    registry.get("model")
+    # models without a signature are warmed up as 3 channel uint8
+    assert loader.calls == [
+        ("model", (1, 64, 64, 3), tf.uint8),
+        ("model", (4, 128, 96, 3), tf.uint8)
+    ]
+    registry.get("model")
+    assert len(loader.calls) == 2
+
+
+def test_registry_lru_eviction():
+    loader = FakeLoader()
+    registry = ModelRegistry(max_models=2, loader=loader, warmup_shapes=[])
+    a = registry.get("a")
+    registry.get("b")
+    # a is now the most recently used
+    assert registry.get("a") is a
+    registry.get("c")
+    assert sorted(registry.stats()["models"].keys()) == ["a", "c"]
+    assert registry.stats()["evictions"] == 1
+    registry.get("b")
+    assert loader.loads == ["a", "b", "c", "b"]
+
+
+def test_registry_memory_eviction(tmp_path):
+    # the files of the models count against max_bytes
+    for name, size in [("a", 600), ("b", 600), ("c", 300)]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "variables").write_bytes(b"0" * size)
+    registry = \
+        ModelRegistry(
+            max_models=-1,
+            max_bytes=1000,
+            loader=FakeLoader(),
+            warmup_shapes=[])
+    registry.get(tmp_path / "a")
+    assert registry.stats()["bytes"] == 600
+    registry.get(tmp_path / "b")
+    assert list(registry.stats()["models"].keys()) == [str(tmp_path / "b")]
+    registry.get(tmp_path / "c")
+    assert registry.stats()["bytes"] == 900
+    # a model larger than the budget is still served
+    registry = \
+        ModelRegistry(
+            max_bytes=100,
+            loader=FakeLoader(),
+            warmup_shapes=[])
+    assert registry.get(tmp_path / "a") is not None
+    assert registry.evict(tmp_path / "a")
+
+
+def test_registry_failed_load_retries():
+    loader = FakeLoader(fail=1)
+    registry = ModelRegistry(loader=loader, warmup_shapes=[])
+    with pytest.raises(IOError):
+        registry.get("model")
+    assert registry.stats()["failed"] == 1
+    assert registry.stats()["models"] == {}
+    assert registry.get("model") is not None
+    assert loader.loads == ["model", "model"]
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.skipif(
+    len([m for m in bfcnn.pretrained_models.values()
+         if os.path.isfile(m["tf"])]) < 2,
+    reason="needs two pretrained models")
+def test_pretrained_load_tf_per_model():
+    # every loader loads its own model, once
+    names = [
+        n for n in sorted(bfcnn.pretrained_models.keys())
+        if os.path.isfile(bfcnn.pretrained_models[n]["tf"])
+    ][0:2]
+    models = [bfcnn.pretrained_models[n]["load_tf"]() for n in names]
+    assert models[0] is not models[1]
+    assert bfcnn.load_model(names[0]) is models[0]
+    stats = bfcnn.registry.default_registry().stats()
+    for n in names:
+        path = bfcnn.pretrained_models[n]["saved_model_path"]
+        assert stats["models"][path]["bytes"] > 0
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,210 @@
+import pytest
+
+import os
+import sys
+import json
+import socket
+import tempfile
+import threading
+import http.client
+import numpy as np
+import tensorflow as tf
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.model_denoise import module_denoiser_builder
+from bfcnn.serve import MicroBatcher, DenoiseServer, ServerStats
+
+# ---------------------------------------------------------------------
+
+
+def build_model_fn():
+    config = [
+        c for c in bfcnn.configs
+        if c["model_denoise"]["input_shape"][2] == 3 and
+        "pyramid" not in c["model_denoise"]
+    ][0]
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    module = \
+        module_denoiser_builder(
+            model_denoise=models.denoiser,
+            model_normalize=models.normalizer,
+            model_denormalize=models.denormalizer,
+            training_channels=3)
+    return lambda x: module(x).numpy()
+
+# ---------------------------------------------------------------------
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+# ---------------------------------------------------------------------
+
+
+def test_micro_batcher_groups_same_shapes():
+    batch_sizes = []
+    lock = threading.Lock()
+
+    def model_fn(x):
+        with lock:
+            batch_sizes.append(x.shape[0])
+        return x
+
+    batcher = \
+        MicroBatcher(
+            model_fn=model_fn,
+            max_batch_size=4,
+            max_latency_ms=200,
+            workers=2)
+    images = \
+        [np.full((16, 16, 3), i, dtype=np.uint8) for i in range(8)] + \
+        [np.full((8, 24, 3), i, dtype=np.uint8) for i in range(3)]
+    futures = [batcher.submit(image) for image in images]
+    results = [f.result(timeout=10) for f in futures]
+    batcher.close()
+
+    for image, result in zip(images, results):
+        assert (image == result).all()
+    assert sorted(batch_sizes) == [3, 4, 4]
+    stats = batcher.stats.to_dict()
+    assert stats["completed"] == len(images)
+    assert stats["queue_depth"] == 0
+    assert stats["latency_p99_ms"] >= stats["latency_p50_ms"]
+
+# ---------------------------------------------------------------------
+
+
+def test_micro_batcher_close_races_submit():
+    # close runs while a submit is between its closed check and the put,
+    # the request must still be served and not queued behind the sentinel
+    entered = threading.Event()
+    closed = threading.Event()
+
+    class SlowStats(ServerStats):
+        def enqueued(self):
+            entered.set()
+            closed.wait(timeout=1.0)
+            super().enqueued()
+
+    batcher = \
+        MicroBatcher(
+            model_fn=lambda x: x,
+            max_batch_size=4,
+            max_latency_ms=1,
+            workers=1,
+            stats=SlowStats())
+    futures = []
+    thread = \
+        threading.Thread(
+            target=lambda: futures.append(
+                batcher.submit(np.zeros((4, 4, 3), dtype=np.uint8))))
+    thread.start()
+    entered.wait(timeout=10)
+    batcher.close()
+    closed.set()
+    thread.join()
+    assert futures[0].result(timeout=10).shape == (4, 4, 3)
+    with pytest.raises(RuntimeError):
+        batcher.submit(np.zeros((4, 4, 3), dtype=np.uint8))
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("use_unix_socket", [False, True])
+def test_server_localhost(use_unix_socket):
+    unix_socket = None
+    if use_unix_socket:
+        unix_socket = os.path.join(tempfile.mkdtemp(), "bfcnn.sock")
+    server = \
+        DenoiseServer(
+            model_fn=build_model_fn(),
+            channels=3,
+            port=0,
+            unix_socket=unix_socket,
+            max_batch_size=4,
+            max_latency_ms=50,
+            workers=2).start()
+
+    def connect():
+        if use_unix_socket:
+            return UnixHTTPConnection(server.address)
+        host, port = server.address
+        return http.client.HTTPConnection(host, port)
+
+    images = [
+        np.random.randint(0, 256, size=(64, 96, 3)).astype(np.uint8)
+        for _ in range(6)
+    ]
+    responses = [None] * len(images)
+
+    def send(i):
+        connection = connect()
+        connection.request(
+            "POST", "/denoise",
+            body=tf.io.encode_png(images[i]).numpy(),
+            headers={"Content-Type": "image/png"})
+        response = connection.getresponse()
+        responses[i] = (response.status, response.read())
+        connection.close()
+
+    try:
+        threads = [
+            threading.Thread(target=send, args=(i,))
+            for i in range(len(images))
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=60)
+
+        for image, (status, body) in zip(images, responses):
+            assert status == 200
+            result = tf.io.decode_png(body).numpy()
+            assert result.shape == image.shape
+
+        connection = connect()
+        connection.request("GET", "/stats")
+        response = connection.getresponse()
+        assert response.status == 200
+        stats = json.loads(response.read())
+        connection.close()
+        assert stats["completed"] == len(images)
+        for key in ["throughput_images_per_s",
+                    "queue_depth",
+                    "latency_p50_ms",
+                    "latency_p99_ms"]:
+            assert key in stats
+    finally:
+        server.close()
+
+# ---------------------------------------------------------------------
+
+
+def test_server_close_without_start():
+    server = \
+        DenoiseServer(
+            model_fn=build_model_fn(),
+            channels=3,
+            port=0)
+    # close on a thread so a regression fails instead of hanging
+    thread = threading.Thread(target=server.close, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert server.httpd.socket.fileno() == -1
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,131 @@
+import pytest
+
+import os
+import sys
+import json
+import types
+import pathlib
+import subprocess
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+
+# ---------------------------------------------------------------------
+
+# generous budgets, a cold start is ~0.01 sec for the import
+# and ~3.5 sec for loading a pretrained model (mostly tensorflow),
+# wall clock depends on the load of the machine so these are opt in
+IMPORT_BUDGET_SECONDS = 1.0
+LOAD_MODEL_BUDGET_SECONDS = 10.0
+
+timing = \
+    pytest.mark.skipif(
+        os.environ.get("BFCNN_TIMING_TESTS", "0") != "1",
+        reason="timing tests run with BFCNN_TIMING_TESTS=1")
+
+# training only modules, inference must not import them
+TRAINING_MODULES = [
+    "bfcnn.train_loop",
+    "bfcnn.dataset",
+    "tensorflow_addons"
+]
+
+# ---------------------------------------------------------------------
+
+
+def run_cold(code: str) -> dict:
+    # fresh interpreter, the result is printed as json on the last line
+    output = \
+        subprocess.check_output(
+            [sys.executable, "-c", code],
+            cwd=str(pathlib.Path(bfcnn.__file__).parent.parent),
+            stderr=subprocess.DEVNULL)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+# ---------------------------------------------------------------------
+
+
+def import_startup() -> dict:
+    return run_cold(
+        "import sys, json, time\n"
+        "start = time.perf_counter()\n"
+        "import bfcnn\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': seconds, "
+        "'modules': sorted(sys.modules.keys())}))\n")
+
+
+def load_model_startup() -> dict:
+    model_name = sorted(bfcnn.pretrained_models.keys())[0]
+    return run_cold(
+        "import sys, json, time\n"
+        "start = time.perf_counter()\n"
+        "import bfcnn\n"
+        f"bfcnn.load_model('{model_name}')\n"
+        "seconds = time.perf_counter() - start\n"
+        "print(json.dumps({'seconds': seconds, "
+        "'modules': sorted(sys.modules.keys())}))\n")
+
+# ---------------------------------------------------------------------
+
+
+def test_import_startup():
+    result = import_startup()
+    assert "tensorflow" not in result["modules"]
+    for m in TRAINING_MODULES:
+        assert m not in result["modules"]
+
+
+@pytest.mark.skipif(
+    len(bfcnn.pretrained_models) == 0,
+    reason="no pretrained models")
+def test_load_model_startup():
+    result = load_model_startup()
+    for m in TRAINING_MODULES:
+        assert m not in result["modules"]
+
+
+@timing
+def test_import_startup_budget():
+    assert import_startup()["seconds"] <= IMPORT_BUDGET_SECONDS
+
+
+@timing
+@pytest.mark.skipif(
+    len(bfcnn.pretrained_models) == 0,
+    reason="no pretrained models")
+def test_load_model_startup_budget():
+    assert load_model_startup()["seconds"] <= LOAD_MODEL_BUDGET_SECONDS
+
+# ---------------------------------------------------------------------
+
+
+def test_lazy_attributes():
+    assert len(bfcnn.configs) > 0
+    assert callable(bfcnn.model_builder)
+    assert callable(bfcnn.train_loop)
+    assert bfcnn.dataset.DATASET_FN_STR == "dataset"
+    for name in bfcnn.__all__:
+        assert getattr(bfcnn, name) is not None
+    with pytest.raises(AttributeError):
+        _ = bfcnn.does_not_exist
+
+# ---------------------------------------------------------------------
+
+
+def test_lazy_attributes_named_like_submodules():
+    # the submodules are imported by other modules first
+    import bfcnn.tiling
+    import bfcnn.train
+    assert callable(bfcnn.receptive_field)
+    assert callable(bfcnn.train_loop)
+    assert not isinstance(bfcnn.receptive_field, types.ModuleType)
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,249 @@
+import pytest
+
+import os
+import sys
+import copy
+import time
+import threading
+import numpy as np
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.stream import \
+    StreamingDenoiser, \
+    denoise_stream, \
+    temporal_blend, \
+    TEMPORAL_BLEND, \
+    TEMPORAL_CONCAT
+
+# ---------------------------------------------------------------------
+
+
+def frames_source(n: int, shape=(16, 24, 3), delay: float = 0.0):
+    # frame i is filled with i
+    for i in range(n):
+        if delay > 0:
+            time.sleep(delay)
+        yield np.full(shape, i % 256, dtype=np.uint8)
+
+
+def identity_model(x):
+    return x
+
+
+class FakeClock:
+    # time only moves when the stream sleeps
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        with self._lock:
+            return self.now
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+# ---------------------------------------------------------------------
+
+
+def test_stream_in_order():
+    denoiser = \
+        StreamingDenoiser(
+            model_fn=identity_model,
+            decode_fn=lambda x: x + 1,
+            encode_fn=lambda x: int(x[0, 0, 0]))
+    outputs = list(denoiser.run(frames_source(50)))
+    assert outputs == [i + 1 for i in range(50)]
+    stats = denoiser.stats()
+    assert stats["frames_in"] == 50
+    assert stats["frames_out"] == 50
+    assert stats["dropped"] == 0
+    for stage in ["decode", "denoise", "encode"]:
+        assert stats[f"{stage}_p50_ms"] >= 0.0
+
+
+def test_stream_drops_frames_behind_target_fps():
+    # the model is stuck on the first frame until the source is exhausted,
+    # so every frame that does not fit the queue is dropped
+    release = threading.Event()
+
+    def blocked_model(x):
+        assert release.wait(timeout=10)
+        return x
+
+    def source():
+        yield from frames_source(20)
+        release.set()
+
+    clock = FakeClock()
+    denoiser = \
+        StreamingDenoiser(
+            model_fn=blocked_model,
+            target_fps=200,
+            queue_size=2,
+            clock=clock.time,
+            sleep=clock.sleep)
+    outputs = list(denoiser.run(source()))
+    stats = denoiser.stats()
+    # one frame in the model and two queued survive
+    assert stats["dropped"] >= 17
+    assert stats["frames_out"] == len(outputs)
+    assert stats["frames_in"] == stats["frames_out"] + stats["dropped"]
+    # the surviving frames are still in order
+    values = [int(o[0, 0, 0]) for o in outputs]
+    assert values == sorted(values)
+    assert values[-1] == 19
+
+
+def test_stream_sustains_target_fps():
+    # the fake sleep returns at once, the queue holds the whole source
+    # so nothing is dropped whatever the thread scheduling
+    clock = FakeClock()
+    denoiser = \
+        StreamingDenoiser(
+            model_fn=identity_model,
+            target_fps=100,
+            queue_size=30,
+            clock=clock.time,
+            sleep=clock.sleep)
+    outputs = list(denoiser.run(frames_source(30)))
+    stats = denoiser.stats()
+    assert len(outputs) == 30
+    assert stats["dropped"] == 0
+    # paced at the target rate, one period per frame
+    assert clock.sleeps == pytest.approx([0.01] * 30)
+    assert stats["elapsed_s"] == pytest.approx(0.3)
+
+
+def test_stream_temporal_concat():
+    # the model sees [frame, previous denoised frame]
+    def model(x):
+        assert x.shape[-1] == 6
+        return x[..., 3:6] // 2 + x[..., 0:3] // 2
+
+    outputs = \
+        list(denoise_stream(
+            model_fn=model,
+            frames=frames_source(4, shape=(8, 8, 3)),
+            temporal=TEMPORAL_CONCAT,
+            encode_fn=lambda x: int(x[0, 0, 0])))
+    # 0, (0 + 1) // 2 ... the recurrence over the outputs
+    expected = [0]
+    for i in range(1, 4):
+        expected.append(expected[-1] // 2 + i // 2)
+    assert outputs == expected
+
+
+def test_stream_temporal_blend():
+    rng = np.random.default_rng(0)
+    clean = np.full((32, 32, 3), 128, dtype=np.uint8)
+    noisy = [
+        np.clip(clean + rng.normal(0, 4, size=clean.shape), 0, 255).astype(np.uint8)
+        for _ in range(10)
+    ]
+    outputs = \
+        list(denoise_stream(
+            model_fn=identity_model,
+            frames=iter(noisy),
+            temporal=TEMPORAL_BLEND))
+    # static content is averaged over time
+    error_in = np.mean(np.abs(noisy[-1].astype(np.float32) - clean))
+    error_out = np.mean(np.abs(outputs[-1].astype(np.float32) - clean))
+    assert error_out < error_in
+    # a change of resolution starts a new sequence
+    outputs = \
+        list(denoise_stream(
+            model_fn=identity_model,
+            frames=iter([clean, np.zeros((8, 8, 3), np.uint8)]),
+            temporal=TEMPORAL_BLEND))
+    assert np.array_equal(outputs[1], np.zeros((8, 8, 3), np.uint8))
+
+
+def test_temporal_blend_keeps_motion():
+    previous = np.zeros((4, 4, 3), dtype=np.uint8)
+    moving = np.full((4, 4, 3), 200, dtype=np.uint8)
+    assert np.array_equal(temporal_blend(moving, previous), moving)
+    still = np.full((4, 4, 3), 2, dtype=np.uint8)
+    assert np.all(temporal_blend(still, previous) < 2)
+
+# ---------------------------------------------------------------------
+
+
+def test_stream_errors_and_early_stop():
+    def failing_model(x):
+        if x[0, 0, 0, 0] == 5:
+            raise RuntimeError("model failed")
+        return x
+
+    with pytest.raises(RuntimeError):
+        list(denoise_stream(model_fn=failing_model, frames=frames_source(20)))
+
+    # the consumer stops early, the stage threads exit
+    stream = denoise_stream(model_fn=identity_model, frames=frames_source(1000))
+    assert int(next(stream)[0, 0, 0]) == 0
+    stream.close()
+
+    with pytest.raises(ValueError):
+        StreamingDenoiser(model_fn=identity_model, temporal="unknown")
+
+# ---------------------------------------------------------------------
+
+
+def test_stream_temporal_concat_model():
+    # a resnet built with temporal_context takes the concatenated frames
+    config = copy.deepcopy([
+        c for c in bfcnn.configs
+        if c["model_denoise"]["type"] == "resnet" and
+        "pyramid" not in c["model_denoise"]
+    ][0]["model_denoise"])
+    config["temporal_context"] = True
+    no_channels = config["input_shape"][2]
+    models = bfcnn.model_builder(config=config)
+
+    def model_fn(x):
+        x = models.normalizer(x.astype(np.float32), training=False)
+        y = models.denoiser(x, training=False)
+        if isinstance(y, list):
+            y = y[0]
+        y = models.denormalizer(y, training=False).numpy()
+        return np.clip(np.round(y), 0, 255).astype(np.uint8)
+
+    outputs = \
+        list(denoise_stream(
+            model_fn=model_fn,
+            frames=frames_source(3, shape=(32, 32, no_channels)),
+            temporal=TEMPORAL_CONCAT))
+    assert len(outputs) == 3
+    assert outputs[0].shape == (32, 32, no_channels)
+    assert outputs[0].dtype == np.uint8
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.skipif(
+    len(bfcnn.pretrained_models) == 0,
+    reason="no pretrained models")
+def test_stream_pretrained():
+    model_name = sorted(bfcnn.pretrained_models.keys())[0]
+    model = bfcnn.load_model(model_name)
+    outputs = \
+        list(denoise_stream(
+            model_fn=model,
+            frames=frames_source(3, shape=(64, 64, 3)),
+            temporal=TEMPORAL_BLEND))
+    assert len(outputs) == 3
+    assert outputs[0].shape == (64, 64, 3)
+    assert outputs[0].dtype == np.uint8
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,119 @@
+import pytest
+
+import os
+import sys
+import threading
+import numpy as np
+import tensorflow as tf
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.tflite_runner import TFLiteRunner
+
+# ---------------------------------------------------------------------
+
+
+def invert_tflite_model() -> bytes:
+    # uint8 [B, H, W, 3] -> 255 - x, any shape
+    @tf.function(
+        input_signature=[
+            tf.TensorSpec(shape=[None, None, None, 3], dtype=tf.uint8)])
+    def invert(x):
+        return tf.cast(255 - tf.cast(x, tf.int32), tf.uint8)
+
+    converter = \
+        tf.lite.TFLiteConverter.from_concrete_functions(
+            [invert.get_concrete_function()], invert)
+    return converter.convert()
+
+# ---------------------------------------------------------------------
+
+
+def test_tflite_runner_shapes():
+    runner = TFLiteRunner(model_content=invert_tflite_model())
+    assert runner.channels == 3
+    for shape in [(1, 16, 16, 3), (2, 16, 16, 3), (1, 8, 24, 3), (1, 8, 24, 3)]:
+        x = np.random.randint(0, 255, size=shape, dtype=np.uint8)
+        y = runner(x)
+        assert y.shape == shape
+        assert np.array_equal(y, 255 - x)
+    # tensors and floats are cast to the input dtype
+    x = tf.zeros((1, 4, 4, 3), dtype=tf.float32)
+    assert np.all(runner(x) == 255)
+
+
+def test_tflite_runner_out_buffer():
+    runner = TFLiteRunner(model_content=invert_tflite_model())
+    x = np.random.randint(0, 255, size=(1, 16, 16, 3), dtype=np.uint8)
+    out = np.zeros_like(x)
+    first = runner(x)
+    assert runner(x, out=out) is out
+    assert np.array_equal(out, 255 - x)
+    # results are not views of the interpreter buffers
+    runner(np.zeros_like(x))
+    assert np.array_equal(first, 255 - x)
+
+
+@pytest.mark.parametrize("max_interpreters", [-1, 2])
+def test_tflite_runner_threads(max_interpreters):
+    runner = \
+        TFLiteRunner(
+            model_content=invert_tflite_model(),
+            max_interpreters=max_interpreters)
+    errors = []
+
+    def work(i):
+        rng = np.random.default_rng(i)
+        for j in range(20):
+            shape = (1, 8 + (i + j) % 3, 16, 3)
+            x = rng.integers(0, 255, size=shape, dtype=np.uint8)
+            if not np.array_equal(runner(x), 255 - x):
+                errors.append((i, j))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    stats = runner.stats()
+    assert stats["idle"] == stats["interpreters"]
+    if max_interpreters > 0:
+        assert stats["interpreters"] <= max_interpreters
+
+
+def test_tflite_runner_arguments():
+    with pytest.raises(ValueError):
+        TFLiteRunner()
+    with pytest.raises(ValueError):
+        TFLiteRunner(model_path="does_not_exist.tflite")
+    with pytest.raises(ValueError):
+        TFLiteRunner(model_content=invert_tflite_model(), max_interpreters=0)
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.skipif(
+    len(bfcnn.pretrained_models) == 0,
+    reason="no pretrained models")
+def test_pretrained_tflite():
+    # the tflite model agrees with the saved_model
+    model_name = sorted(bfcnn.pretrained_models.keys())[0]
+    model_structure = bfcnn.pretrained_models[model_name]
+    runner = model_structure["load_tflite"]()
+    model = model_structure["load_tf"]()
+    x = np.random.randint(0, 255, size=(1, 64, 96, 3), dtype=np.uint8)
+    y = runner(x)
+    assert y.shape == x.shape
+    assert y.dtype == np.uint8
+    assert np.mean(np.abs(
+        y.astype(np.float32) - model(x).numpy().astype(np.float32))) < 1.0
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,114 @@
+import pytest
+
+import os
+import sys
+import numpy as np
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.model_denoise import module_denoiser_builder
+from bfcnn.tiling import \
+    tile_ranges, \
+    blend_weights, \
+    tiled_denoiser_builder, \
+    receptive_field_from_config
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "size,tile_size,halo,alignment", [
+        (100, 32, 0, 1),
+        (100, 32, 8, 1),
+        (128, 32, 12, 4),
+        (17, 32, 8, 4)])
+def test_tile_ranges(size, tile_size, halo, alignment):
+    ranges = tile_ranges(size, tile_size, halo, alignment)
+    # cores partition the dimension
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == size
+    for previous, current in zip(ranges[:-1], ranges[1:]):
+        assert previous[1] == current[0]
+    # windows contain their cores and are aligned
+    for core_start, core_end, window_start, window_end in ranges:
+        assert window_start <= core_start
+        assert window_end >= core_end
+        assert window_start % alignment == 0
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "length,ramp_start,ramp_end", [(32, 0, 0), (32, 8, 8), (16, 4, 0)])
+def test_blend_weights(length, ramp_start, ramp_end):
+    w = blend_weights(length, ramp_start, ramp_end)
+    assert w.shape == (length,)
+    assert (w > 0).all()
+    assert (w <= 1).all()
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "config", bfcnn.configs)
+def test_tiled_inference_matches_untiled(config):
+    models = bfcnn.model_builder(config=config["model_denoise"])
+    no_channels = config["model_denoise"]["input_shape"][2]
+    module = \
+        module_denoiser_builder(
+            model_denoise=models.denoiser,
+            model_normalize=models.normalizer,
+            model_denormalize=models.denormalizer,
+            training_channels=no_channels)
+    image = \
+        np.random.randint(
+            low=0,
+            high=256,
+            size=(1, 128, 192, no_channels)).astype(np.uint8)
+    untiled = module(image).numpy()
+    tiled_fn = \
+        tiled_denoiser_builder(
+            model_fn=lambda x: module(x).numpy(),
+            config=config,
+            tile_size=32,
+            batch_size=3)
+    tiled = tiled_fn(image)
+    assert tiled.shape == untiled.shape
+    assert tiled.dtype == untiled.dtype
+    diff = np.abs(tiled.astype(np.float32) - untiled.astype(np.float32))
+    assert np.mean(diff) < 0.5
+    assert np.max(diff) <= 8
+
+# ---------------------------------------------------------------------
+
+
+def test_tiled_denoiser_global_receptive_field():
+    # exported pipeline of a model that normalizes over the whole image
+    config = {
+        "model_denoise": bfcnn.configs[0]["model_denoise"],
+        "receptive_field": {
+            "radius": 12,
+            "size": 25,
+            "alignment": 1,
+            "output_stride": 1.0,
+            "is_global": True
+        }
+    }
+    with pytest.raises(ValueError):
+        receptive_field_from_config(config)
+    with pytest.raises(ValueError):
+        tiled_denoiser_builder(model_fn=lambda x: x, config=config)
+    with pytest.raises(ValueError):
+        tiled_denoiser_builder(model_fn=lambda x: x, config=config, halo=16)
+    config["receptive_field"]["is_global"] = False
+    assert receptive_field_from_config(config) == 12
+    assert tiled_denoiser_builder(model_fn=lambda x: x, config=config) is not None
+
+# ---------------------------------------------------------------------
@@ -0,0 +1,216 @@
+import pytest
+
+import os
+import sys
+import copy
+import json
+import socket
+import pathlib
+import tempfile
+import subprocess
+import tensorflow as tf
+
+from .constants import *
+
+sys.path.append(os.getcwd() + "/../")
+
+# ---------------------------------------------------------------------
+# local imports
+# ---------------------------------------------------------------------
+
+import bfcnn
+from bfcnn.train_loop import train_loop
+
+# ---------------------------------------------------------------------
+
+
+def build_train_config(pyramid: bool = True, **train_params):
+    config = copy.deepcopy([
+        c for c in bfcnn.configs
+        if c["model_denoise"]["input_shape"][2] == 3 and
+        ("pyramid" in c["model_denoise"]) == pyramid
+    ][0])
+    config["dataset"]["batch_size"] = 2
+    config["dataset"]["input_shape"] = [64, 64, 3]
+    config["dataset"]["inputs"] = [{
+        "dataset_shape": [128, 384],
+        "directory": str(KITTI_DIR)
+    }]
+    config["train"]["epochs"] = 1
+    config["train"]["total_steps"] = 4
+    config["train"]["checkpoint_every"] = -1
+    config["train"]["visualization_every"] = 2
+    config["train"]["visualization_number"] = 2
+    config["train"]["random_batch_iterations"] = 1
+    config["train"]["random_batch_size"] = [64, 64, 3]
+    config["train"].update(train_params)
+    return config
+
+# ---------------------------------------------------------------------
+
+
+def checkpoint_step(model_dir) -> int:
+    return int(
+        tf.train.load_variable(
+            tf.train.latest_checkpoint(model_dir),
+            "step/.ATTRIBUTES/VARIABLE_VALUE"))
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("pyramid", [False, True])
+@pytest.mark.parametrize("jit_compile", [False, True])
+def test_train_loop(pyramid, jit_compile):
+    model_dir = tempfile.mkdtemp()
+    train_loop(
+        pipeline_config_path=build_train_config(
+            pyramid=pyramid,
+            jit_compile=jit_compile),
+        model_dir=model_dir)
+    assert os.path.isfile(os.path.join(model_dir, "checkpoint"))
+    assert checkpoint_step(model_dir) == 4
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("steps_per_execution", [2, 3])
+def test_train_loop_steps_per_execution(steps_per_execution):
+    model_dir = tempfile.mkdtemp()
+    # 19 images in batches of 2 are 10 steps per epoch,
+    # so 23 steps cross two epochs with a partial execution
+    train_loop(
+        pipeline_config_path=build_train_config(
+            pyramid=False,
+            epochs=3,
+            total_steps=23,
+            steps_per_execution=steps_per_execution),
+        model_dir=model_dir)
+    assert checkpoint_step(model_dir) == 23
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("distribute", [None, "mirrored"])
+def test_train_loop_noise_in_pipeline(distribute):
+    model_dir = tempfile.mkdtemp()
+    config = \
+        build_train_config(
+            pyramid=False,
+            steps_per_execution=2,
+            distribute=distribute)
+    config["dataset"]["noise_in_pipeline"] = True
+    config["dataset"]["prefetch_buffer_size"] = -1
+    train_loop(
+        pipeline_config_path=config,
+        model_dir=model_dir)
+    assert checkpoint_step(model_dir) == 4
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("mixed_precision", ["mixed_bfloat16", "mixed_float16"])
+def test_train_loop_mixed_precision(mixed_precision):
+    model_dir = tempfile.mkdtemp()
+    train_loop(
+        pipeline_config_path=build_train_config(
+            pyramid=True,
+            mixed_precision=mixed_precision),
+        model_dir=model_dir)
+    assert checkpoint_step(model_dir) == 4
+    assert tf.keras.mixed_precision.global_policy().name == "float32"
+
+# ---------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("gradient_accumulation_steps", [2, 3])
+def test_train_loop_gradient_accumulation(gradient_accumulation_steps):
+    model_dir = tempfile.mkdtemp()
+    train_loop(
+        pipeline_config_path=build_train_config(
+            pyramid=False,
+            epochs=3,
+            total_steps=23,
+            steps_per_execution=2,
+            gradient_accumulation_steps=gradient_accumulation_steps),
+        model_dir=model_dir)
+    assert checkpoint_step(model_dir) == 23
+    # a single update every gradient_accumulation_steps micro batches,
+    # accumulation carries over the epoch boundaries
+    iterations = \
+        tf.train.load_variable(
+            tf.train.latest_checkpoint(model_dir),
+            "optimizer/_iterations/.ATTRIBUTES/VARIABLE_VALUE")
+    assert iterations == 23 // gradient_accumulation_steps
+
+    # a resumed run completes the partial accumulation of the checkpoint
+    total_steps = 23 + gradient_accumulation_steps - 23 % gradient_accumulation_steps
+    train_loop(
+        pipeline_config_path=build_train_config(
+            pyramid=False,
+            epochs=4,
+            total_steps=total_steps,
+            steps_per_execution=2,
+            gradient_accumulation_steps=gradient_accumulation_steps),
+        model_dir=model_dir)
+    assert checkpoint_step(model_dir) == total_steps
+    checkpoint = tf.train.latest_checkpoint(model_dir)
+    assert tf.train.load_variable(
+        checkpoint,
+        "optimizer/_iterations/.ATTRIBUTES/VARIABLE_VALUE") == \
+        total_steps // gradient_accumulation_steps
+    assert tf.train.load_variable(
+        checkpoint,
+        "accumulated_steps/.ATTRIBUTES/VARIABLE_VALUE") == total_steps
+
+# ---------------------------------------------------------------------
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.parametrize("no_workers", [2])
+@pytest.mark.parametrize("gradient_accumulation_steps", [1, 2])
+def test_train_loop_multi_worker(no_workers, gradient_accumulation_steps):
+    model_dir = tempfile.mkdtemp()
+    # 19 images in global batches of 2, the 4 steps stay in the first epoch
+    config = \
+        build_train_config(
+            pyramid=False,
+            epochs=2,
+            distribute="multi_worker_mirrored",
+            gradient_accumulation_steps=gradient_accumulation_steps)
+    config_path = os.path.join(tempfile.mkdtemp(), "pipeline.json")
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+
+    # local processes form the cluster
+    cluster = {
+        "worker": [f"localhost:{free_port()}" for _ in range(no_workers)]
+    }
+    processes = []
+    for i in range(no_workers):
+        env = dict(os.environ)
+        env["TF_CONFIG"] = json.dumps({
+            "cluster": cluster,
+            "task": {"type": "worker", "index": i}
+        })
+        processes.append(
+            subprocess.Popen(
+                [sys.executable, "-m", "bfcnn.train",
+                 "--pipeline-config", config_path,
+                 "--model-directory", model_dir],
+                env=env,
+                cwd=str(pathlib.Path(bfcnn.__file__).parent.parent)))
+    for p in processes:
+        assert p.wait(timeout=900) == 0
+
+    assert checkpoint_step(model_dir) == 4
+    # non chief workers clean up after themselves
+    assert not any([
+        d.startswith("worker_tmp") for d in os.listdir(model_dir)
+    ])
+
+# ---------------------------------------------------------------------